@@ -7,42 +7,66 @@ prepare_train_test_with_ase_final.py
 功能：
 1) 用户只给若干 root 目录；程序递归遍历所有层级，寻找 basename 以 frame 开头的目录；
 2) frame 目录下若无可用 OUTCAR 或 OUTCAR 解析失败 -> 忽略并输出，写 ignored_frames.txt；
-3) 仅从 OUTCAR 提取结构/能量/力/virial(stress*vol)；不再使用 CONTCAR/POSCAR 作为 fallback；
+3) 仅从 OUTCAR（可为 .gz/.xz/.zst 压缩，或 pack_frames.py 归档中的成员）提取结构/能量/力/virial(stress*vol)；不再使用 CONTCAR/POSCAR 作为 fallback；
+   --backend vasprun（或 --root_backend ROOT=vasprun 只对某些 root）改为流式解析 vasprun.xml，
+   vasprun 缺失/被截断时回退到 OUTCAR，source 记为 vasprun:<name>；
+   默认只取最后一个离子步；--ionic_steps all 时流式取出 AIMD/弛豫 OUTCAR 的每一步
+   （可配合 --stride / --min_de），source 记为 OUTCAR:<name>@<step>，并写 ionic_step 字段；
 4) 按“每个 root 单独抽 test_fraction”划分 train/test（抽样随机，但写入顺序保持原排序）。
 输出：
-- train.xyz / test.xyz (extxyz)
+- train.xyz / test.xyz (extxyz；文件名以 .gz/.zst 结尾时写分块压缩 extxyz，可按帧随机读取)
 - mapping_log.csv
 - ignored_frames.txt
+- （可选）--stats_json：分阶段计时/计数报告；--profile：cProfile 数据
+输出随读随写（追加），并周期性写原子 checkpoint；中断后加 --resume 可从断点继续，
+最终结果与不中断运行逐字节一致。
+- （可选）--bucket_batch N：结束后用 bucket_order.py 把 train 按原子数/组成重排成 N 帧一桶（桶内分层洗牌），
+  mapping_log.csv 的 train 行同步重排。
+- （可选）--worker I/M：分布式 map 阶段，只处理分给第 I 个（0 起）worker 的 root（--assign root）
+  或按 frame 目录哈希分配的 frame（--assign hash），输出写到 --shard_dir 下自己的分片；
+  全部 worker 结束后用 reduce_shards.py 按规范顺序流式拼接，结果与单进程运行逐字节一致。
+  各 worker 只需共享文件系统（每个 worker 都遍历全部 root，以复现同样的 train/test 抽样）。
+- （可选）--shard_frames / --shard_bytes：train/test 写成按帧数/未压缩字节数封顶的分片
+  （<stem>_shards/ 下，带 manifest.json，见 xyz_shards.py），需要单文件时用 concat_shards.py 拼回；
+  mapping_log.csv 仍为单个文件，行序与依次拼接各分片的帧序相同。
 """
 
 import os
 import glob
+import json
+import time
 import random
 import argparse
 import numpy as np
 from ase import io
 
-DEFAULT_OUTCAR_GLOBS = ("OUTCAR", "OUTCAR_*")
+from merge_stats import MergeStats, NULL_STATS
+from frame_crawler import crawl_roots, is_outcar_name, pick_outcar
+from compressed_io import open_text, open_binary, file_size, compression_of, ARCHIVE_SEP
+from outcar_stream import iter_ionic_steps
+from vasprun_stream import iter_calculations, read_last_calculation, is_complete, VasprunTruncated
+from block_xyz import open_xyz_writer, write_json_atomic, INDEX_SUFFIX
+from xyz_shards import ShardedXYZWriter, shard_file, shard_dir_for, split_name, parse_size
+from frame_record import FrameRecord
+from bucket_order import reorder_file
+from reduce_shards import (parse_worker, shard_path, owner, SHARD_FILES, SHARD_META,
+                           SHARD_VERSION, ASSIGN_MODES)
 
+DEFAULT_OUTCAR_GLOBS = ("OUTCAR", "OUTCAR.*", "OUTCAR_*")
+BACKENDS = ("outcar", "vasprun")
 
-def find_frame_dirs_under_root(root: str, prefix: str = "frame") -> list[str]:
-    """在单个 root 下递归查找 basename 以 prefix 开头的目录。"""
-    root = os.path.abspath(root)
-    frame_dirs: list[str] = []
-    if not os.path.isdir(root):
-        return frame_dirs
-    for dirpath, dirnames, _ in os.walk(root):
-        if os.path.basename(dirpath).startswith(prefix):
-            frame_dirs.append(dirpath)
-    return sorted(set(frame_dirs))
 
-
-def choose_outcar(frame_dir: str) -> str | None:
+def choose_outcar(frame_dir: str, stats=NULL_STATS) -> str | None:
     """
     在 frame_dir 下选一个 OUTCAR：
-    - 优先 OUTCAR
-    - 否则在 OUTCAR_* 中选“最新修改时间”的一个
+    - 优先 OUTCAR，其次 OUTCAR.gz/.xz/.zst
+    - 否则在 OUTCAR_*（可压缩）中选“最新修改时间”的一个
     """
+    with stats.stage("choose_outcar"):
+        return _choose_outcar(frame_dir)
+
+
+def _choose_outcar(frame_dir: str) -> str | None:
     exact = os.path.join(frame_dir, "OUTCAR")
     if os.path.exists(exact):
         return exact
@@ -50,16 +74,13 @@ def choose_outcar(frame_dir: str) -> str | None:
     candidates = []
     for pat in DEFAULT_OUTCAR_GLOBS:
         candidates.extend(glob.glob(os.path.join(frame_dir, pat)))
-    candidates = [c for c in candidates if os.path.isfile(c)]
-    if not candidates:
-        return None
-
-    candidates.sort(key=lambda p: os.path.getmtime(p), reverse=True)
-    return candidates[0]
-
+    candidates = [[os.path.basename(c), 0, os.path.getmtime(c)] for c in candidates
+                  if os.path.isfile(c) and is_outcar_name(os.path.basename(c))]
+    name = pick_outcar(candidates)
+    return os.path.join(frame_dir, name) if name else None
 
 
-def parse_last_virial_from_outcar(outcar_path: str) -> np.ndarray | None:
+def parse_last_virial_from_outcar(outcar_path: str, stats=NULL_STATS) -> np.ndarray | None:
     """
     从 OUTCAR 中解析最后一个“FORCE on cell =-STRESS”块的 Total 行（单位通常是 eV）。
     VASP 常见顺序：XX YY ZZ XY YZ ZX
@@ -70,10 +91,11 @@ def parse_last_virial_from_outcar(outcar_path: str) -> np.ndarray | None:
     解析失败返回 None。
     """
     try:
-        with open(outcar_path, "r", errors="ignore") as f:
+        with open_text(outcar_path) as f:
             lines = f.readlines()
     except Exception:
         return None
+    stats.count("files_opened")
 
     starts = [i for i, l in enumerate(lines) if "FORCE on cell =-STRESS" in l]
     if not starts:
@@ -103,19 +125,38 @@ def parse_last_virial_from_outcar(outcar_path: str) -> np.ndarray | None:
     return vir
 
 
-def read_frame_prefer_outcar(frame_dir: str):
+def _read_last_image(outcar: str):
+    """普通 OUTCAR 直接交给 ASE（index=-1）；压缩流/归档成员不可随机 seek，改为流式迭代取最后一帧。"""
+    if compression_of(outcar) is None and os.path.isfile(outcar):
+        return io.read(outcar, format="vasp-out", index=-1)
+    atoms = None
+    with open_text(outcar) as fh:
+        for atoms in io.iread(fh, format="vasp-out", index=":"):
+            pass
+    if atoms is None:
+        raise ValueError("no complete ionic step in OUTCAR")
+    return atoms
+
+
+def read_frame_prefer_outcar(frame_dir: str, stats=NULL_STATS, outcar: str | None = None):
     """
     只从 OUTCAR（ASE vasp-out, index=-1 取最后一步）读取结构/能量/力；
     并从 OUTCAR 解析 virial（FORCE on cell =-STRESS 的 Total）。
     若 OUTCAR 不存在或解析失败，抛异常，由上层忽略该 frame_dir。
-    返回：(atoms, source_tag)。
+    outcar 已由 crawler 选好时直接传入，省去再次 glob。
+    返回：(FrameRecord, source_tag)；ASE 的 Atoms 只在这里短暂存在。
     """
-    outcar = choose_outcar(frame_dir)
+    if outcar is None:
+        outcar = choose_outcar(frame_dir, stats=stats)
     if outcar is None:
         raise FileNotFoundError("OUTCAR not found")
 
     try:
-        atoms = io.read(outcar, format="vasp-out", index=-1)
+        if stats.enabled:
+            stats.count("files_opened")
+            stats.count("bytes_read", file_size(outcar))
+        with stats.stage("ase_parse"):
+            atoms = _read_last_image(outcar)
 
         # 尽量从 atoms.calc 取能量/力；取不到则置零
         try:
@@ -127,67 +168,233 @@ def read_frame_prefer_outcar(frame_dir: str):
         except Exception:
             forces = np.zeros((len(atoms), 3), dtype=float)
 
-        atoms.info["energy"] = energy
-        atoms.arrays["forces"] = forces
+        with stats.stage("virial_parse"):
+            vir = parse_last_virial_from_outcar(outcar, stats=stats)
+        if stats.enabled:
+            stats.count("bytes_read", file_size(outcar))
 
-        vir = parse_last_virial_from_outcar(outcar)
-        atoms.info["virial"] = vir if vir is not None else np.zeros((3, 3), dtype=float)
-
-        return atoms, f"OUTCAR:{os.path.basename(outcar)}"
+        rec = FrameRecord.from_atoms(atoms, energy=energy, forces=forces, virial=vir)
+        return rec, f"OUTCAR:{os.path.basename(outcar)}"
     except Exception as e:
         raise RuntimeError(f"OUTCAR parse failed: {type(e).__name__}: {e}") from e
 
 
-def write_extended_xyz(atoms_list, filename: str):
+def iter_ionic_frames(frame_dir: str, outcar: str, stride: int = 1, min_de: float | None = None,
+                      include_last: bool = False, stats=NULL_STATS):
+    """
+    单次顺序扫描 OUTCAR，逐个产出被选中离子步的 (FrameRecord, source_tag)；
+    每步带自己的能量、力和 FORCE on cell virial，record.ionic_step 为步序号。
     """
-    写 extxyz（Properties=species,pos,forces），并写入 energy、Virial、pbc、root/frame/source。
-    注意：这里的 Virial 直接写 OUTCAR 的 “FORCE on cell =-STRESS ... units (eV)” Total（通常已是应力*体积形式）。
+    if stats.enabled:
+        stats.count("files_opened")
+        stats.count("bytes_read", file_size(outcar))
+    name = os.path.basename(outcar)
+    with open_text(outcar) as f:
+        steps = iter_ionic_steps(f, stride=stride, min_de=min_de, include_last=include_last)
+        while True:
+            with stats.stage("ionic_parse"):
+                st = next(steps, None)
+            if st is None:
+                return
+            yield FrameRecord.from_step(st, ionic_step=st["index"]), f"OUTCAR:{name}@{st['index']}"
+
+
+def iter_vasprun_frames(vasprun: str, ionic_steps: str = "last", stride: int = 1,
+                        min_de: float | None = None, include_last: bool = False,
+                        stats=NULL_STATS):
     """
-    with open(filename, "w") as f:
-        for atoms in atoms_list:
-            n = len(atoms)
-            f.write(f"{n}\n")
-
-            cell = atoms.get_cell()
-            a, b, c = cell[0], cell[1], cell[2]
-            lattice_flat = [a[0], a[1], a[2], b[0], b[1], b[2], c[0], c[1], c[2]]
-            lattice_str = " ".join(f"{x:.14g}" for x in lattice_flat)
-
-            energy = float(atoms.info.get("energy", 0.0))
-            vir = atoms.info.get("virial", np.zeros((3, 3), dtype=float))
-            vir_flat = [vir[i, j] for i in range(3) for j in range(3)]
-            vir_str = " ".join(f"{x:.14g}" for x in vir_flat)
-
-            pbc = atoms.get_pbc()
-            pbc_str = " ".join("T" if v else "F" for v in pbc)
-
-            root_folder = atoms.info.get("root_folder", "")
-            frame_folder = atoms.info.get("frame_folder", "")
-            frame_dir = atoms.info.get("frame_dir", "")
-            source = atoms.info.get("source", "")
-
-            second_line = (
-                f'Lattice="{lattice_str}" '
-                f'Properties=species:S:1:pos:R:3:forces:R:3 '
-                f'energy={energy:.8f} '
-                f'Virial="{vir_str}" '
-                f'pbc="{pbc_str}" '
-                f'root="{root_folder}" '
-                f'frame="{frame_folder}" '
-                f'frame_dir="{frame_dir}" '
-                f'source="{source}"'
-            )
-            f.write(second_line + "\n")
-
-            positions = atoms.get_positions()
-            forces = atoms.arrays.get("forces", np.zeros((n, 3), dtype=float))
-            symbols = atoms.get_chemical_symbols()
-
-            for sym, pos, frc in zip(symbols, positions, forces):
-                f.write(
-                    f"{sym} {pos[0]:.8f} {pos[1]:.8f} {pos[2]:.8f} "
-                    f"{frc[0]:.8f} {frc[1]:.8f} {frc[2]:.8f}\n"
-                )
+    从 vasprun.xml 流式读取：ionic_steps="last" 只产出最后一个 calculation，
+    "all" 按 stride/min_de/include_last 选步。文件不完整时抛 VasprunTruncated。
+    """
+    if stats.enabled:
+        stats.count("files_opened")
+        stats.count("bytes_read", file_size(vasprun))
+    name = os.path.basename(vasprun)
+    if ionic_steps == "last":
+        with stats.stage("vasprun_parse"):
+            st = read_last_calculation(vasprun)
+        yield FrameRecord.from_step(st), f"vasprun:{name}"
+        return
+    if is_complete(vasprun) is False:
+        raise VasprunTruncated("vasprun.xml has no closing </modeling>")
+    with open_binary(vasprun) as f:
+        steps = iter_calculations(f, stride=stride, min_de=min_de, include_last=include_last)
+        while True:
+            with stats.stage("vasprun_parse"):
+                st = next(steps, None)
+            if st is None:
+                return
+            yield FrameRecord.from_step(st, ionic_step=st["index"]), f"vasprun:{name}@{st['index']}"
+
+
+def harvest_frames(frame_dir: str, outcar: str | None, vasprun: str | None, backend: str,
+                   args, stats=NULL_STATS):
+    """
+    按 backend 产出 frame_dir 的 (FrameRecord, source_tag)：
+    - outcar：只读 OUTCAR（默认）；
+    - vasprun：优先 vasprun.xml；vasprun 缺失，或在产出任何一步之前发现截断/解析失败时回退到 OUTCAR。
+    """
+    if backend == "vasprun" and vasprun is not None:
+        n = 0
+        try:
+            for item in iter_vasprun_frames(vasprun, args.ionic_steps, args.stride, args.min_de,
+                                            args.include_last, stats=stats):
+                n += 1
+                yield item
+            return
+        except (ValueError, OSError, EOFError) as e:
+            if n or outcar is None:
+                raise
+            print(f"[FALLBACK] (vasprun unusable, using OUTCAR) {frame_dir} :: {e}")
+            stats.count("vasprun_fallback")
+    if outcar is None:
+        raise FileNotFoundError("OUTCAR not found")
+    if args.ionic_steps == "all":
+        yield from iter_ionic_frames(frame_dir, outcar, stride=args.stride, min_de=args.min_de,
+                                     include_last=args.include_last, stats=stats)
+    else:
+        yield read_frame_prefer_outcar(frame_dir, stats=stats, outcar=outcar)
+
+
+CHECKPOINT_VERSION = 1
+MAPPING_HEADER = "split,root,frame_dir,source\n"
+
+
+class MergeOutputs:
+    """
+    train/test/mapping/ignored 四个输出文件，随读随写（追加）。
+    resume 时先截断到 checkpoint 记录的大小再继续追加，丢掉断点之后写了一半的内容。
+    train/test 以 .gz/.zst 结尾时写分块压缩 extxyz（见 block_xyz.py），
+    checkpoint 里额外记录未写满的块，resume 后块边界与不中断时一致。
+    shards 给出某个 split 的分片参数（max_frames / max_bytes / jobs / meta）时，该 split 写成
+    <stem>_shards/ 下的封顶分片（见 xyz_shards.ShardedXYZWriter），checkpoint 记录分片写者的状态。
+    """
+
+    XYZ_KEYS = ("train", "test")
+    UNIT_KEYS = ("train", "test", "mapping", "ignored")
+
+    def __init__(self, out_train: str, out_test: str, mapping: str = "mapping_log.csv",
+                 ignored: str = "ignored_frames.txt", sizes: dict | None = None,
+                 frames_per_block: int = 256, units: str | None = None, shards: dict | None = None):
+        self.paths = {"train": out_train, "test": out_test, "mapping": mapping, "ignored": ignored}
+        # worker 分片：units 文件逐个记录每个处理单元（root 序号, 阶段, 序号）在四个输出里写了多少字节，
+        # mapping 不写表头（由 reduce_shards.py 写一次）
+        if units is not None:
+            self.paths["units"] = units
+        self._unit = None
+        self.files = {}
+        for key, path in self.paths.items():
+            if key in self.XYZ_KEYS and shards and key in shards:
+                opts = shards[key]
+                name, suffix = split_name(path)
+                self.files[key] = ShardedXYZWriter(shard_dir_for(path), name, suffix, opts["max_frames"],
+                                                   opts["max_bytes"], frames_per_block, opts["jobs"],
+                                                   opts["meta"], resume_state=None if sizes is None else sizes[key])
+            elif key in self.XYZ_KEYS:
+                self.files[key] = open_xyz_writer(path, frames_per_block,
+                                                  resume_state=None if sizes is None else sizes[key])
+            elif sizes is None:
+                self.files[key] = open(path, "w")
+            else:
+                with open(path, "r+b") as fb:
+                    fb.truncate(sizes[key])
+                self.files[key] = open(path, "a")
+        if sizes is None and units is None:
+            self.files["mapping"].write(MAPPING_HEADER)
+
+    def begin_unit(self, root_index: int, stage: int, index: int):
+        if "units" in self.files:
+            self._unit = [root_index, stage, index] + [0] * len(self.UNIT_KEYS)
+
+    def end_unit(self):
+        if self._unit is not None:
+            self.files["units"].write(" ".join(map(str, self._unit)) + "\n")
+            self._unit = None
+
+    def _count(self, key: str, nbytes: int):
+        if self._unit is not None:
+            self._unit[3 + self.UNIT_KEYS.index(key)] += nbytes
+
+    def write_frame(self, split: str, rec: FrameRecord, root: str, frame_dir: str, source: str):
+        data = rec.to_xyz().encode()
+        self.files[split].write_frame(data)
+        line = f"{split},{root},{frame_dir},{source}\n"
+        self.files["mapping"].write(line)
+        self._count(split, len(data))
+        self._count("mapping", len(line.encode()))
+
+    def write_ignored(self, frame_dir: str):
+        line = frame_dir + "\n"
+        self.files["ignored"].write(line)
+        self._count("ignored", len(line.encode()))
+
+    def sync(self) -> dict:
+        """flush + fsync 所有输出，返回各文件的续写状态（文本文件为字节数）。"""
+        sizes = {}
+        for key, f in self.files.items():
+            if key in self.XYZ_KEYS:
+                sizes[key] = f.sync()
+                continue
+            f.flush()
+            os.fsync(f.fileno())
+            sizes[key] = f.tell()
+        return sizes
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def _run_signature(args, roots_sorted) -> dict:
+    """决定输出内容的参数；resume 时必须与 checkpoint 一致。"""
+    sig = {
+        "roots": roots_sorted,
+        "prefix": args.prefix,
+        "test_fraction": args.test_fraction,
+        "seed": args.seed,
+        "out_train": os.path.abspath(args.out_train),
+        "out_test": os.path.abspath(args.out_test),
+        "frames_per_block": args.frames_per_block,
+        "ionic_steps": args.ionic_steps,
+        "stride": args.stride,
+        "min_de": args.min_de,
+        "include_last": args.include_last,
+        "backend": args.backend,
+        "root_backend": sorted(args.root_backend or []),
+    }
+    if args.shard_frames or args.shard_bytes:
+        sig["shards"] = [args.shard_frames, parse_size(args.shard_bytes)]
+    return sig
+
+
+def _root_backends(ap, args, roots_sorted) -> dict:
+    """--backend 为默认值，--root_backend ROOT=BACKEND 覆盖单个 root（ROOT 按绝对路径匹配）。"""
+    backend_of = {r: args.backend for r in roots_sorted}
+    for item in args.root_backend or []:
+        root, sep, backend = item.rpartition("=")
+        root = os.path.abspath(root)
+        if not sep or backend not in BACKENDS:
+            ap.error(f"--root_backend expects ROOT=BACKEND with BACKEND in {BACKENDS}: {item}")
+        if root not in backend_of:
+            ap.error(f"--root_backend root is not among the given roots: {root}")
+        backend_of[root] = backend
+    return backend_of
+
+
+def save_checkpoint(path: str, state: dict):
+    """原子写 checkpoint：要么是旧的要么是新的。"""
+    write_json_atomic(path, state)
+
+
+def load_checkpoint(path: str, signature: dict) -> dict:
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise SystemExit(f"[ERROR] checkpoint version mismatch: {path}")
+    if state.get("signature") != signature:
+        raise SystemExit(f"[ERROR] checkpoint {path} was written with different roots/options; "
+                         f"refusing to resume")
+    return state
 
 
 def main():
@@ -198,78 +405,291 @@ def main():
     ap.add_argument("--seed", type=int, default=1234, help="随机种子（保证可复现）")
     ap.add_argument("--out_train", type=str, default="train.xyz")
     ap.add_argument("--out_test", type=str, default="test.xyz")
+    ap.add_argument("--frames_per_block", type=int, default=256,
+                    help="输出以 .gz/.zst 结尾时写分块压缩 extxyz，每块的帧数")
+    ap.add_argument("--bucket_batch", type=int, default=0,
+                    help=">0 时结束后把 train 按原子数/组成重排成该大小的桶（与 NEP 的 batch 一致）")
+    ap.add_argument("--ionic_steps", choices=("last", "all"), default="last",
+                    help="last：每个 frame 只取 OUTCAR 最后一步（默认）；all：取所有（被选中的）离子步")
+    ap.add_argument("--stride", type=int, default=1, help="--ionic_steps all 时每隔多少步取一步")
+    ap.add_argument("--min_de", type=float, default=None,
+                    help="--ionic_steps all 时，与上一个选中步的每原子能量差（eV/atom）不小于该值才取")
+    ap.add_argument("--include_last", action="store_true",
+                    help="--ionic_steps all 时总是带上最后一步")
+    ap.add_argument("--backend", choices=BACKENDS, default="outcar",
+                    help="outcar：解析 OUTCAR（默认）；vasprun：流式解析 vasprun.xml，不可用时回退 OUTCAR")
+    ap.add_argument("--root_backend", action="append", default=None, metavar="ROOT=BACKEND",
+                    help="为某个 root 单独指定 backend（可重复），例如 --root_backend aimd/300K=vasprun")
+    ap.add_argument("--manifest", type=str, default=None,
+                    help="目录遍历 manifest（JSON）；再次运行时只重新列出 mtime 变化的目录")
+    ap.add_argument("--crawl_workers", type=int, default=8, help="并发遍历的 root 数")
+    ap.add_argument("--checkpoint", type=str, default="merge_checkpoint.json",
+                    help="checkpoint 文件（默认 merge_checkpoint.json，正常结束后删除）")
+    ap.add_argument("--checkpoint_every", type=int, default=500,
+                    help="每处理多少个 frame 目录写一次 checkpoint（每个 root 结束时也会写）")
+    ap.add_argument("--resume", action="store_true",
+                    help="从 --checkpoint 记录的断点继续（参数必须与中断的那次一致）")
+    ap.add_argument("--worker", type=str, default=None, metavar="I/M",
+                    help="分布式模式：本进程是 M 个 worker 中的第 I 个（0 起），只写自己的分片，最后用 reduce_shards.py 拼接")
+    ap.add_argument("--assign", choices=ASSIGN_MODES, default="hash",
+                    help="--worker 的分配方式：hash 按 frame 目录哈希（默认），root 按 root 轮流分")
+    ap.add_argument("--shard_dir", type=str, default="shards", help="--worker 分片的输出目录")
+    ap.add_argument("--shard_frames", type=int, default=None,
+                    help="train/test 写成每个最多这么多帧的分片 + manifest.json（与 --worker 的 --shard_dir 无关）")
+    ap.add_argument("--shard_bytes", type=str, default=None,
+                    help="每个分片最多的未压缩字节数（可写 500M / 2G），可与 --shard_frames 同时给")
+    ap.add_argument("--shard_jobs", type=int, default=4, help="并行收尾分片（压缩/fsync/校验和）的线程数")
+    ap.add_argument("--stats_json", type=str, default=None,
+                    help="开启分阶段计时/计数，并把报告写到该 JSON 文件")
+    ap.add_argument("--slowest", type=int, default=20, help="报告中保留最慢的 N 帧")
+    ap.add_argument("--profile", type=str, default=None,
+                    help="开启 cProfile，并把原始数据写到该文件（隐含开启计时）")
     args = ap.parse_args()
 
-    rng = random.Random(args.seed)
+    if args.stats_json or args.profile:
+        stats = MergeStats(slowest_n=args.slowest, profile=bool(args.profile))
+    else:
+        stats = NULL_STATS
 
-    train_structs, test_structs = [], []
-    mapping_log = []
-    ignored = []
+    rng = random.Random(args.seed)
+    sharded = bool(args.shard_frames or args.shard_bytes)
+    if sharded and args.worker is not None:
+        ap.error("--shard_frames/--shard_bytes cannot be combined with --worker; "
+                 "pass them to reduce_shards.py instead")
 
     roots_sorted = [os.path.abspath(r) for r in args.roots]
     roots_sorted.sort()
+    signature = _run_signature(args, roots_sorted)
+    backend_of = _root_backends(ap, args, roots_sorted)
+
+    # 分布式 worker：四个输出与 checkpoint 都放到自己的分片目录
+    worker = workers = shard = None
+    out_paths = {"out_train": args.out_train, "out_test": args.out_test, "mapping": "mapping_log.csv",
+                 "ignored": "ignored_frames.txt", "units": None}
+    if args.worker is not None:
+        try:
+            worker, workers = parse_worker(args.worker)
+        except ValueError as e:
+            ap.error(str(e))
+        shard = shard_path(args.shard_dir, worker, workers)
+        os.makedirs(shard, exist_ok=True)
+        out_paths = {"out_train": os.path.join(shard, SHARD_FILES["train"]),
+                     "out_test": os.path.join(shard, SHARD_FILES["test"]),
+                     "mapping": os.path.join(shard, SHARD_FILES["mapping"]),
+                     "ignored": os.path.join(shard, SHARD_FILES["ignored"]),
+                     "units": os.path.join(shard, SHARD_FILES["units"])}
+        if args.checkpoint == ap.get_default("checkpoint"):
+            args.checkpoint = os.path.join(shard, args.checkpoint)
+        if os.path.exists(os.path.join(shard, SHARD_META)) and not args.resume:
+            os.remove(os.path.join(shard, SHARD_META))
+    shard_signature = dict(signature)
+    if worker is not None:
+        signature = dict(signature, worker=worker, workers=workers, assign=args.assign)
+
+    # 分片输出：给了 --bucket_batch 的 train 先写整文件，重排后再切分片
+    shard_opts = None
+    if sharded:
+        shard_opts = {}
+        for split in ("train", "test"):
+            if split == "train" and args.bucket_batch > 0:
+                continue
+            shard_opts[split] = {"max_frames": args.shard_frames, "max_bytes": parse_size(args.shard_bytes),
+                                 "jobs": args.shard_jobs,
+                                 "meta": {"tool": "1218merge.py", "split": split, "mapping": "mapping_log.csv",
+                                          "roots": roots_sorted, "seed": args.seed,
+                                          "test_fraction": args.test_fraction}}
+
+    def mine(root_index: int, frame_dir: str) -> bool:
+        return worker is None or owner(args.assign, workers, root_index, frame_dir) == worker
+
+    # 断点：当前 root 序号、root 内下一个 frame 序号、该 root 的抽样结果
+    start_root, start_frame, root_state = 0, 0, None
+    counts = {"train": 0, "test": 0, "ignored": 0}
+    if args.resume:
+        if not os.path.isfile(args.checkpoint):
+            raise SystemExit(f"[ERROR] --resume given but no checkpoint: {args.checkpoint}")
+        ckpt = load_checkpoint(args.checkpoint, signature)
+        v, internal, gauss = ckpt["rng_state"]
+        rng.setstate((v, tuple(internal), gauss))
+        start_root, start_frame = ckpt["root_index"], ckpt["frame_index"]
+        root_state, counts = ckpt["root_state"], ckpt["counts"]
+        outputs = MergeOutputs(out_paths["out_train"], out_paths["out_test"], out_paths["mapping"],
+                               out_paths["ignored"], sizes=ckpt["sizes"],
+                               frames_per_block=args.frames_per_block, units=out_paths["units"],
+                               shards=shard_opts)
+        print(f"[RESUME] root #{start_root}, frame #{start_frame}: "
+              f"train={counts['train']}, test={counts['test']}, ignored={counts['ignored']}")
+    else:
+        outputs = MergeOutputs(out_paths["out_train"], out_paths["out_test"], out_paths["mapping"],
+                               out_paths["ignored"], frames_per_block=args.frames_per_block,
+                               units=out_paths["units"], shards=shard_opts)
+
+    def checkpoint(root_index: int, frame_index: int, state):
+        with stats.stage("checkpoint"):
+            sizes = outputs.sync()
+            v, internal, gauss = rng.getstate()
+            save_checkpoint(args.checkpoint, {
+                "version": CHECKPOINT_VERSION,
+                "signature": signature,
+                "root_index": root_index,
+                "frame_index": frame_index,
+                "root_state": state,
+                "rng_state": [v, list(internal), gauss],
+                "counts": counts,
+                "sizes": sizes,
+            })
+
+    # 断点所在 root 的抽样结果已在 checkpoint 里，只需遍历之后的 root
+    pending = roots_sorted[start_root + (0 if root_state is None else 1):]
+    with stats.stage("walk"):
+        crawled = crawl_roots(pending, prefix=args.prefix, manifest=args.manifest,
+                              workers=args.crawl_workers, stats=stats)
+
+    since_ckpt = 0
+    for ri in range(start_root, len(roots_sorted)):
+        root = roots_sorted[ri]
+        if root_state is None:
+            frame_dirs = crawled[root]
+            if not frame_dirs:
+                print(f"[WARN] No {args.prefix}* directories under root: {root}")
+                checkpoint(ri + 1, 0, None)
+                continue
 
-    for root in roots_sorted:
-        frame_dirs = find_frame_dirs_under_root(root, prefix=args.prefix)
-        if not frame_dirs:
-            print(f"[WARN] No {args.prefix}* directories under root: {root}")
-            continue
-
-        # 预筛：只接受存在可用 OUTCAR 的 frame 目录
-        valid_dirs = []
-        for d in frame_dirs:
-            if choose_outcar(d) is None:
-                print(f"[IGNORED] (no OUTCAR) {d}")
-                ignored.append(d)
-            else:
-                valid_dirs.append(d)
-
-        if not valid_dirs:
-            print(f"[WARN] No valid frames under root: {root}")
-            continue
+            # 预筛：只接受存在可用 OUTCAR（vasprun backend 下也可以是 vasprun.xml）的 frame 目录
+            # （候选已在遍历时收集）
+            valid_dirs = []
+            outcar_of, vasprun_of = {}, {}
+            use_vasprun = backend_of[root] == "vasprun"
+            for j, (d, outcar, _, vasprun) in enumerate(frame_dirs):
+                if outcar is None and not (use_vasprun and vasprun is not None):
+                    if not mine(ri, d):
+                        continue
+                    outputs.begin_unit(ri, 0, j)
+                    print(f"[IGNORED] (no OUTCAR) {d}")
+                    outputs.write_ignored(d)
+                    outputs.end_unit()
+                    counts["ignored"] += 1
+                    stats.count("ignored_no_outcar")
+                else:
+                    valid_dirs.append(d)
+                    outcar_of[d] = outcar
+                    vasprun_of[d] = vasprun
+
+            if not valid_dirs:
+                print(f"[WARN] No valid frames under root: {root}")
+                checkpoint(ri + 1, 0, None)
+                continue
 
-        n_total = len(valid_dirs)
-        n_test = max(1, int(n_total * args.test_fraction))
-        test_idx = set(rng.sample(range(n_total), n_test))
+            n_total = len(valid_dirs)
+            n_test = max(1, int(n_total * args.test_fraction))
+            test_idx = set(rng.sample(range(n_total), n_test))
+            root_state = {
+                "valid_dirs": valid_dirs,
+                "outcars": [outcar_of[d] for d in valid_dirs],
+                "vaspruns": [vasprun_of[d] for d in valid_dirs],
+                "test_idx": sorted(test_idx),
+            }
+            start_frame = 0
+            checkpoint(ri, 0, root_state)
+        else:
+            valid_dirs = root_state["valid_dirs"]
+            outcar_of = dict(zip(valid_dirs, root_state["outcars"]))
+            vasprun_of = dict(zip(valid_dirs, root_state.get("vaspruns") or [None] * len(valid_dirs)))
+            test_idx = set(root_state["test_idx"])
+            n_total, n_test = len(valid_dirs), len(test_idx)
 
         # 按原排序遍历，保持顺序
-        for i, frame_dir in enumerate(valid_dirs):
+        for i in range(start_frame, n_total):
+            frame_dir = valid_dirs[i]
+            if not mine(ri, frame_dir):
+                continue
+            split = "test" if i in test_idx else "train"
+            outputs.begin_unit(ri, 1, i)
+            t0 = time.perf_counter() if stats.enabled else 0.0
+            frames = harvest_frames(frame_dir, outcar_of[frame_dir], vasprun_of[frame_dir],
+                                    backend_of[root], args, stats=stats)
+            n_written = 0
             try:
-                atoms, source = read_frame_prefer_outcar(frame_dir)
-                atoms.info["root_folder"] = root
-                atoms.info["frame_folder"] = os.path.basename(frame_dir)
-                atoms.info["frame_dir"] = frame_dir
-                atoms.info["source"] = source
+                for rec, source in frames:
+                    rec.set_provenance(root, os.path.basename(frame_dir.split(ARCHIVE_SEP)[-1]),
+                                       frame_dir, source)
+                    with stats.stage("write"):
+                        outputs.write_frame(split, rec, root, frame_dir, source)
+                    counts[split] += 1
+                    n_written += 1
+                if n_written == 0:
+                    raise RuntimeError("no complete ionic step in OUTCAR/vasprun")
             except Exception as e:
-                print(f"[IGNORED] (OUTCAR missing/unusable) {frame_dir} :: {e}")
-                ignored.append(frame_dir)
-                continue
-
-            if i in test_idx:
-                test_structs.append(atoms)
-                mapping_log.append(f"test,{root},{frame_dir},{source}")
-            else:
-                train_structs.append(atoms)
-                mapping_log.append(f"train,{root},{frame_dir},{source}")
-
+                if n_written == 0:
+                    print(f"[IGNORED] (OUTCAR missing/unusable) {frame_dir} :: {e}")
+                    outputs.write_ignored(frame_dir)
+                    counts["ignored"] += 1
+                    stats.count("ignored_parse_failed")
+                else:
+                    print(f"[WARN] {frame_dir}: stopped after {n_written} ionic steps :: {e}")
+            outputs.end_unit()
+            if stats.enabled and n_written:
+                stats.count("frames_parsed", n_written)
+                stats.record_frame(frame_dir, time.perf_counter() - t0)
+
+            since_ckpt += 1
+            if since_ckpt >= args.checkpoint_every:
+                checkpoint(ri, i + 1, root_state)
+                since_ckpt = 0
+
+        root_state = None
+        checkpoint(ri + 1, 0, None)
         print(f"[ROOT DONE] {root} : frames={n_total}, test={n_test}")
 
-    print(f"Read total: train={len(train_structs)}, test={len(test_structs)}")
-
-    write_extended_xyz(train_structs, args.out_train)
-    write_extended_xyz(test_structs, args.out_test)
-
-    with open("mapping_log.csv", "w") as mf:
-        mf.write("split,root,frame_dir,source\n")
-        for line in mapping_log:
-            mf.write(line + "\n")
-
-    with open("ignored_frames.txt", "w") as f:
-        for d in ignored:
-            f.write(d + "\n")
-
-    print(f"Wrote: {args.out_train}, {args.out_test}, mapping_log.csv")
-    print(f"Ignored frames: {len(ignored)} (see ignored_frames.txt)")
+    outputs.close()
+    os.remove(args.checkpoint)
+
+    if worker is not None:
+        write_json_atomic(os.path.join(shard, SHARD_META), {
+            "version": SHARD_VERSION,
+            "signature": shard_signature,
+            "worker": worker,
+            "workers": workers,
+            "assign": args.assign,
+            "bucket_batch": args.bucket_batch,
+            "mapping_header": MAPPING_HEADER,
+            "counts": counts,
+        }, indent=1)
+        print(f"[SHARD DONE] worker {worker}/{workers}: train={counts['train']}, test={counts['test']}, "
+              f"ignored={counts['ignored']} -> {shard}")
+        print(f"After all {workers} workers finish: python reduce_shards.py {args.shard_dir}")
+    elif args.bucket_batch > 0:
+        with stats.stage("bucket_order"):
+            reorder_file(args.out_train, batch=args.bucket_batch, seed=args.seed,
+                         mapping="mapping_log.csv", split="train")
+        print(f"[BUCKET] {args.out_train} reordered into buckets of {args.bucket_batch}")
+        if sharded:
+            with stats.stage("shard"):
+                shard_file(args.out_train, max_frames=args.shard_frames, max_bytes=parse_size(args.shard_bytes),
+                           frames_per_block=args.frames_per_block, jobs=args.shard_jobs,
+                           meta=dict(shard_opts["test"]["meta"], split="train"))
+            for p in (args.out_train, args.out_train + INDEX_SUFFIX):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    if worker is None:
+        print(f"Read total: train={counts['train']}, test={counts['test']}")
+        if sharded:
+            print(f"Wrote: {shard_dir_for(args.out_train)}/, {shard_dir_for(args.out_test)}/, mapping_log.csv "
+                  f"(python concat_shards.py {shard_dir_for(args.out_train)} -o {args.out_train})")
+        else:
+            print(f"Wrote: {args.out_train}, {args.out_test}, mapping_log.csv")
+        print(f"Ignored frames: {counts['ignored']} (see ignored_frames.txt)")
+
+    if stats.enabled:
+        stats.finish()
+        stats.print_summary()
+        if args.stats_json:
+            stats.write_json(args.stats_json)
+            print(f"Wrote timing report: {args.stats_json}")
+        if args.profile:
+            print(stats.write_profile(args.profile))
+            print(f"Wrote cProfile data: {args.profile}")
 
 
 if __name__ == "__main__":
@@ -12,9 +12,12 @@ prepare_train_test_with_ase.py
 import os
 import glob
 import random
+import time
 import numpy as np
 from ase import io
 
+from merge_stats import MergeStats, NULL_STATS
+
 # ——— 用户参数 ———
 root_dirs = [
     "dg/100",
@@ -28,10 +31,12 @@ seed = 1234            # 随机种子，保证可重复
 factor = 6.2415e-4      # 单位转化 eV/Å³ per kB
 contcar_name = "CONTCAR"
 outcar_name = "OUTCAR"
+stats_json = None      # 分阶段计时/计数报告（JSON）的路径，例如 "merge_stats.json"；None 为关闭
+profile_out = None     # cProfile 原始数据的路径；None 为关闭（给出时隐含开启计时）
 
 # ——— 辅助函数 ———
 
-def read_frame_folder(frame_folder, root_folder_name=None, frame_folder_name=None):
+def read_frame_folder(frame_folder, root_folder_name=None, frame_folder_name=None, stats=NULL_STATS):
     """
     读取一个 frame 文件夹：读取结构 + 解析 OUTCAR；
     返回 ASE Atoms 对象 （附加 metadata root_folder & frame_folder）。
@@ -42,7 +47,11 @@ def read_frame_folder(frame_folder, root_folder_name=None, frame_folder_name=Non
         if not os.path.exists(contcar_path):
             raise FileNotFoundError(f"No {contcar_name} or POSCAR in {frame_folder}")
 
-    atoms = io.read(contcar_path)
+    with stats.stage("ase_parse"):
+        atoms = io.read(contcar_path)
+    if stats.enabled:
+        stats.count("files_opened")
+        stats.count("bytes_read", os.path.getsize(contcar_path))
 
     N = len(atoms)
     forces = np.zeros((N,3), dtype=float)
@@ -51,57 +60,64 @@ def read_frame_folder(frame_folder, root_folder_name=None, frame_folder_name=Non
 
     outcar_path = os.path.join(frame_folder, outcar_name)
     if os.path.exists(outcar_path):
-        with open(outcar_path, 'r') as f:
+        with stats.stage("outcar_read"), open(outcar_path, 'r') as f:
             lines = f.readlines()
+        if stats.enabled:
+            stats.count("files_opened")
+            stats.count("bytes_read", os.path.getsize(outcar_path))
         # 能量
-        for line in reversed(lines):
-            if "free  energy   TOTEN" in line:
-                parts = line.split()
-                try:
-                    energy = float(parts[4])
-                except:
-                    pass
-                break
-        if energy is None:
-            energy = 0.0
+        with stats.stage("energy_parse"):
+            for line in reversed(lines):
+                if "free  energy   TOTEN" in line:
+                    parts = line.split()
+                    try:
+                        energy = float(parts[4])
+                    except:
+                        pass
+                    break
+            if energy is None:
+                energy = 0.0
         # 应力
-        for i, line in enumerate(lines):
-            if "Total" in line:
-                vals = lines[i].split()
-                if len(vals) >= 7:
-                    fvals = list(map(float, vals[1:7]))
-                    stress_tensor = np.array([
-                        [fvals[0], fvals[3], fvals[5]],
-                        [fvals[3], fvals[1], fvals[4]],
-                        [fvals[5], fvals[4], fvals[2]]
-                    ], dtype=float)
-                break
-        if stress_tensor is not None:
-            stress_tensor = stress_tensor * 1.0
-        else:
-            stress_tensor = np.zeros((3,3), dtype=float)
+        with stats.stage("virial_parse"):
+            for i, line in enumerate(lines):
+                if "Total" in line:
+                    vals = lines[i].split()
+                    if len(vals) >= 7:
+                        fvals = list(map(float, vals[1:7]))
+                        stress_tensor = np.array([
+                            [fvals[0], fvals[3], fvals[5]],
+                            [fvals[3], fvals[1], fvals[4]],
+                            [fvals[5], fvals[4], fvals[2]]
+                        ], dtype=float)
+                    break
+            if stress_tensor is not None:
+                stress_tensor = stress_tensor * 1.0
+            else:
+                stress_tensor = np.zeros((3,3), dtype=float)
         # 原子力
-        for i, line in enumerate(lines):
-            if "POSITION" in line and "TOTAL-FORCE" in line:
-                start = i + 2
-                k = 0
-                for j in range(start, len(lines)):
-                    parts = lines[j].split()
-                    if len(parts) < 4:
-                        break
-                    try:
-                        fx = float(parts[-3])
-                        fy = float(parts[-2])
-                        fz = float(parts[-1])
-                        forces[k,:] = [fx, fy, fz]
-                        k += 1
-                        if k >= N:
+        with stats.stage("force_parse"):
+            for i, line in enumerate(lines):
+                if "POSITION" in line and "TOTAL-FORCE" in line:
+                    start = i + 2
+                    k = 0
+                    for j in range(start, len(lines)):
+                        parts = lines[j].split()
+                        if len(parts) < 4:
                             break
-                    except:
-                        break
-                break
+                        try:
+                            fx = float(parts[-3])
+                            fy = float(parts[-2])
+                            fz = float(parts[-1])
+                            forces[k,:] = [fx, fy, fz]
+                            k += 1
+                            if k >= N:
+                                break
+                        except:
+                            break
+                    break
     else:
         print(f"Warning: {outcar_name} not found in {frame_folder}")
+        stats.count("missing_outcar")
         energy = 0.0
         stress_tensor = np.zeros((3,3), dtype=float)
 
@@ -161,13 +177,15 @@ def write_extended_xyz(atoms_list, filename):
 
 def main():
     random.seed(seed)
+    stats = MergeStats(profile=bool(profile_out)) if (stats_json or profile_out) else NULL_STATS
 
     train_structs = []
     test_structs = []
     mapping_log = []
 
     for root in root_dirs:
-        frame_dirs = sorted(glob.glob(os.path.join(root, "frame*")))
+        with stats.stage("walk"):
+            frame_dirs = sorted(glob.glob(os.path.join(root, "frame*")))
         if not frame_dirs:
             print(f"WARNING: No frame folders found in {root}")
             continue
@@ -180,22 +198,33 @@ def main():
         train_dirs = [ frame_dirs[i] for i in range(n_total) if i not in selected_idx ]
 
         for d in train_dirs:
+            t0 = time.perf_counter() if stats.enabled else 0.0
             atoms = read_frame_folder(d,
                                       root_folder_name=root,
-                                      frame_folder_name=os.path.basename(d))
+                                      frame_folder_name=os.path.basename(d),
+                                      stats=stats)
+            if stats.enabled:
+                stats.count("frames_parsed")
+                stats.record_frame(d, time.perf_counter() - t0)
             train_structs.append(atoms)
             mapping_log.append(f"train,{root},{os.path.basename(d)}")
         for d in test_dirs:
+            t0 = time.perf_counter() if stats.enabled else 0.0
             atoms = read_frame_folder(d,
                                       root_folder_name=root,
-                                      frame_folder_name=os.path.basename(d))
+                                      frame_folder_name=os.path.basename(d),
+                                      stats=stats)
+            if stats.enabled:
+                stats.count("frames_parsed")
+                stats.record_frame(d, time.perf_counter() - t0)
             test_structs.append(atoms)
             mapping_log.append(f"test,{root},{os.path.basename(d)}")
 
     print(f"Read total: train = {len(train_structs)}, test = {len(test_structs)}")
 
-    write_extended_xyz(train_structs, out_train_xyz)
-    write_extended_xyz(test_structs, out_test_xyz)
+    with stats.stage("write"):
+        write_extended_xyz(train_structs, out_train_xyz)
+        write_extended_xyz(test_structs, out_test_xyz)
 
     # 写映射日志
     with open("mapping_log.csv", "w") as mf:
@@ -206,5 +235,15 @@ def main():
     print(f"Wrote train file: {out_train_xyz} ({len(train_structs)} frames)")
     print(f"Wrote test  file: {out_test_xyz}  ({len(test_structs)} frames)")
 
+    if stats.enabled:
+        stats.finish()
+        stats.print_summary()
+        if stats_json:
+            stats.write_json(stats_json)
+            print(f"Wrote timing report: {stats_json}")
+        if profile_out:
+            print(stats.write_profile(profile_out))
+            print(f"Wrote cProfile data: {profile_out}")
+
 if __name__ == "__main__":
     main()
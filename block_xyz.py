@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+block_xyz.py
+
+分块压缩的 extxyz（train.xyz.gz / train.xyz.zst），保留按帧随机访问：
+- 每 frames_per_block 帧压成一个独立的 gzip member / zstd frame，依次拼接；
+  整个文件仍是合法的 .gz / .zst，zcat / zstdcat 直接得到普通 extxyz；
+- 旁边写 <file>.fidx（JSON）：每块的压缩偏移、压缩大小、块内各帧的解压偏移；
+  第 i 帧在第 i // frames_per_block 块，O(1) 定位，只解压一块；
+- 顺序读取时多线程并行解压各块（zlib / zstd 解压会释放 GIL）；
+- 索引丢失时可扫描数据文件重建（python block_xyz.py reindex train.xyz.gz）。
+
+统一入口：
+  open_frame_reader(path) -> 支持 len / frame_bytes(i) / iter_frame_bytes() 的读者（普通或分块）
+  open_xyz_writer(path)   -> 支持 write_frame(bytes) / sync() / close() 的写者（普通或分块）
+  frame_count(path)       -> 帧数（不解压、不解析原子行）
+  iter_chunk_frames(path, start, end) -> 一个字节区间 / 块区间里的帧（多进程分块处理用）
+
+用法：
+  python block_xyz.py compress train.xyz train.xyz.zst --frames_per_block 256
+  python block_xyz.py decompress train.xyz.zst train.xyz
+  python block_xyz.py reindex train.xyz.gz
+"""
+
+import argparse
+import base64
+import bisect
+import json
+import mmap
+import os
+import zlib
+
+from xyz_stream import open_mmap, resync, iter_frame_spans, count_frames
+
+INDEX_SUFFIX = ".fidx"
+INDEX_VERSION = 1
+BLOCK_CODECS = {".gz": "gz", ".zst": "zst"}
+DEFAULT_FRAMES_PER_BLOCK = 256
+
+
+def codec_of(path: str) -> str | None:
+    for suf, codec in BLOCK_CODECS.items():
+        if path.endswith(suf):
+            return codec
+    return None
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("block-compressed .zst xyz needs the 'zstandard' package") from e
+    return zstandard
+
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "gz":
+        c = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return c.compress(data) + c.flush()
+    return _zstd().ZstdCompressor(level=level).compress(data)
+
+
+def _decompressobj(codec: str):
+    if codec == "gz":
+        return zlib.decompressobj(31)
+    return _zstd().ZstdDecompressor().decompressobj()
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "gz":
+        return zlib.decompress(data, 31)
+    d = _zstd().ZstdDecompressor().decompressobj()
+    return d.decompress(data)
+
+
+def _frame_offsets(block: bytes) -> list[int]:
+    return [start for start, *_ in iter_frame_spans(block)]
+
+
+def build_index(path: str, codec: str | None = None) -> dict:
+    """顺序扫描数据文件，按压缩 member/frame 边界重建索引。"""
+    codec = codec or codec_of(path)
+    blocks = []
+    with open(path, "rb") as f:
+        pos = 0
+        while True:
+            f.seek(pos)
+            d = _decompressobj(codec)
+            out = []
+            consumed = 0
+            while not d.eof:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                out.append(d.decompress(chunk))
+                consumed += len(chunk)
+            if not d.eof:
+                if out and any(out):
+                    raise ValueError(f"truncated compressed block at byte {pos} in {path}")
+                break
+            csize = consumed - len(d.unused_data)
+            block = b"".join(out)
+            blocks.append([pos, csize, _frame_offsets(block)])
+            pos += csize
+    return _index_dict(codec, None, blocks)
+
+
+def _index_dict(codec: str, frames_per_block: int | None, blocks: list) -> dict:
+    if frames_per_block is None:
+        frames_per_block = len(blocks[0][2]) if blocks else DEFAULT_FRAMES_PER_BLOCK
+    return {"version": INDEX_VERSION, "codec": codec,
+            "frames_per_block": frames_per_block, "blocks": blocks}
+
+
+def load_index(path: str) -> dict:
+    ipath = path + INDEX_SUFFIX
+    if os.path.isfile(ipath) and os.path.getmtime(ipath) >= os.path.getmtime(path):
+        with open(ipath) as f:
+            idx = json.load(f)
+        if idx.get("version") == INDEX_VERSION:
+            return idx
+    idx = build_index(path)
+    write_json_atomic(ipath, idx)
+    return idx
+
+
+def write_text_atomic(path: str, text: str):
+    """先写临时文件并 fsync，再 os.replace：path 要么是旧内容要么是新内容。"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_json_atomic(path: str, obj, indent: int | None = None):
+    """原子写 JSON（见 write_text_atomic）；indent 为 None 时写紧凑格式。"""
+    if indent is None:
+        write_text_atomic(path, json.dumps(obj, separators=(",", ":")))
+    else:
+        write_text_atomic(path, json.dumps(obj, indent=indent))
+
+
+# ——— 读者 ———
+
+class BlockXYZReader:
+    """分块压缩 extxyz 的随机访问读者。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = load_index(path)
+        self.codec = self.index["codec"]
+        self.blocks = self.index["blocks"]
+        self.fpb = self.index["frames_per_block"]
+        self._n = sum(len(b[2]) for b in self.blocks)
+        self._f = open(path, "rb")
+        self._cache = (-1, b"")
+        # 除最后一块外每块都是 fpb 帧时 O(1) 定位；否则（外部拼接的文件）用块首帧号二分
+        self._firsts = None
+        if any(len(b[2]) != self.fpb for b in self.blocks[:-1]):
+            self._firsts, first = [], 0
+            for b in self.blocks:
+                self._firsts.append(first)
+                first += len(b[2])
+
+    def __len__(self):
+        return self._n
+
+    def _locate(self, i: int) -> tuple[int, int]:
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(f"frame {i} out of range ({self._n} frames)")
+        if self._firsts is None:
+            return i // self.fpb, i % self.fpb
+        b = bisect.bisect_right(self._firsts, i) - 1
+        return b, i - self._firsts[b]
+
+    def _read_block_raw(self, b: int) -> bytes:
+        off, csize, _ = self.blocks[b]
+        return os.pread(self._f.fileno(), csize, off)
+
+    def block(self, b: int) -> bytes:
+        if self._cache[0] != b:
+            self._cache = (b, _decompress(self._read_block_raw(b), self.codec))
+        return self._cache[1]
+
+    def frame_bytes(self, i: int) -> bytes:
+        b, k = self._locate(i)
+        data = self.block(b)
+        offs = self.blocks[b][2]
+        end = offs[k + 1] if k + 1 < len(offs) else len(data)
+        return data[offs[k]:end]
+
+    def iter_frame_bytes(self, threads: int = 4):
+        """按顺序产出每帧原始字节；各块并行解压，最多预取 2*threads 块。"""
+        def work(b):
+            return _decompress(self._read_block_raw(b), self.codec)
+
+        nb = len(self.blocks)
+        from concurrent.futures import ThreadPoolExecutor  # 延迟导入：extract/count 等随机读取用不到
+
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as ex:
+            window = max(1, 2 * threads)
+            futs = [ex.submit(work, b) for b in range(min(window, nb))]
+            for b in range(nb):
+                data = futs[b].result()
+                futs[b] = None
+                if b + window < nb:
+                    futs.append(ex.submit(work, b + window))
+                offs = self.blocks[b][2]
+                for k, s in enumerate(offs):
+                    yield data[s:offs[k + 1] if k + 1 < len(offs) else len(data)]
+
+    def close(self):
+        self._f.close()
+
+
+class PlainXYZReader:
+    """普通 extxyz 的随机访问读者（mmap + 帧偏移表）。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buf = open_mmap(path)
+        self.offsets = []
+        self.ends = []
+        for start, _, _, _, end in iter_frame_spans(self._buf):
+            self.offsets.append(start)
+            self.ends.append(end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def frame_bytes(self, i: int) -> bytes:
+        return bytes(self._buf[self.offsets[i]:self.ends[i]])
+
+    def iter_frame_bytes(self, threads: int = 1):
+        for s, e in zip(self.offsets, self.ends):
+            yield bytes(self._buf[s:e])
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+
+def open_frame_reader(path: str):
+    return BlockXYZReader(path) if codec_of(path) else PlainXYZReader(path)
+
+
+def frame_count(path: str) -> int:
+    """帧数：分块压缩文件只读 .fidx，普通 xyz 只切分帧边界（都不解析原子行）。"""
+    if codec_of(path):
+        return sum(len(b[2]) for b in load_index(path)["blocks"])
+    return count_frames(path)
+
+
+def iter_chunk_frames(path: str, start: int, end: int):
+    """
+    多进程分块处理的一块：普通 xyz 产出起点落在字节区间 [start, end) 内的帧，
+    分块压缩文件产出第 start..end-1 块里的帧（均为原始字节）。
+    """
+    if codec_of(path):
+        reader = BlockXYZReader(path)
+        try:
+            for b in range(start, end):
+                data = reader.block(b)
+                offs = reader.blocks[b][2]
+                for k, s in enumerate(offs):
+                    yield data[s:offs[k + 1] if k + 1 < len(offs) else len(data)]
+        finally:
+            reader.close()
+        return
+    buf = open_mmap(path)
+    try:
+        pos = resync(buf, start, limit=end) if start > 0 else 0
+        for s, _, _, _, e in iter_frame_spans(buf, pos, end):
+            yield bytes(buf[s:e])
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+# ——— 写者 ———
+
+class PlainXYZWriter:
+    def __init__(self, path: str, resume_state: int | None = None):
+        self.path = path
+        if resume_state is None:
+            self._f = open(path, "wb")
+        else:
+            with open(path, "r+b") as fb:
+                fb.truncate(resume_state)
+            self._f = open(path, "ab")
+
+    def write_frame(self, data: bytes):
+        self._f.write(data)
+
+    def sync(self) -> int:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+
+class BlockXYZWriter:
+    """
+    每攒满 frames_per_block 帧压缩成一块写出。
+    sync() 返回可 JSON 序列化的状态（已落盘字节数、块数、未满块的原始内容），
+    用该状态重新构造写者即可从断点继续，最终文件与不中断时逐字节相同。
+    """
+
+    def __init__(self, path: str, frames_per_block: int = DEFAULT_FRAMES_PER_BLOCK,
+                 level: int | None = None, resume_state: dict | None = None):
+        self.path = path
+        self.codec = codec_of(path)
+        if self.codec is None:
+            raise ValueError(f"not a block-compressed xyz name (.gz/.zst): {path}")
+        self.level = level if level is not None else (6 if self.codec == "gz" else 10)
+        self.fpb = frames_per_block
+        self.blocks: list = []
+        self._pending: list[bytes] = []
+        if resume_state is None:
+            self._f = open(path, "wb")
+        else:
+            self._resume(resume_state)
+
+    def _resume(self, state: dict):
+        with open(self.path, "r+b") as fb:
+            fb.truncate(state["size"])
+        ipath = self.path + INDEX_SUFFIX
+        blocks = []
+        if os.path.isfile(ipath):
+            with open(ipath) as f:
+                blocks = [b for b in json.load(f)["blocks"] if b[0] + b[1] <= state["size"]]
+        if len(blocks) != state["blocks"]:
+            blocks = build_index(self.path, self.codec)["blocks"]
+        self.blocks = blocks
+        self.fpb = state["frames_per_block"]
+        pending = base64.b64decode(state["pending"])
+        self._pending = [pending[s:e] for s, _, _, _, e in iter_frame_spans(pending)]
+        self._f = open(self.path, "ab")
+
+    def write_frame(self, data: bytes):
+        self._pending.append(data)
+        if len(self._pending) >= self.fpb:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        raw = b"".join(self._pending)
+        offs, pos = [], 0
+        for fr in self._pending:
+            offs.append(pos)
+            pos += len(fr)
+        comp = _compress(raw, self.codec, self.level)
+        self.blocks.append([self._f.tell(), len(comp), offs])
+        self._f.write(comp)
+        self._pending = []
+
+    def _write_index(self):
+        write_json_atomic(self.path + INDEX_SUFFIX,
+                           _index_dict(self.codec, self.fpb, self.blocks))
+
+    def sync(self) -> dict:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._write_index()
+        return {"size": self._f.tell(), "blocks": len(self.blocks), "frames_per_block": self.fpb,
+                "pending": base64.b64encode(b"".join(self._pending)).decode("ascii")}
+
+    def close(self):
+        self._flush_block()
+        self._f.close()
+        self._write_index()
+
+
+def open_xyz_writer(path: str, frames_per_block: int = DEFAULT_FRAMES_PER_BLOCK,
+                    resume_state=None):
+    """按后缀选择写者：.gz/.zst 为分块压缩，其它为普通文本。"""
+    if codec_of(path):
+        return BlockXYZWriter(path, frames_per_block, resume_state=resume_state)
+    return PlainXYZWriter(path, resume_state=resume_state)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="分块压缩 extxyz 的转换与索引工具")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("compress", help="普通 xyz -> 分块压缩（输出后缀 .gz 或 .zst）")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--frames_per_block", type=int, default=DEFAULT_FRAMES_PER_BLOCK)
+    p = sub.add_parser("decompress", help="分块压缩 -> 普通 xyz")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--threads", type=int, default=4)
+    p = sub.add_parser("reindex", help="扫描数据文件重建 .fidx 索引")
+    p.add_argument("input")
+    args = ap.parse_args()
+
+    if args.cmd == "compress":
+        reader = open_frame_reader(args.input)
+        writer = BlockXYZWriter(args.output, args.frames_per_block)
+        for fr in reader.iter_frame_bytes():
+            writer.write_frame(fr)
+        writer.close()
+        reader.close()
+        print(f"Wrote {args.output}: {len(reader)} frames, {len(writer.blocks)} blocks")
+    elif args.cmd == "decompress":
+        reader = open_frame_reader(args.input)
+        with open(args.output, "wb") as f:
+            for fr in reader.iter_frame_bytes(threads=args.threads):
+                f.write(fr)
+        print(f"Wrote {args.output}: {len(reader)} frames")
+        reader.close()
+    elif args.cmd == "reindex":
+        idx = build_index(args.input)
+        write_json_atomic(args.input + INDEX_SUFFIX, idx)
+        print(f"Indexed {args.input}: {sum(len(b[2]) for b in idx['blocks'])} frames, "
+              f"{len(idx['blocks'])} blocks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bucket_order.py
+
+把 extxyz 的帧按原子数与组成重新排列成 batch 大小的桶，减少 NEP 训练时同一 batch 内
+大小悬殊造成的 padding/负载不均：
+1) 排序键 = (原子数, 组成, 分层抖动位置)：同一 (原子数, 组成) 内，每个 root 的第 j 帧（共 n 帧）
+   放在 (j + U(0,1)) / n 处，使各 root 的帧均匀散布在该组的各个桶里（分层）；
+2) 外部排序：每 --run_records 条记录排一次写成临时 run，最后 heapq.merge 归并，
+   内存只与 run 大小有关，与数据集大小无关；
+3) 按排序结果每 --batch 帧切一个桶，桶内随机打乱（分层洗牌），默认桶的先后顺序也打乱；
+4) 输出重排后的 xyz（帧内容原样拷贝），和/或逐帧置换（第 k 行 = 新第 k 帧在原文件中的序号）；
+   给了 mapping_log.csv 时，把其中该 split 的行按同一置换重写，保持与 xyz 一一对应。
+
+输入输出都可以是普通 xyz 或 block_xyz.py 的 .gz/.zst 分块压缩文件；分块压缩输入在扫描时
+顺便解压到临时目录（需要与解压后大小相同的磁盘空间），写出时按偏移随机读，每块只解压一次。
+1218merge.py --bucket_batch、filter_E&F.py --bucket_batch 结束时调用 reorder_file。
+
+用法：
+  python bucket_order.py train.xyz -o train_bucketed.xyz --batch 1000 --mapping mapping_log.csv
+  python bucket_order.py train.xyz --in_place --batch 1000 --perm_out perm.txt
+  python bucket_order.py train.xyz --perm_only --perm_out perm.txt
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import random
+import shutil
+import struct
+import tempfile
+from array import array
+from collections import Counter
+
+from block_xyz import codec_of, open_frame_reader, open_xyz_writer, INDEX_SUFFIX
+from xyz_stream import open_mmap, iter_frame_spans, parse_header, find_header_value
+
+# 扫描记录：natoms, 组成 id, root id, 原序号, 偏移, 长度
+_RAW = struct.Struct("<iiiqqq")
+# 排序记录：natoms, 组成名次, 分层位置, 原序号, 偏移, 长度（元组比较即排序键）
+_SORTED = struct.Struct("<iidqqq")
+SPOOL_NAME = "frames.xyz"  # 分块压缩输入解压后的临时副本（在 bucket_permutation 的临时目录里）
+
+
+def _composition(atom_lines: bytes) -> str:
+    c = Counter(ln.split(None, 1)[0] for ln in atom_lines.splitlines() if ln.strip())
+    return "".join(f"{s.decode()}{c[s]}" for s in sorted(c))
+
+
+def _iter_frames(path: str, spool=None):
+    """
+    产出 (原序号, natoms, comment 字节, 原子行字节, 偏移, 长度)。
+    分块压缩文件：给了 spool（二进制文件对象）时把解压出的帧依次写进去，偏移/长度指 spool 里的位置，
+    否则记 -1。
+    """
+    if codec_of(path):
+        reader = open_frame_reader(path)
+        pos = 0
+        for i, fb in enumerate(reader.iter_frame_bytes()):
+            nl1 = fb.index(b"\n")
+            nl2 = fb.index(b"\n", nl1 + 1)
+            off = length = -1
+            if spool is not None:
+                spool.write(fb)
+                off, length = pos, len(fb)
+                pos += length
+            yield i, int(fb[:nl1]), fb[nl1 + 1:nl2], fb[nl2 + 1:], off, length
+        reader.close()
+        return
+    buf = open_mmap(path)
+    for i, (start, natoms, cs, ats, end) in enumerate(iter_frame_spans(buf)):
+        yield i, natoms, bytes(buf[cs:ats]), bytes(buf[ats:end]), start, end - start
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+
+
+def _scan(path: str, raw_path: str, spool_path: str | None = None):
+    """第一遍：写扫描记录，统计每个 (natoms, 组成, root) 的帧数；分块压缩输入可顺便解压到 spool_path。"""
+    comps: dict[str, int] = {}
+    roots: dict[str, int] = {}
+    counts: Counter = Counter()
+    n = 0
+    spool = open(spool_path, "wb") if spool_path else None
+    try:
+        with open(raw_path, "wb") as out:
+            for i, natoms, comment, atoms, off, length in _iter_frames(path, spool):
+                comp = comps.setdefault(_composition(atoms), len(comps))
+                root = find_header_value(parse_header(comment.decode("utf-8", "ignore")), "root")
+                rid = roots.setdefault(root, len(roots))
+                counts[(natoms, comp, rid)] += 1
+                out.write(_RAW.pack(natoms, comp, rid, i, off, length))
+                n = i + 1
+    finally:
+        if spool is not None:
+            spool.close()
+    return n, comps, counts
+
+
+def _iter_struct(path: str, st: struct.Struct, chunk: int = 4096):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(st.size * chunk)
+            if not data:
+                return
+            yield from st.iter_unpack(data)
+
+
+def _sorted_runs(raw_path: str, comps: dict, counts: Counter, rng: random.Random,
+                 run_records: int, tmpdir: str) -> list[str]:
+    """第二遍：算分层位置，按 run_records 条一段排序写出。"""
+    rank = {cid: r for r, (_, cid) in enumerate(sorted((name, cid) for name, cid in comps.items()))}
+    seen: Counter = Counter()
+    runs, buf = [], []
+
+    def flush():
+        buf.sort()
+        path = os.path.join(tmpdir, f"run_{len(runs):05d}.bin")
+        with open(path, "wb") as f:
+            for rec in buf:
+                f.write(_SORTED.pack(*rec))
+        runs.append(path)
+        buf.clear()
+
+    for natoms, comp, rid, i, off, length in _iter_struct(raw_path, _RAW):
+        key = (natoms, comp, rid)
+        j = seen[key]
+        seen[key] = j + 1
+        buf.append((natoms, rank[comp], (j + rng.random()) / counts[key], i, off, length))
+        if len(buf) >= run_records:
+            flush()
+    if buf:
+        flush()
+    return runs
+
+
+def bucket_permutation(path: str, batch: int = 1000, seed: int = 1234,
+                       shuffle_buckets: bool = True, run_records: int = 1_000_000,
+                       tmpdir: str | None = None, spool: bool = False):
+    """
+    计算新顺序，返回 (n, 记录文件路径, 临时目录)：记录文件按新顺序存放 (原序号, 偏移, 长度)，
+    每条 int64×3。调用方用完后删除临时目录。
+    spool=True 且输入是分块压缩文件时，扫描时把帧解压到临时目录的 SPOOL_NAME，偏移/长度指向它，
+    按新顺序写出时随机读这个普通文件，而不是逐帧解压整块。
+    """
+    rng = random.Random(seed)
+    tmp = tempfile.mkdtemp(prefix="bucket_order_", dir=tmpdir)
+    raw_path = os.path.join(tmp, "scan.bin")
+    spool_path = os.path.join(tmp, SPOOL_NAME) if spool and codec_of(path) else None
+    n, comps, counts = _scan(path, raw_path, spool_path)
+    runs = _sorted_runs(raw_path, comps, counts, rng, run_records, tmp)
+    os.remove(raw_path)
+
+    rec = struct.Struct("<qqq")
+    sorted_path = os.path.join(tmp, "sorted.bin")
+    with open(sorted_path, "wb") as f:
+        for r in heapq.merge(*(_iter_struct(p, _SORTED) for p in runs)):
+            f.write(rec.pack(r[3], r[4], r[5]))
+    for p in runs:
+        os.remove(p)
+
+    n_buckets = -(-n // batch) if n else 0
+    order = list(range(n_buckets))
+    if shuffle_buckets:
+        rng.shuffle(order)
+    final_path = os.path.join(tmp, "order.bin")
+    with open(sorted_path, "rb") as src, open(final_path, "wb") as dst:
+        for b in order:
+            src.seek(b * batch * rec.size)
+            items = list(rec.iter_unpack(src.read(min(batch, n - b * batch) * rec.size)))
+            rng.shuffle(items)
+            for it in items:
+                dst.write(rec.pack(*it))
+    os.remove(sorted_path)
+    return n, final_path, tmp
+
+
+def _rewrite_mapping(mapping: str, split: str, new_order: array):
+    """mapping_log.csv 中属于 split 的行按 new_order 重排，其它行位置不变。"""
+    offsets = array("q")
+    with open(mapping, "rb") as f:
+        header = f.readline()
+        pos = len(header)
+        for line in f:
+            if line.split(b",", 1)[0].decode() == split:
+                offsets.append(pos)
+            pos += len(line)
+    if len(offsets) != len(new_order):
+        raise ValueError(f"{mapping}: {len(offsets)} '{split}' rows, but xyz has {len(new_order)} frames")
+
+    tmp = mapping + ".bucket_tmp"
+    k = 0
+    with open(mapping, "rb") as src, open(mapping, "rb") as rows, open(tmp, "wb") as out:
+        out.write(src.readline())
+        for line in src:
+            if line.split(b",", 1)[0].decode() == split:
+                rows.seek(offsets[new_order[k]])
+                line = rows.readline()
+                k += 1
+            out.write(line)
+    os.replace(tmp, mapping)
+
+
+def reorder_file(path: str, output: str | None = None, batch: int = 1000, seed: int = 1234,
+                 mapping: str | None = None, split: str = "train", perm_out: str | None = None,
+                 shuffle_buckets: bool = True, run_records: int = 1_000_000,
+                 write_xyz: bool = True, tmpdir: str | None = None) -> int:
+    """
+    按桶重排 path；output 为 None 时原地替换。返回帧数。
+    write_xyz=False 时只写置换（perm_out）和 mapping。
+    """
+    n, order_path, tmp = bucket_permutation(path, batch, seed, shuffle_buckets, run_records, tmpdir,
+                                            spool=write_xyz)
+    try:
+        new_order = array("q", (r[0] for r in _iter_struct(order_path, struct.Struct("<qqq"))))
+        if perm_out:
+            with open(perm_out, "w") as f:
+                f.writelines(f"{i}\n" for i in new_order)
+        if write_xyz:
+            spool = os.path.join(tmp, SPOOL_NAME)
+            _write_reordered(path, output, order_path, spool if os.path.exists(spool) else path)
+        if mapping:
+            _rewrite_mapping(mapping, split, new_order)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return n
+
+
+def _write_reordered(path: str, output: str | None, order_path: str, source: str):
+    """按 order_path 的 (偏移, 长度) 从普通文件 source（path 本身或解压出的 spool）拷贝帧。"""
+    in_place = output is None or os.path.abspath(output) == os.path.abspath(path)
+    target = path if in_place else output
+    # 临时文件保留原后缀，open_xyz_writer 才会选对格式
+    tmp_out = os.path.join(os.path.dirname(os.path.abspath(target)),
+                           ".bucket_tmp." + os.path.basename(target))
+    writer = open_xyz_writer(tmp_out)
+    buf = open_mmap(source)
+    for _, off, length in _iter_struct(order_path, struct.Struct("<qqq")):
+        writer.write_frame(bytes(buf[off:off + length]))
+    if isinstance(buf, mmap.mmap):
+        buf.close()
+    writer.close()
+    os.replace(tmp_out, target)
+    if codec_of(target):
+        os.replace(tmp_out + INDEX_SUFFIX, target + INDEX_SUFFIX)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按原子数/组成把 extxyz 重排成 batch 大小的桶（桶内分层洗牌）")
+    ap.add_argument("input")
+    ap.add_argument("-o", "--output", default=None, help="输出 xyz（与 --in_place 二选一）")
+    ap.add_argument("--in_place", action="store_true", help="原地替换输入文件")
+    ap.add_argument("--perm_only", action="store_true", help="不写 xyz，只写 --perm_out")
+    ap.add_argument("--perm_out", default=None, help="逐帧置换：第 k 行为新第 k 帧的原序号")
+    ap.add_argument("--batch", type=int, default=1000, help="桶大小（与 NEP 的 batch 一致）")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--keep_bucket_order", action="store_true",
+                    help="桶按原子数从小到大排列（默认打乱桶的先后）")
+    ap.add_argument("--mapping", default=None, help="同步重写的 mapping_log.csv")
+    ap.add_argument("--split", default="train", help="mapping 中与该 xyz 对应的 split")
+    ap.add_argument("--run_records", type=int, default=1_000_000,
+                    help="外部排序每个 run 的记录数（控制内存）")
+    ap.add_argument("--tmpdir", default=None, help="外部排序临时目录")
+    args = ap.parse_args()
+
+    if args.perm_only:
+        if not args.perm_out:
+            ap.error("--perm_only needs --perm_out")
+    elif bool(args.output) == args.in_place:
+        ap.error("give exactly one of -o/--output or --in_place (or use --perm_only)")
+
+    n = reorder_file(args.input, args.output, args.batch, args.seed, args.mapping, args.split,
+                     args.perm_out, not args.keep_bucket_order, args.run_records,
+                     write_xyz=not args.perm_only, tmpdir=args.tmpdir)
+    print(f"Reordered {n} frames into {-(-n // args.batch) if n else 0} buckets of {args.batch}")
+    for p in (args.output or (args.input if args.in_place else None), args.perm_out, args.mapping):
+        if p:
+            print(f"Wrote: {p}")
+
+
+if __name__ == "__main__":
+    main()
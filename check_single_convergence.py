@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
+import csv
 import glob
 
+from compressed_io import open_text, resolve_variant
+from cost_profile import TimingScan, TIMING_FIELDS
+
 # ======================
 # 1. 根目录配置
 # ======================
@@ -30,6 +34,7 @@ root_dirs += ["purega", "pureC"]
 
 # 输出文件
 ERROR_FILE = "error.out"
+TIMING_FILE = "timing.csv"   # 每个 frame 的核数/规模/计时，供 cost_profile.py 分析
 
 
 # ======================
@@ -37,12 +42,13 @@ ERROR_FILE = "error.out"
 # ======================
 
 def get_nelm(incar_path: str, default_nelm: int = 60) -> int:
-    """从 INCAR 中读取 NELM；如果没有则返回默认值"""
+    """从 INCAR（可为 .gz/.xz/.zst）中读取 NELM；如果没有则返回默认值"""
     nelm = default_nelm
-    if not os.path.isfile(incar_path):
+    incar_path = resolve_variant(incar_path)
+    if incar_path is None or not os.path.isfile(incar_path):
         return nelm
 
-    with open(incar_path, "r") as f:
+    with open_text(incar_path) as f:
         for line in f:
             # 去掉注释（! 或 # 后面）
             raw = line.split("!")[0].split("#")[0]
@@ -54,44 +60,51 @@ def get_nelm(incar_path: str, default_nelm: int = 60) -> int:
     return nelm
 
 
-def check_convergence(frame_dir: str) -> bool:
+def scan_frame(frame_dir: str) -> tuple[bool, dict | None]:
     """
-    根据 OUTCAR 判断单点能是否收敛：
+    根据 OUTCAR（OUTCAR 不存在时依次找 OUTCAR.gz/.xz/.zst，流式解压）判断单点能是否收敛，
+    同一遍扫描里顺便收集计时信息（TimingScan），返回 (是否收敛, 计时 dict 或 None)：
 
     1）如果 OUTCAR 中包含 "aborting loop because EDIFF is reached" -> 收敛
     2）否则，统计 DAV:/RMM: 行数 = NELEC，读取 INCAR 中 NELM（默认 60）：
         - 若 NELEC == NELM -> 电子在最大步数内未收敛 -> 不收敛
         - 其它情况 -> 视为不收敛/异常
     """
-    outcar = os.path.join(frame_dir, "OUTCAR")
+    outcar = resolve_variant(os.path.join(frame_dir, "OUTCAR"))
     incar = os.path.join(frame_dir, "INCAR")
 
-    if not os.path.isfile(outcar):
+    if outcar is None or not os.path.isfile(outcar):
         # 没有 OUTCAR，肯定不收敛
-        return False
+        return False, None
 
     nelm = get_nelm(incar)
 
     converged = False
     nelec = 0
+    timing = TimingScan()
 
     # 按行扫描，避免一次性读入特别大的 OUTCAR
-    with open(outcar, "r", errors="ignore") as f:
+    with open_text(outcar) as f:
         for line in f:
             if "aborting loop because EDIFF is reached" in line:
                 converged = True
             if "DAV:" in line or "RMM:" in line:
                 nelec += 1
+            timing.feed(line)
 
     if converged:
-        return True
+        return True, timing.result()
 
     # 没有收敛语句，且电子步数达到 NELM -> 明确不收敛
     if nelec >= nelm:
-        return False
+        return False, timing.result()
 
     # 步数没跑满 NELM 又没有收敛语句，多半是异常终止，也算不收敛
-    return False
+    return False, timing.result()
+
+
+def check_convergence(frame_dir: str) -> bool:
+    return scan_frame(frame_dir)[0]
 
 
 # ======================
@@ -102,6 +115,9 @@ def main():
     # 清空上一轮 error.out
     with open(ERROR_FILE, "w") as f:
         pass
+    timing_f = open(TIMING_FILE, "w", newline="")
+    timing_csv = csv.DictWriter(timing_f, fieldnames=TIMING_FIELDS)
+    timing_csv.writeheader()
 
     total_frames = 0
     conv_frames = 0
@@ -128,7 +144,12 @@ def main():
             total_frames += 1
             abs_path = os.path.abspath(frame)
 
-            if check_convergence(frame):
+            converged, timing = scan_frame(frame)
+            if timing is not None:
+                timing_csv.writerow({"frame_dir": abs_path, "root": root,
+                                     "converged": int(converged), **timing})
+
+            if converged:
                 conv_frames += 1
                 print(f"  [OK] 收敛:   {abs_path}")
             else:
@@ -137,11 +158,14 @@ def main():
                 with open(ERROR_FILE, "a") as f:
                     f.write(abs_path + "\n")
 
+    timing_f.close()
+
     print("\n===== 统计 =====")
     print(f"总计 frame 目录数:    {total_frames}")
     print(f"收敛:                 {conv_frames}")
     print(f"不收敛/异常:          {unconv_frames}")
     print(f"不收敛路径已写入:     {os.path.abspath(ERROR_FILE)}")
+    print(f"计时表已写入:         {os.path.abspath(TIMING_FILE)}（python cost_profile.py 分析）")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+compressed_io.py
+
+透明读取压缩的 VASP 输出：
+- OUTCAR.gz / OUTCAR.xz / OUTCAR.zst（zst 需要 zstandard 包）均按流式解压读取；
+- "<archive>::<member>" 形式的路径表示 pack_frames.py 打包的 root 归档中的一个成员，
+  通过归档的成员偏移表直接 seek 读取，不需要解包。
+
+常用入口：open_text(path)、resolve_variant(path)、file_size(path)。
+"""
+
+import functools
+import gzip
+import io
+import json
+import lzma
+import os
+import tarfile
+
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".zst")
+ARCHIVE_SEP = "::"
+ARCHIVE_SUFFIX = ".frames.tar"
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+
+
+def strip_compression_suffix(name: str) -> str:
+    for suf in COMPRESSED_SUFFIXES:
+        if name.endswith(suf):
+            return name[: -len(suf)]
+    return name
+
+
+def compression_of(name: str) -> str | None:
+    for suf in COMPRESSED_SUFFIXES:
+        if name.endswith(suf):
+            return suf[1:]
+    return None
+
+
+def resolve_variant(path: str) -> str | None:
+    """path 存在则返回 path，否则依次尝试 path.gz / .xz / .zst，都没有返回 None。"""
+    if os.path.exists(path):
+        return path
+    for suf in COMPRESSED_SUFFIXES:
+        if os.path.exists(path + suf):
+            return path + suf
+    return None
+
+
+def _zstd_reader(raw):
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("reading .zst files needs the 'zstandard' package "
+                           "(pip install zstandard)") from e
+    return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+
+
+class _OwningRaw(io.RawIOBase):
+    """把解压流包装成 RawIOBase；关闭时连同底层文件一起关闭（GzipFile/LZMAFile 不会关传入的 fileobj）。"""
+
+    def __init__(self, stream, *owned):
+        self._stream = stream
+        self._owned = owned
+        self.name = getattr(owned[0], "name", "") if owned else ""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._stream.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+            for f in self._owned:
+                f.close()
+        super().close()
+
+
+def _decompress(raw, name: str):
+    kind = compression_of(name)
+    if kind == "gz":
+        dec = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif kind == "xz":
+        dec = lzma.LZMAFile(raw, mode="rb")
+    elif kind == "zst":
+        return io.BufferedReader(_zstd_reader(raw))
+    else:
+        return raw
+    return io.BufferedReader(_OwningRaw(dec, raw), buffer_size=1 << 16)
+
+
+class _SliceReader(io.RawIOBase):
+    """只读文件中 [offset, offset+size) 这一段（归档成员）。"""
+
+    def __init__(self, path: str, offset: int, size: int):
+        self._f = open(path, "rb")
+        self._f.seek(offset)
+        self._left = size
+        self.name = path
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._left <= 0:
+            return 0
+        n = min(len(b), self._left)
+        got = self._f.readinto(memoryview(b)[:n])
+        self._left -= got
+        return got
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class _NamedText(io.TextIOWrapper):
+    """TextIOWrapper 的 name 取自底层流；压缩/归档流没有文件名时用这里给的名字。"""
+
+    def __init__(self, buffer, name: str, **kwargs):
+        super().__init__(buffer, **kwargs)
+        self._display_name = name
+
+    @property
+    def name(self):
+        return self._display_name
+
+
+# ——— 归档（pack_frames.py）———
+
+def index_path(archive: str) -> str:
+    return archive + INDEX_SUFFIX
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and (path.endswith(ARCHIVE_SUFFIX) or os.path.isfile(index_path(path)))
+
+
+def build_archive_index(archive: str) -> dict:
+    """扫描 tar 头重建成员偏移表（sidecar 索引丢失时使用）。"""
+    frames: dict[str, dict] = {}
+    with tarfile.open(archive, "r:") as tf:
+        for ti in tf:
+            if not ti.isfile():
+                continue
+            rel, _, fname = ti.name.rpartition("/")
+            frames.setdefault(rel, {})[fname] = [ti.offset_data, ti.size, ti.mtime]
+    return {"version": INDEX_VERSION, "frames": frames}
+
+
+@functools.lru_cache(maxsize=64)
+def load_archive_index(archive: str) -> dict:
+    ipath = index_path(archive)
+    if os.path.isfile(ipath):
+        with open(ipath) as f:
+            data = json.load(f)
+        if data.get("version") == INDEX_VERSION:
+            return data
+    return build_archive_index(archive)
+
+
+def split_archive_path(path: str):
+    """'a.frames.tar::frame_1/OUTCAR' -> ('a.frames.tar', 'frame_1', 'OUTCAR')；普通路径返回 None。"""
+    if ARCHIVE_SEP not in path:
+        return None
+    archive, member = path.split(ARCHIVE_SEP, 1)
+    rel, _, fname = member.rpartition("/")
+    return archive, rel, fname
+
+
+def _member_entry(path: str):
+    archive, rel, fname = split_archive_path(path)
+    try:
+        return archive, load_archive_index(archive)["frames"][rel][fname]
+    except KeyError:
+        raise FileNotFoundError(path) from None
+
+
+# ——— 对外接口 ———
+
+def open_binary(path: str):
+    """以二进制流打开（自动解压；支持归档成员）。"""
+    if ARCHIVE_SEP in path:
+        archive, (offset, size, _) = _member_entry(path)
+        raw = io.BufferedReader(_SliceReader(archive, offset, size))
+    else:
+        raw = open(path, "rb")
+    return _decompress(raw, path)
+
+
+def open_text(path: str, errors: str = "ignore"):
+    return _NamedText(open_binary(path), path, encoding="utf-8", errors=errors)
+
+
+def file_size(path: str) -> int:
+    """磁盘上（压缩后）的字节数。"""
+    if ARCHIVE_SEP in path:
+        return _member_entry(path)[1][1]
+    return os.path.getsize(path)
+
+
+def file_mtime(path: str) -> float:
+    if ARCHIVE_SEP in path:
+        return _member_entry(path)[1][2]
+    return os.path.getmtime(path)
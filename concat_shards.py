@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+concat_shards.py
+
+把 xyz_shards.py / 1218merge.py --shard_frames 写出的分片按 manifest.json 的顺序拼回一个文件
+（GPUMD 训练只读单个 train.xyz）：
+- 先并行校验各分片的 sha256（--no_verify 跳过），不一致或缺文件直接报错，不写输出；
+- 普通分片 -> 普通输出：整文件流式拷贝；其它组合（.gz/.zst 分片或输出）逐帧读写，
+  输出为 .gz/.zst 时重新分块压缩；
+- 先写临时文件，帧数与 manifest 对上后再改名为目标文件；
+- 不完整的 manifest（写入被中断）拒绝拼接，除非给 --allow_partial。
+
+用法：
+  python concat_shards.py train_shards -o train.xyz
+  python concat_shards.py train_shards/manifest.json -o train.xyz.zst --no_verify
+"""
+
+import argparse
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from block_xyz import codec_of, open_frame_reader, open_xyz_writer, INDEX_SUFFIX, DEFAULT_FRAMES_PER_BLOCK
+from xyz_shards import load_manifest, sha256_file
+
+
+def verify_shards(manifest: dict, jobs: int = 4) -> list[str]:
+    """返回校验失败的说明（空列表表示全部通过）。"""
+    def check(e):
+        path = os.path.join(manifest["directory"], e["file"])
+        if not os.path.isfile(path):
+            return f"{e['file']}: missing"
+        if os.path.getsize(path) != e["size"]:
+            return f"{e['file']}: size {os.path.getsize(path)} != {e['size']}"
+        if sha256_file(path) != e["sha256"]:
+            return f"{e['file']}: sha256 mismatch"
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        return [r for r in ex.map(check, manifest["shards"]) if r]
+
+
+def concat(manifest: dict, output: str, frames_per_block: int = DEFAULT_FRAMES_PER_BLOCK) -> int:
+    """按顺序拼接分片到 output（先写临时文件再改名），返回帧数。"""
+    directory = manifest["directory"]
+    tmp = os.path.join(os.path.dirname(os.path.abspath(output)), "." + os.path.basename(output))
+    frames = 0
+    if not codec_of(output) and not codec_of("x" + manifest["suffix"]):
+        with open(tmp, "wb") as fo:
+            for e in manifest["shards"]:
+                with open(os.path.join(directory, e["file"]), "rb") as fi:
+                    shutil.copyfileobj(fi, fo, 1 << 22)
+                frames += e["frames"]
+    else:
+        writer = open_xyz_writer(tmp, frames_per_block)
+        for e in manifest["shards"]:
+            reader = open_frame_reader(os.path.join(directory, e["file"]))
+            try:
+                n = 0
+                for data in reader.iter_frame_bytes():
+                    writer.write_frame(data)
+                    n += 1
+            finally:
+                reader.close()
+            if n != e["frames"]:
+                writer.close()
+                os.remove(tmp)
+                raise SystemExit(f"[ERROR] {e['file']}: {n} frames, manifest says {e['frames']}")
+            frames += n
+        writer.close()
+    if os.path.exists(tmp + INDEX_SUFFIX):
+        os.replace(tmp + INDEX_SUFFIX, output + INDEX_SUFFIX)
+    os.replace(tmp, output)
+    return frames
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按 manifest.json 把分片拼回单个 extxyz")
+    ap.add_argument("manifest", help="分片目录或其中的 manifest.json")
+    ap.add_argument("-o", "--output", required=True, help="输出文件（.gz/.zst 结尾时分块压缩）")
+    ap.add_argument("--frames_per_block", type=int, default=DEFAULT_FRAMES_PER_BLOCK,
+                    help="压缩输出每块帧数")
+    ap.add_argument("--no_verify", action="store_true", help="不校验分片 sha256")
+    ap.add_argument("--allow_partial", action="store_true", help="允许拼接未写完的 manifest")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="并行校验的线程数")
+    args = ap.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    if not manifest["complete"] and not args.allow_partial:
+        raise SystemExit(f"[ERROR] manifest in {manifest['directory']} is incomplete (interrupted run?); "
+                         f"resume the run or pass --allow_partial")
+    if not args.no_verify:
+        bad = verify_shards(manifest, args.jobs)
+        for msg in bad:
+            print(f"[CORRUPT] {msg}")
+        if bad:
+            raise SystemExit(f"[ERROR] {len(bad)} shards failed verification, nothing written")
+    n = concat(manifest, args.output, args.frames_per_block)
+    print(f"[CONCAT] {len(manifest['shards'])} shards, {n} frames -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cost_profile.py
+
+DFT 机时剖析：
+1) TimingScan：逐行喂 OUTCAR，收集核数（mpi-ranks × threads/rank 或 total cores）、NIONS、NELECT、
+   NKPTS、NBANDS、组成（POTCAR + ions per type）、电子步数与 LOOP: real time 之和、离子步数、
+   Total CPU time used、Elapsed time；check_single_convergence.py 在判断收敛的同一遍扫描里调用它，
+   把每个 frame 一行写进 timing.csv；
+2) 本脚本读 timing.csv：
+   - 按 root / 原子数 / 体系（元素集合）汇总核时；
+   - 拟合 log(核秒) = c0 + c1·log(NIONS) + c2·log(NELECT) + c3·log(NKPTS)，导出 JSON 给排程估算用；
+   - 标出比同组（同 root、同原子数，至少 --min_peers 个）中位数慢 --factor 倍（默认 10）的 frame；
+     同组太少时与模型预测值比较。
+
+用法：
+  python check_single_convergence.py           # 同时写 timing.csv
+  python cost_profile.py timing.csv --model_json cost_model.json --outliers_csv slow_frames.csv
+"""
+
+import argparse
+import csv
+import json
+import math
+import re
+import statistics
+
+import numpy as np
+
+from scf_stream import parse_loop_line
+
+TIMING_FIELDS = ("frame_dir", "root", "converged", "cores", "nions", "nelect", "nkpts", "nbands",
+                 "formula", "scf_steps", "ionic_steps", "scf_seconds", "cpu_time", "elapsed",
+                 "core_hours")
+MODEL_FEATURES = ("nions", "nelect", "nkpts")
+
+_RANKS_RE = re.compile(r"running\s+(\d+)\s+mpi-ranks,\s+with\s+(\d+)\s+threads/rank")
+_CORES_RE = re.compile(r"running on\s+(\d+)\s+(?:total cores|nodes)")
+_INT_TAG_RE = {tag: re.compile(tag + r"\s*=\s*(\d+)") for tag in ("NIONS", "NKPTS", "NBANDS")}
+_NELECT_RE = re.compile(r"NELECT\s*=\s*([-\d.]+)")
+
+
+def _float_after_colon(line: str) -> float | None:
+    try:
+        return float(line.rsplit(":", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class TimingScan:
+    """逐行累积一个 OUTCAR 的计时与规模信息；result() 返回 timing.csv 的一行（不含 frame_dir/root/converged）。"""
+
+    def __init__(self):
+        self.cores = None
+        self.ints = {}
+        self.nelect = None
+        self.potcars = []
+        self.ions_per_type = None
+        self.scf_steps = 0
+        self.ionic_steps = 0
+        self.scf_seconds = 0.0
+        self.cpu_time = None
+        self.elapsed = None
+
+    def feed(self, line: str):
+        if "LOOP" in line:
+            rec = parse_loop_line(line)
+            if rec:
+                ionic, _, real = rec
+                if ionic:
+                    self.ionic_steps += 1
+                else:
+                    self.scf_steps += 1
+                    if not math.isnan(real):
+                        self.scf_seconds += real
+            return
+        if "time" in line:
+            if "Elapsed time (sec):" in line:
+                self.elapsed = _float_after_colon(line)
+            elif "Total CPU time used (sec):" in line:
+                self.cpu_time = _float_after_colon(line)
+            return
+        if self.cores is None and "running" in line:
+            m = _RANKS_RE.search(line)
+            if m:
+                self.cores = int(m.group(1)) * int(m.group(2))
+            else:
+                m = _CORES_RE.search(line)
+                if m:
+                    self.cores = int(m.group(1))
+            return
+        if "POTCAR:" in line:
+            parts = line.split()
+            if len(parts) >= 3:
+                self.potcars.append(parts[2].split("_")[0])
+            return
+        if self.ions_per_type is None and "ions per type" in line:
+            self.ions_per_type = [int(x) for x in line.split("=")[1].split()]
+            return
+        if "NELECT" in line and self.nelect is None:
+            m = _NELECT_RE.search(line)
+            if m:
+                self.nelect = float(m.group(1))
+        for tag, rx in _INT_TAG_RE.items():
+            if tag not in self.ints and tag in line:
+                m = rx.search(line)
+                if m:
+                    self.ints[tag] = int(m.group(1))
+
+    def formula(self) -> str:
+        if not self.ions_per_type:
+            return ""
+        # POTCAR: 行在 OUTCAR 开头出现两遍，只取前 len(ions per type) 个
+        syms = self.potcars[:len(self.ions_per_type)]
+        if len(syms) != len(self.ions_per_type):
+            return ""
+        comp: dict[str, int] = {}
+        for s, n in zip(syms, self.ions_per_type):
+            comp[s] = comp.get(s, 0) + n
+        return "".join(f"{s}{comp[s]}" for s in sorted(comp))
+
+    def result(self) -> dict:
+        core_hours = None
+        if self.elapsed is not None and self.cores:
+            core_hours = self.elapsed * self.cores / 3600.0
+        return {
+            "cores": self.cores,
+            "nions": self.ints.get("NIONS"),
+            "nelect": self.nelect,
+            "nkpts": self.ints.get("NKPTS"),
+            "nbands": self.ints.get("NBANDS"),
+            "formula": self.formula(),
+            "scf_steps": self.scf_steps,
+            "ionic_steps": self.ionic_steps,
+            "scf_seconds": round(self.scf_seconds, 3),
+            "cpu_time": self.cpu_time,
+            "elapsed": self.elapsed,
+            "core_hours": None if core_hours is None else round(core_hours, 6),
+        }
+
+
+# ======================
+# 汇总与模型
+# ======================
+
+def _num(v: str):
+    if v in ("", "None", None):
+        return None
+    try:
+        x = float(v)
+    except ValueError:
+        return v
+    return int(x) if x.is_integer() and "." not in v else x
+
+
+def load_timing(path: str) -> list[dict]:
+    with open(path, newline="") as f:
+        rows = []
+        for r in csv.DictReader(f):
+            rows.append({k: (v if k in ("frame_dir", "root", "formula") else _num(v)) for k, v in r.items()})
+    return rows
+
+
+def system_of(formula: str) -> str:
+    """C2Ga1 -> C-Ga"""
+    return "-".join(re.findall(r"[A-Z][a-z]?", formula or "")) or "?"
+
+
+def aggregate(rows: list[dict], key) -> list[dict]:
+    """按 key(row) 分组汇总核时；按总核时降序。"""
+    groups: dict = {}
+    for r in rows:
+        if r.get("core_hours") is None:
+            continue
+        groups.setdefault(key(r), []).append(r)
+    total = sum(r["core_hours"] for g in groups.values() for r in g) or 1.0
+    out = []
+    for k, g in groups.items():
+        ch = [r["core_hours"] for r in g]
+        steps = [r["scf_steps"] for r in g if r.get("scf_steps")]
+        out.append({
+            "group": k,
+            "frames": len(g),
+            "core_hours": sum(ch),
+            "share": sum(ch) / total,
+            "median_core_hours": statistics.median(ch),
+            "median_scf_steps": statistics.median(steps) if steps else None,
+        })
+    out.sort(key=lambda d: -d["core_hours"])
+    return out
+
+
+def _usable(r: dict) -> bool:
+    return all(isinstance(r.get(k), (int, float)) and r[k] > 0 for k in MODEL_FEATURES + ("core_hours",))
+
+
+def fit_cost_model(rows: list[dict]) -> dict:
+    """最小二乘拟合 log(核秒) 对 log(NIONS)、log(NELECT)、log(NKPTS) 的线性模型。"""
+    data = [r for r in rows if _usable(r)]
+    if len(data) < len(MODEL_FEATURES) + 1:
+        raise ValueError(f"need at least {len(MODEL_FEATURES) + 1} frames with timing, got {len(data)}")
+    X = np.array([[1.0] + [math.log(r[k]) for k in MODEL_FEATURES] for r in data])
+    y = np.array([math.log(r["core_hours"] * 3600.0) for r in data])
+    coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+    resid = y - X @ coef
+    return {
+        "target": "core_seconds",
+        "form": "log(core_seconds) = intercept + sum(coef[k] * log(k))",
+        "intercept": float(coef[0]),
+        "coef": {k: float(c) for k, c in zip(MODEL_FEATURES, coef[1:])},
+        "rmse_log": float(np.sqrt(np.mean(resid ** 2))),
+        "frames": len(data),
+    }
+
+
+def predict_core_seconds(model: dict, **features) -> float:
+    s = model["intercept"]
+    for k, c in model["coef"].items():
+        s += c * math.log(features[k])
+    return math.exp(s)
+
+
+def find_outliers(rows: list[dict], model: dict | None, factor: float = 10.0,
+                  min_peers: int = 3) -> list[dict]:
+    """比同组中位数（同组不足 min_peers 个时用模型预测）慢 factor 倍以上的 frame。"""
+    peers: dict = {}
+    for r in rows:
+        if r.get("core_hours"):
+            peers.setdefault((r["root"], r["nions"]), []).append(r["core_hours"])
+    out = []
+    for r in rows:
+        if not r.get("core_hours"):
+            continue
+        group = peers[(r["root"], r["nions"])]
+        if len(group) >= min_peers:
+            ref, basis = statistics.median(group), "peers"
+        elif model is not None and _usable(r):
+            ref = predict_core_seconds(model, **{k: r[k] for k in MODEL_FEATURES}) / 3600.0
+            basis = "model"
+        else:
+            continue
+        if ref > 0 and r["core_hours"] >= factor * ref:
+            out.append({"frame_dir": r["frame_dir"], "root": r["root"], "nions": r["nions"],
+                        "core_hours": r["core_hours"], "reference": ref,
+                        "ratio": r["core_hours"] / ref, "basis": basis,
+                        "scf_steps": r.get("scf_steps")})
+    out.sort(key=lambda d: -d["ratio"])
+    return out
+
+
+def _print_table(title: str, groups: list[dict], top: int):
+    print(f"\n=== {title} ===")
+    print(f"{'group':40s} {'frames':>7s} {'core-h':>10s} {'share':>6s} {'median':>9s} {'scf':>5s}")
+    for g in groups[:top]:
+        scf = "-" if g["median_scf_steps"] is None else f"{g['median_scf_steps']:.0f}"
+        print(f"{str(g['group'])[-40:]:40s} {g['frames']:7d} {g['core_hours']:10.2f} "
+              f"{g['share'] * 100:5.1f}% {g['median_core_hours']:9.4f} {scf:>5s}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按 root/原子数/体系汇总 VASP 核时，拟合代价模型并找出异常慢的 frame")
+    ap.add_argument("timing_csv", nargs="?", default="timing.csv", help="check_single_convergence.py 写的 timing.csv")
+    ap.add_argument("--top", type=int, default=20, help="每张表显示的组数")
+    ap.add_argument("--model_json", default=None, help="导出代价模型（JSON）")
+    ap.add_argument("--factor", type=float, default=10.0, help="慢于同组中位数多少倍算异常")
+    ap.add_argument("--min_peers", type=int, default=3, help="同组至少多少个 frame 才用同组中位数作参照")
+    ap.add_argument("--outliers_csv", default=None, help="异常 frame 明细")
+    args = ap.parse_args()
+
+    rows = load_timing(args.timing_csv)
+    timed = [r for r in rows if r.get("core_hours") is not None]
+    print(f"frames={len(rows)}, with timing={len(timed)}, "
+          f"total core-hours={sum(r['core_hours'] for r in timed):.2f}")
+
+    _print_table("by root", aggregate(rows, lambda r: r["root"]), args.top)
+    _print_table("by atom count", aggregate(rows, lambda r: r["nions"]), args.top)
+    _print_table("by system", aggregate(rows, lambda r: system_of(r["formula"])), args.top)
+
+    model = None
+    try:
+        model = fit_cost_model(rows)
+    except ValueError as e:
+        print(f"\n[WARN] cost model not fitted: {e}")
+    if model is not None:
+        terms = " ".join(f"{c:+.3f}*log({k})" for k, c in model["coef"].items())
+        print(f"\ncost model: log(core_s) = {model['intercept']:.3f} {terms}  "
+              f"(rmse_log={model['rmse_log']:.3f}, n={model['frames']})")
+        if args.model_json:
+            with open(args.model_json, "w") as f:
+                json.dump(model, f, indent=1)
+            print(f"Wrote: {args.model_json}")
+
+    outliers = find_outliers(rows, model, args.factor, args.min_peers)
+    print(f"\n=== frames >= {args.factor:g}x slower than peers: {len(outliers)} ===")
+    for o in outliers[:args.top]:
+        print(f"  [SLOW] {o['ratio']:6.1f}x ({o['basis']}) {o['core_hours']:.4f} core-h  {o['frame_dir']}")
+    if args.outliers_csv:
+        with open(args.outliers_csv, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=["frame_dir", "root", "nions", "core_hours", "reference",
+                                              "ratio", "basis", "scf_steps"])
+            w.writeheader()
+            w.writerows(outliers)
+        print(f"Wrote: {args.outliers_csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
-from ase.io import read
 import sys
-# 读取 train.xyz 的所有帧
-frames = read(sys.argv[1],index=":")
 
-print("Number of frames in train.xyz:", len(frames))
+from block_xyz import frame_count
+
+# 只切分帧边界统计 train.xyz 的帧数（不导入 ASE；.gz/.zst 分块压缩文件直接读 .fidx）
+n = frame_count(sys.argv[1])
+
+print("Number of frames in train.xyz:", n)
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-from ase.io import read, write
 import argparse
 
+from block_xyz import open_frame_reader, open_xyz_writer
+
 
 def parse_frame_list(s, one_based=False):
     """
@@ -37,7 +38,7 @@ def parse_frame_list(s, one_based=False):
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Delete specific frames or frame ranges from a train.xyz file."
+        description="Delete specific frames or frame ranges from a train.xyz file (plain or block-compressed .gz/.zst)."
     )
     parser.add_argument("input", help="输入文件，例如 train.xyz")
     parser.add_argument("output", help="输出文件，例如 new_train.xyz")
@@ -52,8 +53,8 @@ def main():
 
     args = parser.parse_args()
 
-    images = read(args.input, ":")
-    total = len(images)
+    reader = open_frame_reader(args.input)
+    total = len(reader)
     print(f"共有 {total} 帧")
 
     # 解析用户输入
@@ -65,11 +66,14 @@ def main():
         if idx < 0 or idx >= total:
             raise IndexError(f"帧号 {idx} 越界（共有 {total} 帧）")
 
-    # 删除帧（按降序删除避免索引变化）
-    for idx in sorted(del_list, reverse=True):
-        del images[idx]
-
-    write(args.output, images)
+    # 其余帧按原顺序原样拷贝（分块压缩输入会并行解压各块）
+    to_delete = set(del_list)
+    writer = open_xyz_writer(args.output)
+    for idx, frame in enumerate(reader.iter_frame_bytes()):
+        if idx not in to_delete:
+            writer.write_frame(frame)
+    writer.close()
+    reader.close()
     print(f"已删除 {len(del_list)} 个帧，输出文件: {args.output}")
 
 
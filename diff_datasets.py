@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+diff_datasets.py
+
+比较两个带标签的数据集（重算 DFT、换 merge 脚本前后），逐帧给出能量/力/virial 的变化：
+- 对齐方式（--key）：
+  provenance 按来源键 root + frame_dir/frame + source + ionic_step；
+  content    按元素 + 坐标的精确哈希；
+  auto       看两边第一帧：来源键相同用 provenance，结构哈希相同用 content，
+             都不同时两边都有 frame_dir/frame 则用 provenance，否则 content；
+- 两个文件顺序一致时逐帧同步读取（lockstep）；第一次遇到键不一致（或帧数不同），
+  对剩余部分改为按键连接：B 的剩余帧只建 键 -> 帧号 的索引，A 的每帧按索引随机读取 B 对应帧；
+- 配对的帧攒成批（--batch 帧），用 NumPy 对整批一起算：
+  能量差 dE/atom (B - A)，力 RMSE（按分量）与最大 |ΔF|（按原子），virial 差/atom 的 RMSE 与最大分量；
+- 输出：按 root 汇总（终端表格 + --summary_csv），逐帧结果（--frames_csv），
+  按 --rank_by 排序的最差 --top 帧，以及只在一边出现的帧（--unmatched_csv）。
+  同一来源键但结构不同（原子数/坐标变了）的帧 same_structure=0，原子数不同时力记为 nan。
+
+用法：
+  python diff_datasets.py old/train.xyz new/train.xyz
+  python diff_datasets.py a.xyz.zst b.xyz --key content --rank_by energy --top 50
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+
+import numpy as np
+
+from block_xyz import open_frame_reader
+from union_xyz import frame_arrays, content_hash
+
+KEY_MODES = ("auto", "provenance", "content")
+METRICS = ("dE_per_atom", "force_rmse", "force_max", "virial_rmse", "virial_max")
+RANK_BY = {"energy": "dE_per_atom", "force_rmse": "force_rmse", "force": "force_max",
+           "virial": "virial_max"}
+FRAME_FIELDS = ["a_index", "b_index", "root", "frame_dir", "natoms", "same_structure"] + list(METRICS)
+SUMMARY_FIELDS = ["root", "frames", "energy_mae", "energy_rmse", "energy_max",
+                  "force_rmse", "force_max", "virial_rmse", "virial_max"]
+
+
+def frame_key(fa: dict, mode: str):
+    return fa["prov"] if mode == "provenance" else content_hash(fa)
+
+
+def _nan33(n: int) -> np.ndarray:
+    return np.full((n, 3), np.nan)
+
+
+class _Batch:
+    """攒一批配对帧，flush 时整批向量化计算各指标。"""
+
+    def __init__(self):
+        self.meta = []   # (a_index, b_index, root, frame_dir, natoms, same_structure)
+        self.ea, self.eb, self.fa, self.fb, self.va, self.vb = [], [], [], [], [], []
+
+    def __len__(self):
+        return len(self.meta)
+
+    def add(self, i: int, j: int, a: dict, b: dict):
+        n = a["natoms"]
+        same = a["natoms"] == b["natoms"] and a["species"] == b["species"] \
+            and np.array_equal(a["positions"], b["positions"])
+        self.meta.append((i, j, a["root"], a["frame_dir"], n, int(same)))
+        self.ea.append(np.nan if a["energy"] is None else a["energy"])
+        self.eb.append(np.nan if b["energy"] is None else b["energy"])
+        comparable = a["natoms"] == b["natoms"] and a["forces"] is not None and b["forces"] is not None
+        self.fa.append(a["forces"] if comparable else _nan33(n))
+        self.fb.append(b["forces"] if comparable else _nan33(n))
+        nan9 = np.full(9, np.nan)
+        self.va.append(a["virial"] if a["virial"] is not None and len(a["virial"]) == 9 else nan9)
+        self.vb.append(b["virial"] if b["virial"] is not None and len(b["virial"]) == 9 else nan9)
+
+    def compute(self) -> dict:
+        """整批的逐帧指标（各为长度 = 帧数的数组）。"""
+        nat = np.array([m[4] for m in self.meta], dtype=np.int64)
+        safe = np.maximum(nat, 1)
+        out = {"natoms": nat}
+        out["dE_per_atom"] = (np.array(self.eb) - np.array(self.ea)) / safe
+
+        d2 = ((np.concatenate(self.fb) - np.concatenate(self.fa)) ** 2).sum(axis=1)  # 每原子 |ΔF|^2
+        f_sq = np.full(len(nat), np.nan)
+        f_max = np.full(len(nat), np.nan)
+        has = nat > 0
+        if has.any():
+            starts = np.concatenate(([0], np.cumsum(nat)[:-1]))[has]
+            f_sq[has] = np.add.reduceat(d2, starts)
+            f_max[has] = np.sqrt(np.maximum.reduceat(d2, starts))
+        out["force_sq"] = f_sq
+        out["force_rmse"] = np.sqrt(f_sq / (3 * safe))
+        out["force_max"] = f_max
+
+        dv = (np.array(self.vb) - np.array(self.va)) / safe[:, None]
+        out["virial_sq"] = (dv ** 2).sum(axis=1)
+        out["virial_rmse"] = np.sqrt(out["virial_sq"] / 9)
+        out["virial_max"] = np.abs(dv).max(axis=1)
+        return out
+
+
+class _RootStats:
+    """按 root 累加；nan（缺标签）不计入对应指标。"""
+
+    def __init__(self):
+        self.acc: dict[str, dict] = {}
+
+    def _get(self, root: str) -> dict:
+        if root not in self.acc:
+            self.acc[root] = {"frames": 0, "n_e": 0, "abs_e": 0.0, "sq_e": 0.0, "max_e": 0.0,
+                              "n_f": 0, "sq_f": 0.0, "max_f": 0.0,
+                              "n_v": 0, "sq_v": 0.0, "max_v": 0.0}
+        return self.acc[root]
+
+    def update(self, roots: np.ndarray, m: dict):
+        for root in np.unique(roots):
+            for key in (root, None):  # None：全部
+                sel = roots == root
+                a = self._get(key)
+                a["frames"] += int(sel.sum())
+                e = m["dE_per_atom"][sel]
+                e = e[np.isfinite(e)]
+                a["n_e"] += len(e)
+                a["abs_e"] += float(np.abs(e).sum())
+                a["sq_e"] += float((e ** 2).sum())
+                if len(e):
+                    a["max_e"] = max(a["max_e"], float(np.abs(e).max()))
+                ok = sel & np.isfinite(m["force_sq"])
+                a["n_f"] += int(3 * m["natoms"][ok].sum())
+                a["sq_f"] += float(m["force_sq"][ok].sum())
+                if ok.any():
+                    a["max_f"] = max(a["max_f"], float(m["force_max"][ok].max()))
+                ok = sel & np.isfinite(m["virial_sq"])
+                a["n_v"] += int(9 * ok.sum())
+                a["sq_v"] += float(m["virial_sq"][ok].sum())
+                if ok.any():
+                    a["max_v"] = max(a["max_v"], float(m["virial_max"][ok].max()))
+
+    def rows(self) -> list[list]:
+        def rms(s, n):
+            return np.sqrt(s / n) if n else np.nan
+
+        out = []
+        for root in sorted((r for r in self.acc if r is not None), key=str) + [None]:
+            if root not in self.acc:
+                continue
+            a = self.acc[root]
+            out.append(["ALL" if root is None else (root or "(no root)"), a["frames"],
+                        a["abs_e"] / a["n_e"] if a["n_e"] else np.nan, rms(a["sq_e"], a["n_e"]),
+                        a["max_e"] if a["n_e"] else np.nan,
+                        rms(a["sq_f"], a["n_f"]), a["max_f"] if a["n_f"] else np.nan,
+                        rms(a["sq_v"], a["n_v"]), a["max_v"] if a["n_v"] else np.nan])
+        return out
+
+
+def _pick_mode(ra, rb) -> str:
+    if not len(ra) or not len(rb):
+        return "content"
+    a, b = frame_arrays(ra.frame_bytes(0)), frame_arrays(rb.frame_bytes(0))
+    if a["prov"] is not None and a["prov"] == b["prov"]:
+        return "provenance"
+    if content_hash(a) == content_hash(b):
+        return "content"  # 如 merge.py 与 1218merge.py 的输出：来源字段写法不同，结构相同
+    return "provenance" if a["prov"] is not None and b["prov"] is not None else "content"
+
+
+def iter_pairs(ra, rb, mode: str, stats: dict):
+    """
+    产出 (i, j, A 帧, B 帧)。先 lockstep；第一次键不一致后对剩余帧按键连接。
+    stats 里记录 lockstep 配对数、连接配对数、a_only / b_only（帧号与来源）。
+    """
+    i = 0
+    mismatch = False
+    for ba, bb in zip(ra.iter_frame_bytes(), rb.iter_frame_bytes()):
+        a, b = frame_arrays(ba), frame_arrays(bb)
+        ka = frame_key(a, mode)
+        if ka is None or ka != frame_key(b, mode):
+            mismatch = True
+            break
+        yield i, i, a, b
+        i += 1
+    stats["lockstep"] = i
+    stats["a_only"], stats["b_only"] = [], []
+    if not mismatch and len(ra) == len(rb):
+        return
+
+    # 按键连接：B 剩余帧的 键 -> 帧号（同键只认第一帧）
+    index: dict = {}
+    for j, bb in enumerate(itertools.islice(rb.iter_frame_bytes(), i, None), start=i):
+        b = frame_arrays(bb)
+        k = frame_key(b, mode)
+        if k is None or k in index:
+            stats["b_only"].append((j, b["root"], b["frame_dir"]))
+            continue
+        index[k] = (j, b["root"], b["frame_dir"])
+    print(f"[JOIN] order differs after {i} frames, joining the remaining "
+          f"{len(ra) - i} x {len(rb) - i} frames by {mode} key")
+    joined = 0
+    for n, ba in enumerate(itertools.islice(ra.iter_frame_bytes(), i, None), start=i):
+        a = frame_arrays(ba)
+        k = frame_key(a, mode)
+        hit = index.pop(k, None) if k is not None else None
+        if hit is None:
+            stats["a_only"].append((n, a["root"], a["frame_dir"]))
+            continue
+        joined += 1
+        yield n, hit[0], a, frame_arrays(rb.frame_bytes(hit[0]))
+    stats["joined"] = joined
+    stats["b_only"].extend(index.values())
+
+
+def diff(path_a: str, path_b: str, key: str = "auto", batch: int = 2048, top: int = 20,
+         rank_by: str = "force", frames_csv: str | None = "diff_frames.csv") -> dict:
+    """返回 {"summary": 汇总行, "worst": 最差帧行, "stats": 配对计数, "mode": 对齐方式}。"""
+    ra, rb = open_frame_reader(path_a), open_frame_reader(path_b)
+    metric = RANK_BY[rank_by]
+    mode = _pick_mode(ra, rb) if key == "auto" else key
+    stats = {"lockstep": 0, "joined": 0}
+    roots = _RootStats()
+    worst: list = []  # 最小堆 (|指标|, 序号, 行)
+    fout = open(frames_csv, "w", newline="") if frames_csv else None
+    w = csv.writer(fout) if fout else None
+    if w:
+        w.writerow(FRAME_FIELDS)
+    seq = 0
+
+    def flush(bt: _Batch):
+        nonlocal seq
+        m = bt.compute()
+        roots.update(np.array([x[2] for x in bt.meta], dtype=object), m)
+        for k, meta in enumerate(bt.meta):
+            vals = [float(m[name][k]) for name in METRICS]
+            row = list(meta) + vals
+            if w:
+                w.writerow(row[:6] + [f"{v:.6g}" for v in vals])
+            score = abs(float(m[metric][k]))
+            if top > 0 and np.isfinite(score):
+                item = (score, seq, row)
+                if len(worst) < top:
+                    heapq.heappush(worst, item)
+                elif item > worst[0]:
+                    heapq.heapreplace(worst, item)
+            seq += 1
+
+    try:
+        bt = _Batch()
+        for i, j, a, b in iter_pairs(ra, rb, mode, stats):
+            bt.add(i, j, a, b)
+            if len(bt) >= batch:
+                flush(bt)
+                bt = _Batch()
+        if len(bt):
+            flush(bt)
+    finally:
+        ra.close()
+        rb.close()
+        if fout:
+            fout.close()
+    return {"summary": roots.rows(), "worst": [r for _, _, r in sorted(worst, reverse=True)],
+            "stats": stats, "mode": mode}
+
+
+def _fmt(v) -> str:
+    return f"{v:.4g}" if isinstance(v, float) else str(v)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="逐帧比较两个数据集的能量/力/virial（按来源键或结构哈希对齐）")
+    ap.add_argument("a", help="数据集 A（旧），extxyz，可为 .gz/.zst 分块压缩")
+    ap.add_argument("b", help="数据集 B（新）；差值一律为 B - A")
+    ap.add_argument("--key", choices=KEY_MODES, default="auto", help="对齐方式")
+    ap.add_argument("--batch", type=int, default=2048, help="每批向量化计算的帧数")
+    ap.add_argument("--rank_by", choices=sorted(RANK_BY), default="force",
+                    help="最差帧排序依据：energy=|dE/atom|，force=最大 |ΔF|，force_rmse，virial=最大 virial 差/atom")
+    ap.add_argument("--top", type=int, default=20, help="列出最差的帧数")
+    ap.add_argument("--frames_csv", default="diff_frames.csv", help="逐帧结果（空字符串不写）")
+    ap.add_argument("--summary_csv", default="diff_summary.csv", help="按 root 汇总")
+    ap.add_argument("--unmatched_csv", default="diff_unmatched.csv", help="只在一边出现的帧")
+    args = ap.parse_args()
+
+    r = diff(args.a, args.b, args.key, args.batch, args.top, args.rank_by, args.frames_csv or None)
+    st = r["stats"]
+    print(f"Aligned by {r['mode']}: {st['lockstep']} frames in lockstep, {st['joined']} joined; "
+          f"A only: {len(st['a_only'])}, B only: {len(st['b_only'])}")
+
+    units = ["", "eV/atom", "eV/atom", "eV/atom", "eV/A", "eV/A", "eV/atom", "eV/atom"]
+    wr = max([4] + [len(str(row[0])) for row in r["summary"]])
+    print("\n" + f"{'root':<{wr}s}  " + "  ".join(f"{h:>11s}" for h in SUMMARY_FIELDS[1:]))
+    print(" " * wr + "  " + "  ".join(f"{u:>11s}" for u in units))
+    for row in r["summary"]:
+        print(f"{row[0]:<{wr}s}  " + "  ".join(f"{_fmt(v):>11s}" for v in row[1:]))
+    with open(args.summary_csv, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(SUMMARY_FIELDS)
+        w.writerows([[_fmt(v) for v in row] for row in r["summary"]])
+
+    if r["worst"]:
+        print(f"\nWorst {len(r['worst'])} frames by {RANK_BY[args.rank_by]}:")
+        for row in r["worst"]:
+            i, j, root, where, n, same = row[:6]
+            vals = ", ".join(f"{k}={v:.4g}" for k, v in zip(METRICS, row[6:]))
+            flag = "" if same else " [STRUCTURE CHANGED]"
+            print(f"  A#{i} / B#{j} {root}:{where} ({n} atoms) {vals}{flag}")
+
+    if st["a_only"] or st["b_only"]:
+        with open(args.unmatched_csv, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["side", "index", "root", "frame_dir"])
+            w.writerows([("A", *x) for x in st["a_only"]] + [("B", *x) for x in st["b_only"]])
+        print(f"[UNMATCHED] see {args.unmatched_csv}")
+
+
+if __name__ == "__main__":
+    main()
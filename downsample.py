@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+downsample.py
+
+把大训练集按分布降采样到目标帧数：过密的区域削平，稀有构型尽量全保留（随机丢帧会把它们一起丢掉）。
+1. 第一遍：流式读取，每帧算 组成 / 能量每原子 / 最大力 / 密度 / root，落到多维格子里：
+     组成     元素计数完全相同为同一格（化学式）；
+     能量     按 --de（eV/atom）等宽分格；
+     最大力   按 --force_ratio 对数分格（每格最大力相差 force_ratio 倍，低于 0.01 eV/A 归到最低格）；
+     密度     按 --drho（g/cm^3）等宽分格，没有 Lattice 的帧不分；
+     root     注释行里的 root；
+   --dims 可去掉某些维度。每帧的格子编号写进临时文件，内存里只有格子表（与帧数无关）；
+2. 配额：水位线法，每格最多保留 t 帧，t 取使总数等于 --target（或 --fraction × 总帧数）的值；
+   帧数不足 t 的格整格保留，超出的格削到 t（t 不是整数时余下的名额给最大的几格）；
+3. 第二遍：顺序读格子编号文件，每格做蓄水池抽样（容量 = 配额），内存只和目标帧数有关；
+4. 按原顺序写出被选中的帧（原样拷贝，.gz/.zst 写分块压缩），并可同步过滤 mapping_log.csv。
+
+普通 extxyz 按帧对齐分块、多进程计算每帧特征（与 energy_screen.py 相同）；.gz/.zst 分块压缩文件按块分组并行。
+
+用法：
+  python downsample.py train.xyz --target 50000 -o train_small.xyz
+  python downsample.py train.xyz.zst --fraction 0.3 --dims composition,energy,force --report bins.csv
+  python downsample.py train.xyz --target 20000 --mapping mapping_log.csv --mapping_out mapping_small.csv
+"""
+
+import argparse
+import csv
+import math
+import mmap
+import os
+import random
+import tempfile
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from block_xyz import codec_of, open_frame_reader, open_xyz_writer, load_index, iter_chunk_frames
+from xyz_stream import (open_mmap, chunk_ranges, iter_frame_spans, parallel_map, parse_header, find_header_value,
+                        property_columns)
+from energy_screen import format_frame_list
+
+DIMS = ("composition", "energy", "force", "density", "root")
+F_FLOOR = 0.01  # eV/A，最大力低于此值的帧归到最低的力格
+AMU_PER_A3_TO_G_PER_CM3 = 1.66053907
+BIN_FIELDS = ["bin", "root", "composition", "e_lo", "e_hi", "fmax_lo", "fmax_hi", "rho_lo", "rho_hi",
+              "frames", "kept"]
+
+_masses = None
+
+
+def _mass_of(symbol: str) -> float:
+    """元素的原子质量（amu）；不认识的元素返回 nan。"""
+    global _masses
+    if _masses is None:
+        from ase.data import atomic_masses, atomic_numbers  # 延迟导入：只在算密度时需要
+        _masses = {s: float(atomic_masses[z]) for s, z in atomic_numbers.items()}
+    return _masses.get(symbol, float("nan"))
+
+
+def frame_features(frame: bytes) -> tuple[str, str, float, float, float]:
+    """一帧原始字节 -> (root, 化学式, 能量/atom, 最大力 eV/A, 密度 g/cm^3)；缺失的数值记 nan。"""
+    nl1 = frame.index(b"\n")
+    nl2 = frame.find(b"\n", nl1 + 1)
+    natoms = int(frame[:nl1])
+    fields = parse_header(frame[nl1 + 1:nl2].decode("utf-8", "ignore"))
+
+    cols = property_columns(fields)
+    ncol = max((c + n for c, n in cols.values()), default=0)
+    toks = frame[nl2 + 1:].split()
+    if natoms == 0 or len(toks) < natoms * ncol:
+        raise ValueError(f"frame with {natoms} atoms has too few columns for Properties")
+    toks = toks[:natoms * ncol]
+    counts = Counter(toks[cols.get("species", (0, 1))[0]::ncol])
+    symbols = sorted(s.decode() for s in counts)
+    counts = [counts[s.encode()] for s in symbols]
+    comp = "".join(f"{s}{n}" for s, n in zip(symbols, counts))
+
+    cf = cols.get("forces", cols.get("force", (None, 0)))[0]
+    fmax = float("nan")
+    if cf is not None:
+        f = np.array([toks[cf + d::ncol] for d in range(3)], dtype=np.float64)
+        fmax = float(np.sqrt((f * f).sum(axis=0).max()))
+    try:
+        e_pa = float(find_header_value(fields, "energy")) / natoms
+    except ValueError:
+        e_pa = float("nan")
+    rho = float("nan")
+    lat = find_header_value(fields, "Lattice")
+    if lat:
+        a1, a2, a3, b1, b2, b3, c1, c2, c3 = (float(x) for x in lat.split())
+        vol = abs(a1 * (b2 * c3 - b3 * c2) - a2 * (b1 * c3 - b3 * c1) + a3 * (b1 * c2 - b2 * c1))
+        if vol > 0:
+            mass = sum(_mass_of(s) * n for s, n in zip(symbols, counts))
+            rho = mass * AMU_PER_A3_TO_G_PER_CM3 / vol
+    return find_header_value(fields, "root"), comp, e_pa, fmax, rho
+
+
+def _floor_bin(x: float, width: float):
+    return math.floor(x / width) if math.isfinite(x) else None
+
+
+def bin_key(feat: tuple, dims: tuple, de: float, force_ratio: float, drho: float) -> tuple:
+    """特征 -> 格子键 (root, 化学式, 能量格, 力格, 密度格)；不参与分格的维度与缺失值为 None。"""
+    root, comp, e_pa, fmax, rho = feat
+    fbin = None
+    if "force" in dims and math.isfinite(fmax):
+        fbin = math.floor(math.log(max(fmax, F_FLOOR) / F_FLOOR) / math.log(force_ratio))
+    return (root if "root" in dims else None,
+            comp if "composition" in dims else None,
+            _floor_bin(e_pa, de) if "energy" in dims else None,
+            fbin,
+            _floor_bin(rho, drho) if "density" in dims else None)
+
+
+# ——— 第一遍：分块算格子键 ———
+
+def _keys_chunk(task) -> list[tuple]:
+    path, start, end, binning = task
+    return [bin_key(frame_features(fr), *binning) for fr in iter_chunk_frames(path, start, end)]
+
+
+def _tasks(path: str, chunk_bytes: int, binning: tuple) -> list[tuple]:
+    if codec_of(path):
+        blocks = load_index(path)["blocks"]
+        tasks, lo, size = [], 0, 0
+        for b, (_, csize, _) in enumerate(blocks):
+            size += csize
+            if size * 4 >= chunk_bytes:  # 压缩块按约 4 倍压缩比估计解压后的大小
+                tasks.append((path, lo, b + 1, binning))
+                lo, size = b + 1, 0
+        if lo < len(blocks):
+            tasks.append((path, lo, len(blocks), binning))
+        return tasks
+    return [(path, s, e, binning) for s, e in chunk_ranges(os.path.getsize(path), chunk_bytes)]
+
+
+def scan_bins(path: str, ids_path: str, binning: tuple, jobs: int = 1,
+              chunk_bytes: int = 64 << 20) -> tuple[dict, list[int]]:
+    """第一遍：每帧的格子编号写进 ids_path（int32），返回 ({格子键: 编号}, 各格帧数)。"""
+    bins: dict[tuple, int] = {}
+    counts: list[int] = []
+    with open(ids_path, "wb") as out:
+        for keys in parallel_map(_keys_chunk, _tasks(path, chunk_bytes, binning), jobs):
+            ids = array("i")
+            for key in keys:
+                b = bins.get(key)
+                if b is None:
+                    b = bins[key] = len(counts)
+                    counts.append(0)
+                counts[b] += 1
+                ids.append(b)
+            ids.tofile(out)
+    return bins, counts
+
+
+# ——— 配额与抽样 ———
+
+def flat_quotas(counts, target: int, seed: int = 1234) -> np.ndarray:
+    """水位线配额：quota = min(count, t)，t 使 Σquota = target；余下的名额按帧数从多到少每格加 1（同样多的随机）。"""
+    c = np.asarray(counts, dtype=np.int64)
+    if target >= c.sum():
+        return c.copy()
+    if target <= 0:
+        return np.zeros_like(c)
+    sc = np.sort(c)
+    # 水位落在第 k 小的格之前：前 k 格整格保留，其余 n-k 格各 t 帧
+    before = np.concatenate(([0], np.cumsum(sc)[:-1]))
+    left = len(sc) - np.arange(len(sc))
+    k = int(np.searchsorted(before + sc * left > target, True))
+    t = (target - before[k]) // left[k]
+    quota = np.minimum(c, t)
+    extra = target - int(quota.sum())
+    if extra:
+        order = np.lexsort((np.random.default_rng(seed).permutation(len(c)), -c))
+        order = order[c[order] > t][:extra]
+        quota[order] += 1
+    return quota
+
+
+def reservoir_select(ids_path: str, quotas: np.ndarray, seed: int = 1234, chunk: int = 1 << 20) -> array:
+    """第二遍：每格蓄水池抽样（容量 = 配额），返回按帧号排序的选中帧号。"""
+    rng = random.Random(seed)
+    q = quotas.tolist()
+    seen = [0] * len(q)
+    res: list[list[int]] = [[] for _ in q]
+    i = 0
+    with open(ids_path, "rb") as f:
+        while True:
+            ids = array("i")
+            try:
+                ids.fromfile(f, chunk)
+            except EOFError:
+                pass
+            if not ids:
+                break
+            for b in ids:
+                j = seen[b]
+                seen[b] = j + 1
+                if j < q[b]:
+                    res[b].append(i)
+                elif q[b]:
+                    r = rng.randrange(j + 1)
+                    if r < q[b]:
+                        res[b][r] = i
+                i += 1
+    out = array("q")
+    for r in res:
+        out.extend(r)
+    return array("q", sorted(out))
+
+
+def _iter_all_frames(path: str):
+    if codec_of(path):
+        reader = open_frame_reader(path)
+        try:
+            yield from reader.iter_frame_bytes()
+        finally:
+            reader.close()
+        return
+    buf = open_mmap(path)
+    try:
+        for s, _, _, _, e in iter_frame_spans(buf):
+            yield buf[s:e]
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+def write_selected(path: str, output: str, selected: array) -> int:
+    """按原顺序拷贝选中的帧。"""
+    writer = open_xyz_writer(output)
+    k = n = 0
+    for i, frame in enumerate(_iter_all_frames(path)):
+        if k < len(selected) and selected[k] == i:
+            writer.write_frame(frame)
+            k += 1
+            n += 1
+    writer.close()
+    return n
+
+
+def filter_mapping(mapping: str, output: str, split: str, selected: array, n_frames: int):
+    """mapping_log.csv 中 split 行按顺序对应各帧，只留选中的帧；其它 split 的行原样保留。"""
+    keep = set(selected)
+    j = 0
+    with open(mapping, newline="") as fi, open(output, "w", newline="") as fo:
+        r = csv.reader(fi)
+        w = csv.writer(fo, lineterminator="\n")
+        header = next(r)
+        w.writerow(header)
+        col = header.index("split")
+        for row in r:
+            if row[col] == split:
+                if j in keep:
+                    w.writerow(row)
+                j += 1
+            else:
+                w.writerow(row)
+    if j != n_frames:
+        print(f"[WARN] {mapping} has {j} {split} rows but the xyz has {n_frames} frames; "
+              f"{output} is not aligned with the output")
+
+
+def _edges(b, width, log=False):
+    if b is None:
+        return "", ""
+    if log:
+        return f"{F_FLOOR * width ** b:.4g}", f"{F_FLOOR * width ** (b + 1):.4g}"
+    return f"{b * width:.4g}", f"{(b + 1) * width:.4g}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按 组成/能量/最大力/密度/root 分格、水位线配额 + 格内蓄水池抽样降采样")
+    ap.add_argument("input_file", help="extxyz（可为 .gz/.zst 分块压缩）")
+    ap.add_argument("-o", "--output", default="downsampled.xyz", help="输出（.gz/.zst 结尾时分块压缩）")
+    g = ap.add_mutually_exclusive_group(required=True)
+    g.add_argument("--target", type=int, help="目标帧数")
+    g.add_argument("--fraction", type=float, help="目标帧数占总帧数的比例")
+    ap.add_argument("--dims", default=",".join(DIMS), help=f"参与分格的维度（逗号分隔，可选 {','.join(DIMS)}）")
+    ap.add_argument("--de", type=float, default=0.05, help="能量格宽（eV/atom）")
+    ap.add_argument("--force_ratio", type=float, default=1.5, help="相邻力格最大力之比（对数分格）")
+    ap.add_argument("--drho", type=float, default=0.1, help="密度格宽（g/cm^3）")
+    ap.add_argument("--seed", type=int, default=1234, help="随机种子（蓄水池抽样、余下名额的分配）")
+    ap.add_argument("--report", default="downsample_bins.csv", help="各格帧数与保留数（CSV）")
+    ap.add_argument("--keep_list", default=None, help="可选：保留帧的帧号（delete_frame.py 语法）")
+    ap.add_argument("--mapping", default=None, help="可选：与输入对应的 mapping_log.csv，同步过滤")
+    ap.add_argument("--mapping_out", default="mapping_downsampled.csv", help="过滤后的 mapping")
+    ap.add_argument("--split", choices=("train", "test"), default="train", help="mapping 中与输入对应的 split")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="第一遍的并行进程数")
+    ap.add_argument("--chunk_mb", type=float, default=64.0, help="每个分块的大小（MB）")
+    args = ap.parse_args()
+
+    dims = tuple(d.strip() for d in args.dims.split(",") if d.strip())
+    bad = [d for d in dims if d not in DIMS]
+    if bad:
+        ap.error(f"unknown --dims {bad}; choose from {DIMS}")
+    if args.force_ratio <= 1:
+        ap.error("--force_ratio must be > 1")
+    binning = (dims, args.de, args.force_ratio, args.drho)
+
+    with tempfile.TemporaryDirectory(prefix="downsample_", dir=os.path.dirname(os.path.abspath(args.output))) as tmp:
+        ids_path = os.path.join(tmp, "bin_ids.i32")
+        bins, counts = scan_bins(args.input_file, ids_path, binning, args.jobs, int(args.chunk_mb * (1 << 20)))
+        n_frames = sum(counts)
+        if not n_frames:
+            raise SystemExit(f"[ERROR] no frames in {args.input_file}")
+        target = args.target if args.target is not None else int(round(args.fraction * n_frames))
+        quotas = flat_quotas(counts, target, args.seed)
+        selected = reservoir_select(ids_path, quotas, args.seed)
+
+    c = np.asarray(counts)
+    cut = quotas < c
+    level = int(quotas[cut].max()) if cut.any() else int(c.max())
+    print(f"Frames: {n_frames}, bins: {len(counts)} ({', '.join(dims)}), target: {min(target, n_frames)}")
+    print(f"[DOWNSAMPLE] {int(cut.sum())} bins capped at <= {level} frames, "
+          f"{int((~cut).sum())} bins kept whole; {len(selected)} frames selected")
+
+    with open(args.report, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(BIN_FIELDS)
+        for key, b in sorted(bins.items(), key=lambda kv: -counts[kv[1]]):
+            root, comp, eb, fb, rb = key
+            w.writerow([b, root or "", comp or "", *_edges(eb, args.de), *_edges(fb, args.force_ratio, log=True),
+                        *_edges(rb, args.drho), counts[b], int(quotas[b])])
+
+    n = write_selected(args.input_file, args.output, selected)
+    print(f"Wrote: {args.output} ({n} frames), bin report {args.report}")
+    if args.keep_list:
+        with open(args.keep_list, "w") as f:
+            f.write(format_frame_list(selected) + "\n")
+        print(f"Kept frame list: {args.keep_list}")
+    if args.mapping:
+        filter_mapping(args.mapping, args.mapping_out, args.split, selected, n_frames)
+        print(f"Filtered mapping: {args.mapping_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+energy_screen.py
+
+比 rm_E_0.py / filter_E&F.py 的 “E > 0 就删” 更细的能量筛查：
+1. 第一遍：流式读取，每帧只取元素计数向量 c 和能量 E，按组成（c 相同）累加 帧数 k 与 ΣE；
+   最小二乘 E ≈ c·μ 拟合每种元素的参考能 μ。每个组成类贡献 k·c·cᵀ 和 c·ΣE 到法方程，
+   所以内存只和组成类数有关，与帧数无关；
+2. 第二遍：重新读取，算每帧的残差能 r = (E - c·μ) / N（eV/atom），
+   在各自的组成类内用 中位数 / MAD 判定离群：|r - 中位数| > max(z · 1.4826·MAD, --min_dev)；
+   帧数少于 --min_class 的组成类改用全体帧的中位数 / MAD。
+
+普通 extxyz 按帧对齐分块、多进程处理（与 rewrite_header.py 相同）；.gz/.zst 分块压缩文件顺序读取。
+每块内换行位置、元素计数、组成归类都用 NumPy 整块计算（composition_table），
+原子行只看元素列，不解析坐标和力，不经 ASE。
+
+输出：
+  --refs        各元素参考能（JSON）
+  --report      离群帧（CSV，按 |robust z| 从大到小）
+  --remove_list 离群帧帧号，delete_frame.py 的语法（如 3,7,10-12），可直接：
+                python delete_frame.py train.xyz clean.xyz "$(cat energy_outliers.txt)"
+  --output      可选，直接写出去掉离群帧后的数据集
+
+用法：
+  python energy_screen.py train.xyz
+  python energy_screen.py train.xyz.zst --z 6 --min_dev 0.05 --output clean.xyz
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+
+import numpy as np
+
+from block_xyz import codec_of, open_frame_reader, open_xyz_writer
+from xyz_stream import open_mmap, resync, chunk_ranges, parallel_map, property_columns
+
+MAD_SCALE = 1.4826  # 正态分布下 MAD -> 标准差
+_ENERGY_RE = re.compile(rb'(?:^|\s)energy=("?)([^\s"]+)', re.I)
+_PROPS_RE = re.compile(rb'(?:^|\s)properties=(\S+)', re.I)
+
+
+def _is_ws(x: np.ndarray) -> np.ndarray:
+    return (x == 32) | (x == 9) | (x == 10) | (x == 13)
+
+
+def composition_table(buf, pos: int = 0, end: int | None = None):
+    """
+    起点落在 [pos, end) 内的帧 -> (元素名列表, 逐帧元素计数 (F, S) int64, 能量 (F,)（缺失为 nan）, 原子数 (F,))。
+    换行位置用 NumPy 一次找出，Python 只按行号逐帧跳（每帧 O(1)）；
+    元素取每个原子行第一个字段的前 3 个字节编码后 np.unique / bincount，不逐行切分。
+    元素不在第一列、或元素名超过 3 个字符时退回逐行切分。
+    """
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    size = len(arr)
+    end = size if end is None else min(end, size)
+    hi = min(size, end + max(1 << 20, (end - pos) // 4))
+    nl = (pos + np.flatnonzero(arr[pos:hi] == 10)).tolist()
+
+    def more() -> bool:
+        nonlocal hi
+        if hi >= size:
+            return False
+        new_hi = min(size, hi + max(1 << 20, hi - pos))
+        nl.extend((hi + np.flatnonzero(arr[hi:new_hi] == 10)).tolist())
+        hi = new_hi
+        if hi == size and arr[size - 1] != 10:
+            nl.append(size)  # 最后一行没有换行符
+        return True
+
+    if hi == size and size and arr[size - 1] != 10:
+        nl.append(size)
+    first, nat, energy = [], [], []
+    simple = True
+    cols: dict[bytes, int] = {}
+    k = 0
+    while True:
+        s = pos if k == 0 else nl[k - 1] + 1
+        if s >= end:
+            break
+        while len(nl) <= k + 1 and more():
+            pass
+        if len(nl) <= k + 1:
+            break
+        token = bytes(buf[s:nl[k]]).strip()
+        if not token:
+            k += 1
+            continue
+        if not token.isdigit():
+            raise ValueError(f"expected an atom count at byte {s}, got {token[:40]!r}")
+        n = int(token)
+        while len(nl) <= k + 1 + n and more():
+            pass
+        if len(nl) <= k + 1 + n:
+            break  # 文件末尾不完整的帧
+        comment = bytes(buf[nl[k] + 1:nl[k + 1]])
+        m = _ENERGY_RE.search(comment)
+        try:
+            energy.append(float(m.group(2)) if m else np.nan)
+        except ValueError:
+            energy.append(np.nan)
+        m = _PROPS_RE.search(comment)
+        props = m.group(1).strip(b'"') if m else b"species:S:1"
+        if props not in cols:
+            pc = property_columns({"Properties": props.decode("utf-8", "ignore")})
+            cols[props] = pc.get("species", (0, 1))[0]
+        simple = simple and cols[props] == 0
+        first.append(k + 2)
+        nat.append(n)
+        k += 2 + n
+
+    n_frames = len(nat)
+    nat_a = np.array(nat, dtype=np.int64)
+    energy = np.array(energy, dtype=np.float64)
+    if not n_frames or not nat_a.sum():
+        return [], np.zeros((n_frames, 0), dtype=np.int64), energy, nat_a
+    nl_a = np.array(nl, dtype=np.int64)
+    before = np.cumsum(nat_a) - nat_a
+    line = np.repeat(np.array(first, dtype=np.int64) - before, nat_a) + np.arange(nat_a.sum())
+    frame_of = np.repeat(np.arange(n_frames), nat_a)
+
+    if simple:
+        st = nl_a[line - 1] + 1
+        while True:  # 跳过行首空白
+            lead = (arr[st] == 32) | (arr[st] == 9)
+            if not lead.any():
+                break
+            st[lead] += 1
+        b = [arr[np.minimum(st + d, size - 1)].astype(np.int64) for d in range(4)]
+        e1 = _is_ws(b[1])
+        e2 = e1 | _is_ws(b[2])
+        simple = bool((e2 | _is_ws(b[3])).all())
+    if simple:
+        code = (b[0] << 16) | (np.where(e1, 0, b[1]) << 8) | np.where(e2, 0, b[2])
+        uniq, sp = np.unique(code, return_inverse=True)
+        names = [bytes(x for x in ((c >> 16) & 255, (c >> 8) & 255, c & 255) if x).decode()
+                 for c in uniq.tolist()]
+    else:
+        tokens = []
+        for ln, f in zip(line.tolist(), frame_of.tolist()):
+            text = bytes(buf[nl[ln - 1] + 1:nl[ln]])
+            props = _PROPS_RE.search(bytes(buf[nl[first[f] - 2] + 1:nl[first[f] - 1]]))
+            col = cols[props.group(1).strip(b'"') if props else b"species:S:1"]
+            tokens.append(text.split()[col].decode())
+        names, sp = np.unique(np.array(tokens), return_inverse=True)
+        names = names.tolist()
+    n_sp = len(names)
+    counts = np.bincount(frame_of * n_sp + sp.ravel(), minlength=n_frames * n_sp).reshape(n_frames, n_sp)
+    return names, counts, energy, nat_a
+
+
+def composition_key(names: list[str], row) -> tuple:
+    """计数行 -> ((元素, 个数), ...)，按元素名排序，只含个数 > 0 的元素。"""
+    return tuple(sorted((names[j], int(c)) for j, c in enumerate(row) if c))
+
+
+def formula(comp: tuple) -> str:
+    return "".join(f"{s}{n}" for s, n in comp)
+
+
+# ——— 分块（普通 xyz 多进程分块 / 压缩文件顺序读）———
+
+def _iter_tables(path: str, start: int, end: int | None, chunk_bytes: int):
+    """起点落在 [start, end) 内的帧的组成表；end 为 None 表示整个（分块压缩）文件，按 chunk_bytes 攒帧。"""
+    if end is None:
+        reader = open_frame_reader(path)
+        try:
+            pending, size = [], 0
+            for frame in reader.iter_frame_bytes():
+                pending.append(frame)
+                size += len(frame)
+                if size >= chunk_bytes:
+                    yield composition_table(b"".join(pending))
+                    pending, size = [], 0
+            if pending:
+                yield composition_table(b"".join(pending))
+        finally:
+            reader.close()
+        return
+    buf = open_mmap(path)
+    try:
+        pos = resync(buf, start, limit=end) if start > 0 else 0
+        if pos < end:
+            yield composition_table(buf, pos, end)
+    finally:
+        if not isinstance(buf, bytes):
+            buf.close()
+
+
+def iter_composition_tables(path: str, chunk_bytes: int = 64 << 20):
+    """顺序产出整个文件的组成表（composition_table 的结果），供其他脚本单进程使用。"""
+    for task in _tasks(path, chunk_bytes):
+        yield from _iter_tables(*task)
+
+
+def _classes_of(names, counts):
+    """逐帧的组成类：(组成元组列表, 每帧所属下标)。"""
+    if counts.shape[0] == 0:
+        return [], np.zeros(0, dtype=np.int64)
+    rows, inv = np.unique(counts, axis=0, return_inverse=True)
+    return [composition_key(names, r) for r in rows], inv.ravel()
+
+
+def _fit_chunk(task) -> tuple[dict, int]:
+    """第一遍的分块：{组成: [帧数, ΣE]}（只计有能量的帧）与总帧数。"""
+    path, start, end, chunk_bytes = task
+    acc: dict[tuple, list] = {}
+    n = 0
+    for names, counts, energy, _ in _iter_tables(path, start, end, chunk_bytes):
+        n += len(energy)
+        comps, inv = _classes_of(names, counts)
+        ok = np.isfinite(energy)
+        k = np.bincount(inv[ok], minlength=len(comps))
+        se = np.bincount(inv[ok], weights=energy[ok], minlength=len(comps))
+        for c, kk, ss in zip(comps, k.tolist(), se.tolist()):
+            if kk:
+                a = acc.setdefault(c, [0, 0.0])
+                a[0] += kk
+                a[1] += ss
+    return acc, n
+
+
+def _residual_chunk(task) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """第二遍的分块：每帧的残差能/atom、组成类编号（-1 表示不在拟合里）、原子数。"""
+    path, start, end, chunk_bytes, refs, class_of = task
+    res, cls, nat = [], [], []
+    for names, counts, energy, natoms in _iter_tables(path, start, end, chunk_bytes):
+        mu = np.array([refs.get(s, np.nan) for s in names], dtype=np.float64)
+        missing = ~np.isfinite(mu)
+        r = (energy - counts @ np.where(missing, 0.0, mu)) / np.maximum(natoms, 1)
+        if missing.any():
+            r[(counts[:, missing] > 0).any(axis=1)] = np.nan
+        comps, inv = _classes_of(names, counts)
+        ids = np.array([class_of.get(c, -1) for c in comps], dtype=np.int32)
+        res.append(r)
+        cls.append(ids[inv] if len(inv) else np.zeros(0, dtype=np.int32))
+        nat.append(natoms)
+    if not res:
+        return np.zeros(0), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+    return np.concatenate(res), np.concatenate(cls), np.concatenate(nat)
+
+
+def _tasks(path: str, chunk_bytes: int, extra=()):
+    if codec_of(path):
+        return [(path, 0, None, chunk_bytes) + tuple(extra)]
+    size = os.path.getsize(path)
+    return [(path, s, e, chunk_bytes) + tuple(extra) for s, e in chunk_ranges(size, chunk_bytes)]
+
+
+# ——— 拟合与判定 ———
+
+def fit_references(classes: dict) -> tuple[dict, int]:
+    """classes: {组成: [帧数 k, ΣE]} -> ({元素: μ}, 秩)。按 √k 加权的类均值做最小二乘，与逐帧最小二乘的解相同。"""
+    elements = sorted({s for comp in classes for s, _ in comp})
+    col = {s: i for i, s in enumerate(elements)}
+    a = np.zeros((len(classes), len(elements)))
+    b = np.zeros(len(classes))
+    for r, (comp, (k, se)) in enumerate(classes.items()):
+        w = np.sqrt(k)
+        for s, n in comp:
+            a[r, col[s]] = n * w
+        b[r] = se / k * w
+    mu, _, rank, _ = np.linalg.lstsq(a, b, rcond=None)
+    return dict(zip(elements, mu.tolist())), int(rank)
+
+
+def robust_flags(res: np.ndarray, cls: np.ndarray, z: float, min_dev: float,
+                 min_class: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """返回 (中位数, 尺度 1.4826·MAD, 是否离群)，均为逐帧数组；nan 残差不判定为离群。"""
+    ok = np.isfinite(res)
+    med = np.full(len(res), np.nan)
+    scale = np.full(len(res), np.nan)
+    if ok.any():
+        g_med = np.median(res[ok])
+        g_scale = MAD_SCALE * np.median(np.abs(res[ok] - g_med))
+        med[ok], scale[ok] = g_med, g_scale
+
+        # 各组成类：按 (类, 残差) 排序后取每段中点即为中位数
+        idx = np.flatnonzero(ok & (cls >= 0))
+        c = cls[idx]
+        sizes = np.bincount(c)
+        big = sizes >= min_class
+        if big.any():
+            def class_median(values):
+                order = np.lexsort((values, c))
+                sv, sc = values[order], c[order]
+                starts = np.searchsorted(sc, np.arange(len(sizes)))
+                lo = starts + (sizes - 1) // 2
+                hi = starts + sizes // 2
+                m = np.full(len(sizes), np.nan)
+                m[sizes > 0] = 0.5 * (sv[lo[sizes > 0]] + sv[hi[sizes > 0]])
+                return m
+
+            r = res[idx]
+            c_med = class_median(r)
+            c_scale = MAD_SCALE * class_median(np.abs(r - c_med[c]))
+            use = big[c]
+            med[idx[use]] = c_med[c[use]]
+            scale[idx[use]] = c_scale[c[use]]
+    dev = np.abs(res - med)
+    flag = ok & (dev > np.maximum(z * scale, min_dev))
+    return med, scale, flag
+
+
+def format_frame_list(indices) -> str:
+    """[3, 7, 10, 11, 12] -> '3,7,10-12'（delete_frame.py 的帧号语法）。"""
+    parts = []
+    idx = sorted(int(i) for i in indices)
+    k = 0
+    while k < len(idx):
+        j = k
+        while j + 1 < len(idx) and idx[j + 1] == idx[j] + 1:
+            j += 1
+        parts.append(str(idx[k]) if j == k else f"{idx[k]}-{idx[j]}")
+        k = j + 1
+    return ",".join(parts)
+
+
+def screen(path: str, z: float = 5.0, min_dev: float = 0.02, min_class: int = 5,
+           jobs: int = 1, chunk_bytes: int = 64 << 20) -> dict:
+    # 第一遍：按组成累加
+    classes: dict[tuple, list] = {}
+    n_frames = 0
+    for acc, n in parallel_map(_fit_chunk, _tasks(path, chunk_bytes), jobs):
+        n_frames += n
+        for comp, (k, se) in acc.items():
+            a = classes.setdefault(comp, [0, 0.0])
+            a[0] += k
+            a[1] += se
+    if not classes:
+        raise SystemExit(f"[ERROR] no frame with energy in {path}")
+    refs, rank = fit_references(classes)
+    if rank < len(refs):
+        print(f"[WARN] reference fit is rank deficient ({rank} < {len(refs)} elements): "
+              f"compositions do not separate all elements, individual refs are not unique")
+
+    # 第二遍：残差
+    class_of = {comp: i for i, comp in enumerate(classes)}
+    parts = list(parallel_map(_residual_chunk, _tasks(path, chunk_bytes, (refs, class_of)), jobs))
+    res = np.concatenate([p[0] for p in parts])
+    cls = np.concatenate([p[1] for p in parts])
+    nat = np.concatenate([p[2] for p in parts])
+    med, scale, flag = robust_flags(res, cls, z, min_dev, min_class)
+    return {"frames": n_frames, "refs": refs, "rank": rank, "classes": list(classes),
+            "class_counts": [k for k, _ in classes.values()], "residual": res, "class": cls,
+            "natoms": nat, "median": med, "scale": scale, "flag": flag}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按元素参考能拟合 + 组成类内稳健统计筛查能量离群帧")
+    ap.add_argument("input_file", help="extxyz（可为 .gz/.zst 分块压缩）")
+    ap.add_argument("--z", type=float, default=5.0, help="离群阈值：|r - 中位数| > z × 1.4826·MAD")
+    ap.add_argument("--min_dev", type=float, default=0.02,
+                    help="偏离不到此值（eV/atom）的帧不判为离群（MAD 很小的组成类）")
+    ap.add_argument("--min_class", type=int, default=5, help="组成类帧数少于此值时用全体帧的统计量")
+    ap.add_argument("--refs", default="energy_refs.json", help="元素参考能输出")
+    ap.add_argument("--report", default="energy_outliers.csv", help="离群帧报告")
+    ap.add_argument("--remove_list", default="energy_outliers.txt", help="离群帧帧号（delete_frame.py 语法）")
+    ap.add_argument("--output", default=None, help="写出去掉离群帧后的数据集")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                    help="并行进程数（默认 CPU 核数；.gz/.zst 输入顺序读取）")
+    ap.add_argument("--chunk_mb", type=float, default=64.0, help="每个分块的大小（MB）")
+    args = ap.parse_args()
+
+    r = screen(args.input_file, args.z, args.min_dev, args.min_class, args.jobs,
+               int(args.chunk_mb * (1 << 20)))
+    res, flag = r["residual"], r["flag"]
+    print(f"Frames: {r['frames']}, compositions: {len(r['classes'])}, "
+          f"without energy: {int((~np.isfinite(res)).sum())}")
+    print("Reference energies (eV/atom): " + ", ".join(f"{s}={mu:.5f}" for s, mu in r["refs"].items()))
+    ok = np.isfinite(res)
+    if ok.any():
+        print(f"Residual (eV/atom): median={np.median(res[ok]):.4f}, "
+              f"p1={np.percentile(res[ok], 1):.4f}, p99={np.percentile(res[ok], 99):.4f}")
+    with open(args.refs, "w") as f:
+        json.dump({"refs": r["refs"], "rank": r["rank"], "frames": r["frames"],
+                   "compositions": len(r["classes"])}, f, indent=1)
+
+    out = np.flatnonzero(flag)
+    robust_z = np.abs(res - r["median"]) / np.where(r["scale"] > 0, r["scale"], np.nan)
+    order = out[np.argsort(-np.nan_to_num(robust_z[out], nan=np.inf), kind="stable")]
+    with open(args.report, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["frame", "natoms", "composition", "class_frames", "residual_per_atom",
+                    "class_median", "robust_z"])
+        for i in order:
+            c = r["class"][i]
+            w.writerow([int(i), int(r["natoms"][i]), formula(r["classes"][c]) if c >= 0 else "",
+                        r["class_counts"][c] if c >= 0 else 0, f"{res[i]:.6f}",
+                        f"{r['median'][i]:.6f}", f"{robust_z[i]:.2f}"])
+    with open(args.remove_list, "w") as f:
+        f.write(format_frame_list(out) + "\n")
+    print(f"[SCREEN] {len(out)} outlier frames (see {args.report}; frame list in {args.remove_list})")
+
+    if args.output:
+        bad = set(out.tolist())
+        reader = open_frame_reader(args.input_file)
+        writer = open_xyz_writer(args.output)
+        for i, frame in enumerate(reader.iter_frame_bytes()):
+            if i not in bad:
+                writer.write_frame(frame)
+        writer.close()
+        reader.close()
+        print(f"Wrote: {args.output} ({r['frames'] - len(out)} frames)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
 import argparse
 import sys
-from ase.io import read, write, iread
-from ase import Atoms
+
+from block_xyz import open_frame_reader, open_xyz_writer
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description="逐帧读取 .xyz (或 extended-xyz) 文件，从中提取指定帧写入新的 .xyz 文件。节省内存。"
+        description="按帧索引从 .xyz (或 extended-xyz，含 .gz/.zst 分块压缩) 文件中提取指定帧写入新文件，原样拷贝帧内容。"
     )
     parser.add_argument("--input", "-i", required=True,
                         help="输入 xyz 文件路径 (e.g. train.xyz)")
@@ -25,42 +25,31 @@ def main():
         print("Error: frames 列表格式错误 — 请输入整数索引, 用逗号分隔 (例如 0,5,10)", file=sys.stderr)
         sys.exit(1)
 
-    # 用 iread() 逐帧读取 — 返回一个 generator / iterator
+    # 按帧偏移表直接拷贝原始字节（普通 xyz 用 mmap；.gz/.zst 分块压缩文件只解压用到的块）
     try:
-        traj_iter = iread(args.input, index=":")  # 全帧
+        reader = open_frame_reader(args.input)
     except Exception as e:
-        print(f"Error: 无法读取输入文件 {args.input} (iread): {e}", file=sys.stderr)
+        print(f"Error: 无法读取输入文件 {args.input}: {e}", file=sys.stderr)
         sys.exit(1)
 
-    # 输出之前，先确保 output 文件是空/新建的
-    # 我们用一个 flag 判断是否写过 header，以便 append 或 overwrite
-    first_write = True
-
-    current = 0
-    extracted = []
-
-    for atoms in traj_iter:
-        # 如果当前帧是我们想提取的
-        if current in frames_to_extract:
-            extracted.append(atoms.copy())  # 先保存起来
-
-        current += 1
-        # 如果已经把所有希望的帧都找到，可以提前跳出
-        if len(extracted) >= len(frames_to_extract):
-            break
-
+    extracted = [i for i in frames_to_extract if 0 <= i < len(reader)]
     if not extracted:
-        print(f"Warning: 未提取到任何帧 — 检查索引 {frames_to_extract} 是否合理？", file=sys.stderr)
+        print(f"Warning: 未提取到任何帧 — 检查索引 {frames_to_extract} 是否合理？(共 {len(reader)} 帧)",
+              file=sys.stderr)
         sys.exit(1)
 
-    # 写入 output
+    # 写入 output（以 .gz/.zst 结尾时同样写分块压缩格式）
     try:
-        write(args.output, extracted, format="xyz", append=False)
+        writer = open_xyz_writer(args.output)
+        for i in extracted:
+            writer.write_frame(reader.frame_bytes(i))
+        writer.close()
     except Exception as e:
         print(f"Error: 无法写入输出文件 {args.output}: {e}", file=sys.stderr)
         sys.exit(1)
+    reader.close()
 
-    print(f"成功: 从 {args.input} 中提取帧 {frames_to_extract} → {args.output}")
+    print(f"成功: 从 {args.input} 中提取帧 {extracted} → {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+fake_vasp.py
+
+假的 VASP 可执行程序：按指定模式往 stdout 打 DAV:/RMM: 电子步行（格式同 vasp.out），
+用来在没有 VASP 的机器上试验 scf_watchdog.py / monitor_vasp.py / submit.sh 的流程。
+
+模式：
+  converge   |dE| 每步约降 0.4 个数量级，到 EDIFF 后正常结束
+  stagnate   |dE| 降到 1E-2 附近后来回抖动、不再下降
+  oscillate  dE 符号每步翻转、幅度不减（charge sloshing）
+
+用法：
+  python fake_vasp.py --mode oscillate --delay 0.05
+  python scf_watchdog.py --ediff 1e-6 -- python fake_vasp.py --mode stagnate
+"""
+
+import argparse
+import random
+import sys
+import time
+
+
+def de_sequence(mode: str, nelm: int, ediff: float, seed: int = 0):
+    rnd = random.Random(seed)
+    for k in range(1, nelm + 1):
+        if k <= 5:  # NELMDL 非自洽步：大而杂乱
+            yield k, -(10 ** rnd.uniform(1, 2))
+            continue
+        if mode == "converge":
+            de = -(10 ** (1 - 0.4 * (k - 5))) * rnd.uniform(0.7, 1.3)
+            yield k, de
+            if abs(de) < ediff:
+                return
+        elif mode == "stagnate":
+            yield k, -(10 ** max(-2, 1 - 0.4 * (k - 5))) * rnd.uniform(1.0, 3.0)
+        else:
+            yield k, (-1) ** k * 10 ** rnd.uniform(-1, 0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="输出合成 DAV:/RMM: 电子步的假 VASP")
+    ap.add_argument("--mode", choices=("converge", "stagnate", "oscillate"), default="converge")
+    ap.add_argument("--nelm", type=int, default=60)
+    ap.add_argument("--ediff", type=float, default=1e-6)
+    ap.add_argument("--delay", type=float, default=0.0, help="每个电子步之间 sleep 的秒数")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    out = sys.stdout
+    out.write(" running on    1 total cores\n vasp.6.3.2 (fake)\n")
+    energy = -120.0
+    for k, de in de_sequence(args.mode, args.nelm, args.ediff, args.seed):
+        energy += de
+        tag = "DAV" if k <= 5 else "RMM"
+        out.write(f"{tag}: {k:3d}    {energy: .12E}   {de: .5E}   {de * 0.1: .5E}  1234   0.123E+01\n")
+        out.flush()
+        if args.delay:
+            time.sleep(args.delay)
+    out.write(f"   1 F= {energy: .8E} E0= {energy: .8E}  d E ={0: .6E}\n")
+    out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ import os
 import argparse
 from ase.io import iread, write
 
+from bucket_order import reorder_file
+from xyz_shards import shard_file, shard_dir_for, parse_size
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="单遍读取轨迹即可：按力 + 能量筛选；输出保留帧、删除帧、筛选报告写入日志文件。"
@@ -21,6 +24,16 @@ def parse_args():
                         help="最小力阈值（帧中最小力必须 > 此值）")
     parser.add_argument("--energy_max", type=float, default=0.0,
                         help="能量阈值，若 E > energy_max 则删除该帧")
+    parser.add_argument("--bucket_batch", type=int, default=0,
+                        help=">0 时把保留帧按原子数/组成重排成该大小的桶（与 NEP 的 batch 一致）")
+    parser.add_argument("--bucket_seed", type=int, default=1234,
+                        help="分桶洗牌的随机种子")
+    parser.add_argument("--perm_out", default=None,
+                        help="分桶时写逐帧置换：第 k 行为新第 k 帧在筛选输出中的序号")
+    parser.add_argument("--shard_frames", type=int, default=None,
+                        help="保留帧切成每个最多这么多帧的分片 + manifest.json（<stem>_shards/，见 xyz_shards.py）")
+    parser.add_argument("--shard_bytes", default=None,
+                        help="每个分片最多的未压缩字节数（可写 500M / 2G）")
     return parser.parse_args()
 
 def main():
@@ -79,6 +92,20 @@ def main():
         write(output_file, atoms, append=True)
         kept_count += 1
 
+    # 分桶重排保留帧
+    if args.bucket_batch > 0 and kept_count > 0:
+        reorder_file(output_file, batch=args.bucket_batch, seed=args.bucket_seed,
+                     perm_out=args.perm_out)
+
+    # 切分片（在分桶之后，分片依次拼接即为重排后的顺序）
+    sharded = bool(args.shard_frames or args.shard_bytes) and kept_count > 0
+    if sharded:
+        shard_file(output_file, max_frames=args.shard_frames, max_bytes=parse_size(args.shard_bytes),
+                   meta={"tool": "filter_E&F.py", "input": os.path.abspath(inp), "force_max": fmax,
+                         "force_min": fmin, "energy_max": emax, "bucket_batch": args.bucket_batch})
+        os.remove(output_file)
+        output_file = shard_dir_for(output_file) + "/"
+
     # 写报告到日志文件
     with open(log_file, "w", encoding="utf-8") as f_log:
         f_log.write(f"输入轨迹: {inp}\n")
@@ -87,6 +114,8 @@ def main():
         f_log.write(f"删除帧数: {deleted_count}\n")
         f_log.write(f"保留帧已写入: {output_file}\n")
         f_log.write(f"删除帧已写入: {deleted_file}\n")
+        if args.bucket_batch > 0:
+            f_log.write(f"保留帧已按原子数/组成分桶重排: 每桶 {args.bucket_batch} 帧\n")
         f_log.write(f"日志文件: {log_file}\n")
 
     # 也在终端输出简短报告
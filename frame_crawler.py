@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+frame_crawler.py
+
+基于 os.scandir 的 frame 目录爬取：
+1) 遇到 basename 以 prefix 开头的目录即视为 frame 目录，不再向下遍历；
+2) 在列 frame 目录的同一次 scandir 中收集 OUTCAR / OUTCAR_* 候选（大小、修改时间）
+   以及 vasprun.xml（可压缩），不需要再对每个目录单独 glob；
+3) 多个 root 并发遍历（线程池，metadata 调用会释放 GIL）；
+4) 可选 manifest（JSON）：记录每个目录的 mtime 和列表结果，
+   下次运行只对 mtime 变化的目录重新 scandir，其余目录只需一次 stat。
+
+OUTCAR 可以是压缩的（OUTCAR.gz/.xz/.zst、OUTCAR_1.gz ...）；root 也可以是 pack_frames.py
+生成的 <root>.frames.tar 归档，此时直接用归档的成员表，frame 目录记为 "<archive>::<相对路径>"。
+
+注意：目录 mtime 只在增删文件时变化；正在写入的 OUTCAR 不会让 frame 目录 mtime 变化，
+但 OUTCAR 的“有/无”与 OUTCAR_* 的增删都会被察觉。需要强制重新列出时不传 manifest 即可。
+
+命令行用法（只列出结果）：
+  python frame_crawler.py root1 root2 --manifest crawl_manifest.json
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from block_xyz import write_json_atomic
+from compressed_io import (strip_compression_suffix, is_archive, load_archive_index,
+                           ARCHIVE_SEP)
+
+MANIFEST_VERSION = 2
+
+
+def is_outcar_name(name: str) -> bool:
+    base = strip_compression_suffix(name)
+    return base == "OUTCAR" or base.startswith("OUTCAR_")
+
+
+def is_vasprun_name(name: str) -> bool:
+    return strip_compression_suffix(name) == "vasprun.xml"
+
+
+def pick_vasprun(names) -> str | None:
+    """优先未压缩的 vasprun.xml，其次压缩版本。"""
+    names = sorted(names, key=lambda n: (n != "vasprun.xml", n))
+    return names[0] if names else None
+
+
+def pick_outcar(candidates: list) -> str | None:
+    """
+    candidates: [[name, size, mtime], ...]；
+    优先 OUTCAR，其次压缩的 OUTCAR.gz/.xz/.zst，否则取 mtime 最新的 OUTCAR_*。
+    """
+    if not candidates:
+        return None
+    exact = sorted((c for c in candidates if strip_compression_suffix(c[0]) == "OUTCAR"),
+                   key=lambda c: (c[0] != "OUTCAR", c[0]))
+    if exact:
+        return exact[0][0]
+    return max(candidates, key=lambda c: c[2])[0]
+
+
+def crawl_archive(archive: str, prefix: str = "frame"):
+    """从 pack_frames.py 归档的成员表列出 frame 目录，返回值格式与 crawl_root 相同。"""
+    archive = os.path.abspath(archive)
+    frames = []
+    index = load_archive_index(archive)
+    for rel, files in index["frames"].items():
+        if not os.path.basename(rel).startswith(prefix):
+            continue
+        cands = [[n, v[1], v[2]] for n, v in files.items() if is_outcar_name(n)]
+        name = pick_outcar(cands)
+        vname = pick_vasprun(n for n in files if is_vasprun_name(n))
+        frame_dir = f"{archive}{ARCHIVE_SEP}{rel}"
+        size = files[name][1] if name else 0
+        frames.append((frame_dir, f"{frame_dir}/{name}" if name else None, size,
+                       f"{frame_dir}/{vname}" if vname else None))
+    frames.sort(key=lambda t: t[0])
+    return frames, {}, {"dirs_listed": 0, "dirs_reused": 0, "dirs_stat": 0}
+
+
+def _scan_frame_dir(path: str, mtime_ns: int) -> dict:
+    outcars, vaspruns = [], []
+    with os.scandir(path) as it:
+        for e in it:
+            if is_outcar_name(e.name) and e.is_file():
+                st = e.stat()
+                outcars.append([e.name, st.st_size, st.st_mtime])
+            elif is_vasprun_name(e.name) and e.is_file():
+                vaspruns.append(e.name)
+    outcars.sort()
+    vaspruns.sort()
+    return {"mtime_ns": mtime_ns, "outcars": outcars, "vaspruns": vaspruns}
+
+
+def _scan_plain_dir(path: str, mtime_ns: int, prefix: str) -> dict:
+    subdirs, frames = [], []
+    with os.scandir(path) as it:
+        for e in it:
+            # 与 os.walk 默认行为一致：不跟随指向目录的符号链接
+            if e.is_dir(follow_symlinks=False):
+                (frames if e.name.startswith(prefix) else subdirs).append(e.name)
+    subdirs.sort()
+    frames.sort()
+    return {"mtime_ns": mtime_ns, "subdirs": subdirs, "frames": frames}
+
+
+def crawl_root(root: str, prefix: str = "frame", known: dict | None = None):
+    """
+    遍历单个 root，返回 (frames, entries, counters)：
+    - frames: [(frame_dir, outcar_path 或 None, outcar_size, vasprun_path 或 None)]，按路径排序
+    - entries: 本次看到的目录 -> manifest 记录
+    - counters: {"dirs_listed": .., "dirs_reused": .., "dirs_stat": ..}
+    """
+    root = os.path.abspath(root)
+    if is_archive(root):
+        return crawl_archive(root, prefix)
+    known = known or {}
+    entries: dict[str, dict] = {}
+    counters = {"dirs_listed": 0, "dirs_reused": 0, "dirs_stat": 0}
+    frames = []
+    if not os.path.isdir(root):
+        return frames, entries, counters
+
+    def visit(path: str, is_frame: bool):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        counters["dirs_stat"] += 1
+        old = known.get(path)
+        if old is not None and old.get("mtime_ns") == mtime_ns and (("outcars" in old) == is_frame):
+            counters["dirs_reused"] += 1
+            entries[path] = old
+            return old
+        counters["dirs_listed"] += 1
+        try:
+            ent = _scan_frame_dir(path, mtime_ns) if is_frame else _scan_plain_dir(path, mtime_ns, prefix)
+        except OSError:
+            return None
+        entries[path] = ent
+        return ent
+
+    stack = [(root, os.path.basename(root).startswith(prefix))]
+    while stack:
+        path, is_frame = stack.pop()
+        ent = visit(path, is_frame)
+        if ent is None:
+            continue
+        if is_frame:
+            name = pick_outcar(ent["outcars"])
+            size = 0
+            if name is not None:
+                size = next(c[1] for c in ent["outcars"] if c[0] == name)
+            vname = pick_vasprun(ent["vaspruns"])
+            frames.append((path, os.path.join(path, name) if name else None, size,
+                           os.path.join(path, vname) if vname else None))
+        else:
+            stack.extend((os.path.join(path, d), False) for d in ent["subdirs"])
+            stack.extend((os.path.join(path, d), True) for d in ent["frames"])
+
+    frames.sort(key=lambda t: t[0])
+    return frames, entries, counters
+
+
+def load_manifest(path: str | None, prefix: str) -> dict:
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        print(f"[WARN] manifest unreadable, rescanning: {path}")
+        return {}
+    if data.get("version") != MANIFEST_VERSION or data.get("prefix") != prefix:
+        return {}
+    return data.get("dirs", {})
+
+
+def save_manifest(path: str, prefix: str, dirs: dict):
+    write_json_atomic(path, {"version": MANIFEST_VERSION, "prefix": prefix, "dirs": dirs})
+
+
+def crawl_roots(roots, prefix: str = "frame", manifest: str | None = None,
+                workers: int = 8, stats=None) -> dict:
+    """
+    并发遍历多个 root，返回 {abs_root: [(frame_dir, outcar_path 或 None, size, vasprun_path 或 None), ...]}。
+    给了 manifest 时读取并在结束后原子地更新。
+    """
+    roots = [os.path.abspath(r) for r in roots]
+    known = load_manifest(manifest, prefix)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(roots) or 1))) as ex:
+        futs = {r: ex.submit(crawl_root, r, prefix, known) for r in roots}
+        for r, fut in futs.items():
+            frames, entries, counters = fut.result()
+            results[r] = frames
+            known.update(entries)
+            if stats is not None:
+                for k, v in counters.items():
+                    stats.count(k, v)
+    if manifest:
+        save_manifest(manifest, prefix, known)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="列出 root 下的 frame 目录及选中的 OUTCAR")
+    ap.add_argument("roots", nargs="+")
+    ap.add_argument("--prefix", default="frame")
+    ap.add_argument("--manifest", default=None, help="manifest JSON 路径（增量遍历）")
+    ap.add_argument("--workers", type=int, default=8, help="并发遍历的 root 数")
+    args = ap.parse_args()
+
+    results = crawl_roots(args.roots, args.prefix, args.manifest, args.workers)
+    n_frames = n_missing = 0
+    for root in sorted(results):
+        for d, outcar, size, vasprun in results[root]:
+            n_frames += 1
+            if outcar is None:
+                n_missing += 1
+            print(f"{d}\t{outcar or '-'}\t{size}\t{vasprun or '-'}")
+    print(f"# frames={n_frames}, without OUTCAR={n_missing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+frame_record.py
+
+合并/筛选流程里代替 ase.Atoms 的紧凑帧记录：
+- __slots__，没有 info/arrays 字典和 calculator；
+- 元素存为 uint8 原子序数（bytes），坐标、力、晶胞、virial 放在同一个 float64 缓冲里
+  （一帧只有一个 numpy 对象头；仍是 float64，写出的 extxyz 与原来逐字节一致）；
+- root/frame/frame_dir/source 用 sys.intern，同一 root、同一 frame 目录的多个离子步共用一份字符串；
+- 只有在 ASE 边界（读 OUTCAR 的 ase.io、交给用户的 API）才用 from_atoms / to_atoms 转换。
+
+省下的是每帧固定的对象开销，逐原子数据仍是 float64，所以省多少取决于原子数。
+与同样 Atoms（带 SinglePointCalculator 与 info）相比，每帧常驻内存实测约为：
+3 原子 1/6.1、32 原子 1/3.0、128 原子 1/2.2、512 原子 1/1.9；
+只有很小的帧能达到 5 倍以上，大帧的内存主要是坐标和力本身。
+
+filter_E&F.py 仍用 ase.io.iread / write：它接受任意 ASE 能读的轨迹格式，不只是 extxyz，不在本模块范围内。
+"""
+
+import sys
+
+import numpy as np
+from ase.data import atomic_numbers, chemical_symbols
+
+from xyz_stream import parse_header, find_header_value, property_columns
+
+_ZERO33 = np.zeros((3, 3), dtype=float)
+_ZERO33.flags.writeable = False
+_PBC = {}  # pbc 元组共用
+
+
+def _intern(s) -> str:
+    return sys.intern(str(s)) if s else ""
+
+
+class FrameRecord:
+    """
+    一帧结构 + 标签 + 来源。
+    所有浮点数据放在一个 float64 缓冲里：[cell 9 | virial 9 | positions 3n | forces 3n]，
+    positions/forces/cell/virial 是按需切出的视图；元素为 bytes（每原子 1 字节原子序数）。
+    forces/virial 缺失时读出为 None（写出时按 0 处理）。
+    """
+
+    __slots__ = ("numbers", "_data", "_flags", "pbc", "energy",
+                 "root", "frame", "frame_dir", "source", "ionic_step")
+
+    _HAS_FORCES = 1
+    _HAS_VIRIAL = 2
+
+    def __init__(self, numbers, positions, forces=None, cell=None, energy: float = 0.0,
+                 virial=None, pbc=(True, True, True), root: str = "", frame: str = "",
+                 frame_dir: str = "", source: str = "", ionic_step: int | None = None):
+        self.numbers = bytes(np.asarray(numbers, dtype=np.uint8))
+        n = len(self.numbers)
+        data = np.zeros(18 + 6 * n, dtype=np.float64)
+        if cell is not None:
+            data[0:9] = np.asarray(cell, dtype=np.float64).ravel()
+        flags = 0
+        if virial is not None:
+            data[9:18] = np.asarray(virial, dtype=np.float64).ravel()
+            flags |= self._HAS_VIRIAL
+        data[18:18 + 3 * n] = np.asarray(positions, dtype=np.float64).ravel()
+        if forces is not None:
+            data[18 + 3 * n:] = np.asarray(forces, dtype=np.float64).ravel()
+            flags |= self._HAS_FORCES
+        self._data = data
+        self._flags = flags
+        pbc = tuple(bool(x) for x in pbc)
+        self.pbc = _PBC.setdefault(pbc, pbc)
+        self.energy = float(energy)
+        self.root = _intern(root)
+        self.frame = _intern(frame)
+        self.frame_dir = _intern(frame_dir)
+        self.source = _intern(source)
+        self.ionic_step = ionic_step
+
+    # ——— 构造 ———
+
+    @classmethod
+    def from_symbols(cls, symbols, positions, **kw) -> "FrameRecord":
+        return cls([atomic_numbers[s] for s in symbols], positions, **kw)
+
+    @classmethod
+    def from_step(cls, st: dict, **kw) -> "FrameRecord":
+        """outcar_stream / vasprun_stream 产出的步（symbols/positions/cell/energy/forces/virial）。"""
+        return cls.from_symbols(st["symbols"], st["positions"], forces=st["forces"], cell=st["cell"],
+                                energy=st["energy"], virial=st["virial"], **kw)
+
+    @classmethod
+    def from_atoms(cls, atoms, energy: float | None = None, forces=None, virial=None,
+                   **kw) -> "FrameRecord":
+        """ase.Atoms -> FrameRecord；energy/forces/virial 缺省时依次取 atoms.info / atoms.arrays / calculator。"""
+        info = atoms.info
+        if energy is None:
+            energy = info.get("energy")
+        if energy is None:
+            try:
+                energy = atoms.get_potential_energy()
+            except Exception:
+                energy = 0.0
+        if forces is None:
+            forces = atoms.arrays.get("forces")
+        if forces is None:
+            try:
+                forces = atoms.get_forces()
+            except Exception:
+                forces = None
+        if virial is None:
+            virial = info.get("virial")
+        for key, name in (("root", "root_folder"), ("frame", "frame_folder"),
+                          ("frame_dir", "frame_dir"), ("source", "source")):
+            kw.setdefault(key, info.get(name, ""))
+        if "ionic_step" in info:
+            kw.setdefault("ionic_step", int(info["ionic_step"]))
+        return cls(atoms.numbers, atoms.positions, forces=forces, cell=np.asarray(atoms.get_cell()),
+                   energy=energy, virial=virial, pbc=atoms.pbc, **kw)
+
+    @classmethod
+    def from_xyz(cls, frame: bytes) -> "FrameRecord":
+        """一帧 extxyz 原始字节 -> FrameRecord（不经 ASE；按 Properties 找 species/pos/forces 列）。"""
+        lines = frame.split(b"\n")
+        n = int(lines[0])
+        fields = parse_header(lines[1].decode("utf-8", "ignore"))
+        cols = property_columns(fields)
+        rows = [ln.split() for ln in lines[2:2 + n]]
+        cs, cp = cols.get("species", (0, 1))[0], cols.get("pos", (1, 3))[0]
+        cf = cols.get("forces", cols.get("force", (None, 0)))[0]
+        symbols = [r[cs].decode() for r in rows]
+        positions = [r[cp:cp + 3] for r in rows]
+        forces = None if cf is None else [r[cf:cf + 3] for r in rows]
+
+        def floats(key):
+            v = find_header_value(fields, key)
+            return [float(x) for x in v.split()] if v else None
+
+        energy = find_header_value(fields, "energy")
+        pbc = find_header_value(fields, "pbc", "T T T").split()
+        step = find_header_value(fields, "ionic_step")
+        return cls.from_symbols(
+            symbols, np.array(positions, dtype=float),
+            forces=None if forces is None else np.array(forces, dtype=float),
+            cell=floats("Lattice"), energy=float(energy) if energy else 0.0,
+            virial=floats("virial"), pbc=[x.upper().startswith("T") for x in pbc],
+            root=find_header_value(fields, "root"), frame=find_header_value(fields, "frame"),
+            frame_dir=find_header_value(fields, "frame_dir"), source=find_header_value(fields, "source"),
+            ionic_step=int(step) if step else None)
+
+    def set_provenance(self, root: str, frame: str, frame_dir: str, source: str):
+        self.root = _intern(root)
+        self.frame = _intern(frame)
+        self.frame_dir = _intern(frame_dir)
+        self.source = _intern(source)
+
+    # ——— 访问 ———
+
+    def __len__(self):
+        return len(self.numbers)
+
+    @property
+    def symbols(self) -> list[str]:
+        return [chemical_symbols[z] for z in self.numbers]
+
+    @property
+    def cell(self) -> np.ndarray:
+        return self._data[0:9].reshape(3, 3)
+
+    @property
+    def virial(self) -> np.ndarray | None:
+        return self._data[9:18].reshape(3, 3) if self._flags & self._HAS_VIRIAL else None
+
+    @property
+    def positions(self) -> np.ndarray:
+        n = len(self.numbers)
+        return self._data[18:18 + 3 * n].reshape(n, 3)
+
+    @property
+    def forces(self) -> np.ndarray | None:
+        if not self._flags & self._HAS_FORCES:
+            return None
+        n = len(self.numbers)
+        return self._data[18 + 3 * n:].reshape(n, 3)
+
+    def nbytes(self) -> int:
+        """数据部分占用的字节数（不含对象头）。"""
+        return len(self.numbers) + self._data.nbytes
+
+    def to_atoms(self):
+        """转换成 ase.Atoms：forces 放 arrays，energy/virial/来源放 info（与旧 merge 流程里的 Atoms 相同）。"""
+        from ase import Atoms
+        atoms = Atoms(numbers=list(self.numbers), positions=self.positions.copy(),
+                      cell=self.cell.copy(), pbc=self.pbc)
+        atoms.info["energy"] = self.energy
+        atoms.info["virial"] = (_ZERO33 if self.virial is None else self.virial).copy()
+        atoms.info["root_folder"] = self.root
+        atoms.info["frame_folder"] = self.frame
+        atoms.info["frame_dir"] = self.frame_dir
+        atoms.info["source"] = self.source
+        if self.ionic_step is not None:
+            atoms.info["ionic_step"] = self.ionic_step
+        if self.forces is not None:
+            atoms.arrays["forces"] = self.forces.copy()
+        return atoms
+
+    # ——— 写出 ———
+
+    def to_xyz(self) -> str:
+        """
+        一帧 extxyz 文本（Properties=species,pos,forces），带 energy、Virial、pbc、root/frame/frame_dir/source，
+        有离子步序号时加 ionic_step。Virial 直接写 OUTCAR “FORCE on cell =-STRESS ... units (eV)” 的 Total。
+        """
+        n = len(self.numbers)
+        head = self._data[:18].tolist()  # 未写入的 virial 本来就是 0
+        lattice_str = " ".join(f"{x:.14g}" for x in head[:9])
+        vir_str = " ".join(f"{x:.14g}" for x in head[9:])
+        pbc_str = " ".join("T" if v else "F" for v in self.pbc)
+        second_line = (
+            f'Lattice="{lattice_str}" '
+            f'Properties=species:S:1:pos:R:3:forces:R:3 '
+            f'energy={self.energy:.8f} '
+            f'Virial="{vir_str}" '
+            f'pbc="{pbc_str}" '
+            f'root="{self.root}" '
+            f'frame="{self.frame}" '
+            f'frame_dir="{self.frame_dir}" '
+            f'source="{self.source}"'
+        )
+        if self.ionic_step is not None:
+            second_line += f" ionic_step={int(self.ionic_step)}"
+        out = [f"{n}\n", second_line, "\n"]
+        pos_frc = self._data[18:].reshape(2, n, 3)
+        for z, pos, frc in zip(self.numbers, pos_frc[0], pos_frc[1]):
+            out.append(
+                f"{chemical_symbols[z]} {pos[0]:.8f} {pos[1]:.8f} {pos[2]:.8f} "
+                f"{frc[0]:.8f} {frc[1]:.8f} {frc[2]:.8f}\n"
+            )
+        return "".join(out)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+gpumd_tools.py
+
+各脚本的统一入口：python gpumd_tools.py <子命令> [该脚本自己的参数...]
+子命令对应的脚本/模块只在被调用时才加载（以 __main__ 身份执行对应脚本，参数原样传过去），
+所以启动开销只取决于实际用到的子命令：
+- count / extract / delete 只走字节级的 xyz_stream / block_xyz，不导入 ASE 和 NumPy；
+- filter / screen / merge / check / nep-errors / union / diff / downsample / novelty / stats / make-singles 才会（间接）导入 NumPy / ASE。
+
+--import-profile：用 python -X importtime 重新运行同一条命令，结束后打印累计导入耗时最多的模块。
+
+用法：
+  python gpumd_tools.py count train.xyz test.xyz.zst
+  python gpumd_tools.py extract -i train.xyz -o sub.xyz -f 0,5,10
+  python gpumd_tools.py merge growth/* --test_fraction 0.05
+  python gpumd_tools.py --import-profile extract -i train.xyz -o sub.xyz -f 1
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 子命令 -> (脚本文件 或 None 表示本文件内实现, 说明)
+COMMANDS = {
+    "count": (None, "统计 xyz 帧数（字节级，不导入 ASE）"),
+    "extract": ("extract.py", "按帧号提取帧，原样拷贝"),
+    "delete": ("delete_frame.py", "按帧号删除帧，原样拷贝"),
+    "filter": ("filter_E&F.py", "按力/能量阈值筛选帧"),
+    "merge": ("1218merge.py", "从 frame 目录收集 train/test.xyz"),
+    "check": ("check_single_convergence.py", "检查单点能是否收敛（并写 timing.csv）"),
+    "screen": ("energy_screen.py", "拟合元素参考能，按组成类稳健统计筛查能量离群帧"),
+    "nep-errors": ("nep_errors.py", "NEP 训练输出的逐帧误差，对应回 frame 目录"),
+    "union": ("union_xyz.py", "按来源键/内容哈希合并多个 xyz，去重并报告冲突"),
+    "diff": ("diff_datasets.py", "逐帧比较两个数据集的能量/力/virial"),
+    "downsample": ("downsample.py", "按组成/能量/力/密度/root 分格削平，降采样到目标帧数"),
+    "novelty": ("novelty.py", "训练集描述符 KD 树索引，按最近邻距离筛出新颖的候选结构"),
+    "shard": ("xyz_shards.py", "把 xyz 切成按帧数/字节数封顶的分片 + manifest.json"),
+    "concat": ("concat_shards.py", "校验并按 manifest.json 把分片拼回单个 xyz"),
+    "stats": (None, "数据集概况：帧数、原子数、能量、最大力"),
+    "make-singles": ("xyz2single.py", "把 xyz 的帧拆成单点能计算目录"),
+}
+
+
+def usage() -> str:
+    lines = ["usage: gpumd_tools.py [--import-profile] <command> [args...]", "", "commands:"]
+    for name, (_, desc) in COMMANDS.items():
+        lines.append(f"  {name:14s} {desc}")
+    lines.append("")
+    lines.append("各子命令的参数见: gpumd_tools.py <command> -h")
+    return "\n".join(lines)
+
+
+# ======================
+# 本文件内实现的子命令
+# ======================
+
+def cmd_count(argv: list[str]) -> int:
+    import argparse
+    from block_xyz import frame_count
+
+    ap = argparse.ArgumentParser(prog="gpumd_tools.py count", description=COMMANDS["count"][1])
+    ap.add_argument("files", nargs="+", help="extxyz（可为 .gz/.zst 分块压缩）")
+    args = ap.parse_args(argv)
+    total = 0
+    for path in args.files:
+        n = frame_count(path)
+        total += n
+        print(f"{n}\t{path}")
+    if len(args.files) > 1:
+        print(f"{total}\ttotal")
+    return 0
+
+
+def cmd_stats(argv: list[str]) -> int:
+    import argparse
+    import numpy as np
+    from xyz_dataset import Dataset
+
+    ap = argparse.ArgumentParser(prog="gpumd_tools.py stats", description=COMMANDS["stats"][1])
+    ap.add_argument("files", nargs="+", help="extxyz（可为 .gz/.zst 分块压缩）")
+    args = ap.parse_args(argv)
+    for path in args.files:
+        with Dataset(path) as ds:
+            n = len(ds)
+            print(f"== {path}: {n} frames")
+            if not n:
+                continue
+            nat = ds.natoms
+            e_pa = ds.energies / nat
+            fmax = ds.max_force
+            print(f"  atoms/frame   min={nat.min()}  max={nat.max()}  mean={nat.mean():.1f}  total={nat.sum()}")
+            print(f"  energy/atom   min={np.nanmin(e_pa):.4f}  max={np.nanmax(e_pa):.4f}  "
+                  f"mean={np.nanmean(e_pa):.4f} eV")
+            if np.isfinite(fmax).any():
+                p50, p99 = np.nanpercentile(fmax, [50, 99])
+                print(f"  max |F|       median={p50:.3f}  p99={p99:.3f}  max={np.nanmax(fmax):.3f} eV/A")
+    return 0
+
+
+BUILTIN = {"count": cmd_count, "stats": cmd_stats}
+
+
+# ======================
+# 调度
+# ======================
+
+def run_script(script: str, argv: list[str]) -> int:
+    """
+    以 __main__ 身份执行同目录下的脚本（等同 python script argv...）；不用 runpy，省掉它的导入开销。
+    脚本在一个真正的模块对象里执行并登记为 sys.modules["__main__"]，
+    这样多进程（parallel_map）pickle 脚本里的函数时能按 __main__.<名字> 找到它们。
+    """
+    import types
+
+    path = os.path.join(HERE, script)
+    sys.argv = [path] + argv
+    with open(path, "rb") as f:
+        code = compile(f.read(), path, "exec")
+    module = types.ModuleType("__main__")
+    module.__file__ = path
+    module.__builtins__ = __builtins__
+    old_main = sys.modules["__main__"]
+    sys.modules["__main__"] = module
+    try:
+        exec(code, module.__dict__)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    finally:
+        sys.modules["__main__"] = old_main
+    return 0
+
+
+def import_profile(argv: list[str], top: int = 15) -> int:
+    """python -X importtime 重新运行本命令，汇总 stderr 中的导入耗时。"""
+    import subprocess
+    import time
+
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__)] + argv,
+                          stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - t0
+    rows, other = [], []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us, cum_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # 表头
+        name = parts[2].rstrip()
+        rows.append((cum_us, self_us, len(name) - len(name.lstrip()), name.strip()))
+    if other:
+        print("\n".join(other), file=sys.stderr)
+
+    top_level = sum(r[0] for r in rows if r[2] == 1)
+    print(f"\n[IMPORT PROFILE] wall={wall * 1000:.0f} ms, imports={top_level / 1000:.0f} ms, "
+          f"modules={len(rows)}", file=sys.stderr)
+    print(f"{'cumulative ms':>14s} {'self ms':>9s}  module", file=sys.stderr)
+    for cum, own, _, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cum / 1000:14.1f} {own / 1000:9.1f}  {name}", file=sys.stderr)
+    heavy = [n for n in ("ase", "numpy", "scipy") if any(r[3] == n for r in rows)]
+    print(f"heavy packages imported: {', '.join(heavy) or 'none'}", file=sys.stderr)
+    return proc.returncode
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if "--import-profile" in argv[:1]:
+        return import_profile(argv[1:])
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    cmd, rest = argv[0], argv[1:]
+    if cmd not in COMMANDS:
+        print(f"unknown command: {cmd}\n\n{usage()}", file=sys.stderr)
+        return 2
+    if cmd in BUILTIN:
+        return BUILTIN[cmd](rest)
+    return run_script(COMMANDS[cmd][0], rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+merge_stats.py
+
+merge 流程的分阶段计时 / 计数工具：
+1) stage(name)：按阶段累计耗时与调用次数（目录遍历、choose_outcar、ASE 解析、virial 解析、写出……）；
+2) count(name, n)：通用计数器（打开文件数、读取字节数、解析帧数、按原因统计的忽略帧数）；
+3) record_frame(label, seconds)：保留最慢的 N 帧；
+4) 可选 cProfile；
+5) 运行结束写 JSON 报告并打印摘要。
+
+未开启时使用 NULL_STATS，所有调用均为空操作，几乎没有开销。
+"""
+
+import cProfile
+import heapq
+import io
+import json
+import pstats
+import time
+from contextlib import nullcontext
+
+_NULL_CONTEXT = nullcontext()
+
+
+class _StageTimer:
+    __slots__ = ("stats", "name", "t0")
+
+    def __init__(self, stats, name: str):
+        self.stats = stats
+        self.name = name
+        self.t0 = 0.0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.add_time(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class MergeStats:
+    """累计各阶段耗时、计数器和最慢帧列表。"""
+
+    enabled = True
+
+    def __init__(self, slowest_n: int = 20, profile: bool = False):
+        self.slowest_n = slowest_n
+        self.stage_time: dict[str, float] = {}
+        self.stage_calls: dict[str, int] = {}
+        self.counters: dict[str, int] = {}
+        self._slowest: list[tuple[float, str]] = []
+        self.t_start = time.perf_counter()
+        self.t_end = None
+        self.profiler = cProfile.Profile() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stage(self, name: str):
+        return _StageTimer(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        self.stage_time[name] = self.stage_time.get(name, 0.0) + seconds
+        self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_frame(self, label: str, seconds: float):
+        item = (seconds, label)
+        if len(self._slowest) < self.slowest_n:
+            heapq.heappush(self._slowest, item)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def finish(self):
+        if self.t_end is None:
+            self.t_end = time.perf_counter()
+            if self.profiler is not None:
+                self.profiler.disable()
+
+    def report(self) -> dict:
+        self.finish()
+        wall = self.t_end - self.t_start
+        stages = {}
+        for name in sorted(self.stage_time, key=self.stage_time.get, reverse=True):
+            t = self.stage_time[name]
+            stages[name] = {
+                "seconds": t,
+                "calls": self.stage_calls[name],
+                "fraction_of_wall": t / wall if wall > 0 else 0.0,
+            }
+        rep = {
+            "wall_seconds": wall,
+            "stages": stages,
+            "counters": dict(sorted(self.counters.items())),
+            "slowest_frames": [
+                {"frame": label, "seconds": t}
+                for t, label in sorted(self._slowest, reverse=True)
+            ],
+        }
+        frames = self.counters.get("frames_parsed", 0)
+        nbytes = self.counters.get("bytes_read", 0)
+        if wall > 0:
+            rep["frames_per_second"] = frames / wall
+            rep["mb_per_second"] = nbytes / wall / 1e6
+        return rep
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_profile(self, path: str, top: int = 30) -> str:
+        """保存 cProfile 原始数据（可用 snakeviz 等查看），返回按 cumtime 排序的前 top 行文本。"""
+        if self.profiler is None:
+            return ""
+        self.finish()
+        self.profiler.dump_stats(path)
+        buf = io.StringIO()
+        pstats.Stats(self.profiler, stream=buf).sort_stats("cumulative").print_stats(top)
+        return buf.getvalue()
+
+    def print_summary(self):
+        rep = self.report()
+        print("===== merge timing =====")
+        print(f"wall: {rep['wall_seconds']:.2f} s")
+        for name, s in rep["stages"].items():
+            print(f"  {name:<16s} {s['seconds']:10.2f} s  calls={s['calls']:<8d} "
+                  f"{100.0 * s['fraction_of_wall']:5.1f}%")
+        for name, n in rep["counters"].items():
+            print(f"  {name:<32s} {n}")
+        if "frames_per_second" in rep:
+            print(f"throughput: {rep['frames_per_second']:.1f} frames/s, "
+                  f"{rep['mb_per_second']:.1f} MB/s")
+        if rep["slowest_frames"]:
+            print(f"slowest {len(rep['slowest_frames'])} frames:")
+            for item in rep["slowest_frames"]:
+                print(f"  {item['seconds']:8.3f} s  {item['frame']}")
+
+
+class NullStats:
+    """关闭统计时使用：接口与 MergeStats 相同，全部为空操作。"""
+
+    enabled = False
+
+    def stage(self, name: str):
+        return _NULL_CONTEXT
+
+    def add_time(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+    def record_frame(self, label: str, seconds: float):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_STATS = NullStats()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+monitor_vasp.py
+
+submit.sh 运行时实时查看各 frame 的进度：
+- 每个正在算的 frame 增量跟踪 vasp.out（DAV:/RMM: 电子步、dE）和 OUTCAR（LOOP: 每步耗时），
+  只读新增字节，不重复读；
+- 每个 frame：电子步数、最后的 dE 及其趋势（log10|dE| 每步斜率）、每步耗时、ETA
+  （按 dE 趋势外推到 EDIFF，最多到 NELM）；
+- 整个 campaign：完成/运行/排队/停滞/被 scf_watchdog.py 中止的 frame 数，已完成 frame 的中位耗时，总体 ETA。
+
+开销：frame 列表（frame_crawler）只在 --rescan 间隔重建，目录 mtime 不变的复用上次列表；
+两次重建之间只 stat 正在运行的 frame 的几个文件。
+
+用法：
+  python monitor_vasp.py growth/2c growth/3c              # 终端视图，每 5 秒刷新
+  python monitor_vasp.py . --once --status_json status.json
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from block_xyz import write_json_atomic
+from frame_crawler import crawl_root
+from recover_failed import read_incar
+from scf_stream import TailFollower, ScfState, ABORT_MARKER
+
+DEFAULT_EDIFF = 1e-4
+DEFAULT_NELM = 60
+
+
+def _float_or(value, default: float) -> float:
+    try:
+        return float(str(value).replace("d", "e").replace("D", "E"))
+    except (TypeError, ValueError):
+        return default
+
+
+def elapsed_from_outcar(frame_dir: str, tail_bytes: int = 8192) -> float | None:
+    """读 OUTCAR 末尾的 'Elapsed time (sec):'（已完成的 frame，只读一次末尾）。"""
+    path = os.path.join(frame_dir, "OUTCAR")
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - tail_bytes))
+            tail = f.read().decode("utf-8", "ignore")
+    except OSError:
+        return None
+    for line in tail.splitlines():
+        if "Elapsed time (sec):" in line:
+            try:
+                return float(line.split(":")[1])
+            except ValueError:
+                return None
+    return None
+
+
+class FrameMonitor:
+    """跟踪一个正在计算的 frame 目录。"""
+
+    def __init__(self, frame_dir: str):
+        self.frame_dir = frame_dir
+        incar = read_incar(os.path.join(frame_dir, "INCAR"))
+        self.state = ScfState(ediff=_float_or(incar.get("EDIFF"), DEFAULT_EDIFF),
+                              nelm=int(_float_or(incar.get("NELM"), DEFAULT_NELM)))
+        self.stdout = TailFollower(os.path.join(frame_dir, "vasp.out"))
+        self.outcar = TailFollower(os.path.join(frame_dir, "OUTCAR"))
+        self.last_update = None
+
+    def poll(self, now: float):
+        lines, reset = self.stdout.poll()
+        lines2, reset2 = self.outcar.poll()
+        if reset or reset2:
+            # 文件被重写（重新提交）：两份都从头读
+            self.state.reset()
+            self.stdout = TailFollower(self.stdout.path)
+            self.outcar = TailFollower(self.outcar.path)
+            lines, _ = self.stdout.poll()
+            lines2, _ = self.outcar.poll()
+        for ln in lines:
+            self.state.feed_stdout(ln)
+        for ln in lines2:
+            self.state.feed_outcar(ln)
+        mtimes = [m for m in (self.stdout.mtime, self.outcar.mtime) if m is not None]
+        if mtimes:
+            self.last_update = max(mtimes)
+
+    def snapshot(self, now: float, stall: float) -> dict:
+        st = self.state
+        idle = None if self.last_update is None else now - self.last_update
+        slope = st.de_slope()
+        return {
+            "frame_dir": self.frame_dir,
+            "status": "stalled" if idle is not None and idle > stall else "running",
+            "ionic_done": st.ionic_done,
+            "scf_step": st.steps,
+            "scf_total": st.scf_total,
+            "nelm": st.nelm,
+            "energy": st.energy,
+            "last_de": st.de[-1] if st.de else None,
+            "de_slope": slope,
+            "sec_per_step": st.seconds_per_step(),
+            "remaining_steps": st.remaining_steps(),
+            "eta": st.eta(),
+            "idle": idle,
+        }
+
+
+class CampaignMonitor:
+    def __init__(self, roots, prefix: str = "frame", rescan: float = 30.0, stall: float = 600.0):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.prefix = prefix
+        self.rescan_every = rescan
+        self.stall = stall
+        self._known: dict[str, dict] = {}     # crawl_root 的目录缓存（按 mtime 复用）
+        self._listing: dict[str, tuple] = {}  # frame_dir -> (mtime_ns, 文件名集合)
+        self._last_rescan = None
+        self.done: dict[str, float | None] = {}
+        self.pending: set[str] = set()
+        self.aborted: set[str] = set()
+        self.active: dict[str, FrameMonitor] = {}
+
+    def _names(self, d: str) -> set | None:
+        try:
+            mtime_ns = os.stat(d).st_mtime_ns
+        except OSError:
+            return None
+        old = self._listing.get(d)
+        if old is not None and old[0] == mtime_ns:
+            return old[1]
+        with os.scandir(d) as it:
+            names = {e.name for e in it}
+        self._listing[d] = (mtime_ns, names)
+        return names
+
+    def rescan(self):
+        frame_dirs = []
+        for root in self.roots:
+            frames, entries, _ = crawl_root(root, self.prefix, self._known)
+            self._known.update(entries)
+            frame_dirs.extend(f[0] for f in frames)
+        self.pending = set()
+        for d in frame_dirs:
+            if d in self.done or d in self.active or d in self.aborted:
+                continue
+            names = self._names(d)
+            if names is None:
+                continue
+            if "DONE" in names:
+                self.done[d] = elapsed_from_outcar(d)
+            elif ABORT_MARKER in names:
+                self.aborted.add(d)
+            elif "vasp.out" in names or "OUTCAR" in names:
+                self.active[d] = FrameMonitor(d)
+            else:
+                self.pending.add(d)
+
+    def poll(self) -> dict:
+        now = time.time()
+        if self._last_rescan is None or now - self._last_rescan >= self.rescan_every:
+            self.rescan()
+            self._last_rescan = now
+        frames = []
+        for d in list(self.active):
+            if os.path.exists(os.path.join(d, "DONE")):
+                self.done[d] = elapsed_from_outcar(d)
+                del self.active[d]
+                continue
+            if os.path.exists(os.path.join(d, ABORT_MARKER)):
+                self.aborted.add(d)
+                del self.active[d]
+                continue
+            mon = self.active[d]
+            mon.poll(now)
+            frames.append(mon.snapshot(now, self.stall))
+        return self._summary(now, frames)
+
+    def _summary(self, now: float, frames: list) -> dict:
+        running = [f for f in frames if f["status"] == "running"]
+        durations = [t for t in self.done.values() if t]
+        median = statistics.median(durations) if durations else None
+        etas = [f["eta"] for f in running if f["eta"] is not None]
+        campaign_eta = None
+        if median is not None or not self.pending:
+            # 正在算的剩余时间 + 排队的 frame × 中位耗时，按当前并发数摊开
+            work = sum(etas) + len(self.pending) * (median or 0.0)
+            campaign_eta = work / max(1, len(running))
+        return {
+            "time": now,
+            "summary": {
+                "done": len(self.done),
+                "running": len(running),
+                "stalled": len(frames) - len(running),
+                "pending": len(self.pending),
+                "aborted": len(self.aborted),
+                "median_frame_seconds": median,
+                "campaign_eta": campaign_eta,
+            },
+            "frames": sorted(frames, key=lambda f: f["frame_dir"]),
+        }
+
+
+def _fmt_secs(s) -> str:
+    if s is None:
+        return "-"
+    s = int(s)
+    return f"{s // 3600:d}:{s % 3600 // 60:02d}:{s % 60:02d}"
+
+
+def _fmt(x, spec: str) -> str:
+    return "-" if x is None else format(x, spec)
+
+
+def render(status: dict) -> str:
+    s = status["summary"]
+    out = [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(status["time"])),
+           f"done={s['done']}  running={s['running']}  stalled={s['stalled']}  pending={s['pending']}  "
+           f"aborted={s['aborted']}  "
+           f"median/frame={_fmt_secs(s['median_frame_seconds'])}  campaign ETA={_fmt_secs(s['campaign_eta'])}",
+           "",
+           f"{'status':8s} {'ion':>4s} {'scf':>8s} {'dE':>10s} {'slope':>6s} {'s/step':>7s} {'ETA':>9s}  frame"]
+    for f in status["frames"]:
+        out.append(f"{f['status']:8s} {f['ionic_done']:4d} {f['scf_step']:4d}/{f['nelm']:<3d} "
+                   f"{_fmt(f['last_de'], '10.2e')} {_fmt(f['de_slope'], '6.2f')} "
+                   f"{_fmt(f['sec_per_step'], '7.2f')} {_fmt_secs(f['eta']):>9s}  {f['frame_dir']}")
+    return "\n".join(out)
+
+
+def write_status(path: str, status: dict):
+    write_json_atomic(path, status, indent=1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="增量监控正在运行的 VASP 单点能（电子步、dE 趋势、ETA）")
+    ap.add_argument("roots", nargs="*", default=["."], help="包含 frame* 目录的 root（默认当前目录）")
+    ap.add_argument("--prefix", default="frame")
+    ap.add_argument("--interval", type=float, default=5.0, help="刷新间隔（秒）")
+    ap.add_argument("--rescan", type=float, default=30.0, help="重建 frame 列表的间隔（秒）")
+    ap.add_argument("--stall", type=float, default=600.0,
+                    help="vasp.out/OUTCAR 超过多少秒没有更新视为停滞")
+    ap.add_argument("--status_json", default=None, help="每次刷新把状态写到该 JSON 文件")
+    ap.add_argument("--once", action="store_true", help="只轮询一次后退出")
+    ap.add_argument("--quiet", action="store_true", help="不打印终端视图（配合 --status_json）")
+    args = ap.parse_args()
+
+    mon = CampaignMonitor(args.roots, args.prefix, args.rescan, args.stall)
+    tty = sys.stdout.isatty()
+    try:
+        while True:
+            status = mon.poll()
+            if args.status_json:
+                write_status(args.status_json, status)
+            if not args.quiet:
+                if tty and not args.once:
+                    sys.stdout.write("\033[2J\033[H")
+                print(render(status), flush=True)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+nep_errors.py
+
+读 GPUMD NEP 训练后的 energy_train.out / force_train.out / virial_train.out，算逐帧误差，
+再按 mapping_log.csv 对应回 frame 目录：
+- .out 文件用 numpy.loadtxt 整块读入（C 实现的文本解析），不逐行处理；
+- 各帧原子数取自 train.xyz（字节级扫描，见 energy_screen.composition_table），
+  force_train.out 的行按原子数切成各帧，np.add.reduceat / np.maximum.reduceat 一次算出逐帧力误差；
+- 逐帧：能量误差 (pred - ref, eV/atom)、力 RMSE（按分量）与最大 |ΔF|（按原子）、virial RMSE（eV/atom）；
+- mapping_log.csv 中 split 相同的行按顺序与 train.xyz 的帧一一对应（bucket_order 重排时两者同步），
+  由此得到每帧的 root / frame_dir / source；
+- 输出每个 root 误差最大的 K 帧，或 delete_frame.py 语法的删除列表；全程不构造 ASE 对象。
+
+.out 格式（各帧顺序与 train.xyz 相同）：
+  energy_*.out  每帧一行：pred ref
+  force_*.out   每原子一行：fx fy fz (pred) fx fy fz (ref)
+  virial_*.out  每帧一行：6 个 pred + 6 个 ref（xx yy zz xy yz zx）；
+                旧版为两列、6×帧数行（先按分量、再按帧排列），两种都能读；
+                参考值绝对值 ≥ 1e5 视为该帧没有 virial（GPUMD 对无 virial 帧写入的占位值），不计入。
+
+用法：
+  python nep_errors.py                      # 当前目录的 *_train.out + train.xyz + mapping_log.csv
+  python nep_errors.py nep_run/ --xyz train.xyz --top 5 --rank_by energy
+  python nep_errors.py nep_run/ --remove_top 200 --remove_list nep_remove.txt
+  python delete_frame.py train.xyz train_clean.xyz "$(cat nep_remove.txt)"
+"""
+
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from energy_screen import iter_composition_tables, composition_key, formula, format_frame_list
+
+RANK_BY = {"energy": "energy_abs", "force": "force_rmse", "force_max": "force_max", "virial": "virial_rmse"}
+FRAME_FIELDS = ["frame", "root", "frame_dir", "source", "natoms", "composition",
+                "energy_err", "force_rmse", "force_max", "virial_rmse"]
+VIRIAL_MISSING = 1e5
+
+
+def load_columns(path: str) -> np.ndarray:
+    """空白分隔的数值表 -> (行, 列) float64；空文件返回 0 行。"""
+    if os.path.getsize(path) == 0:
+        return np.zeros((0, 0))
+    return np.loadtxt(path, dtype=np.float64, ndmin=2)
+
+
+def load_outputs(directory: str, split: str = "train") -> dict:
+    """读 energy/force/virial_{split}.out；缺失的文件对应值为 None。"""
+    out = {}
+    for name in ("energy", "force", "virial"):
+        path = os.path.join(directory, f"{name}_{split}.out")
+        out[name] = load_columns(path) if os.path.isfile(path) else None
+    if out["energy"] is None:
+        raise SystemExit(f"[ERROR] {os.path.join(directory, f'energy_{split}.out')} not found")
+    return out
+
+
+def frame_table(xyz: str) -> tuple[np.ndarray, list[str], np.ndarray]:
+    """xyz 各帧的原子数、化学式、能量/atom（一次扫描，不解析坐标和力）。"""
+    natoms, formulas, e_pa = [], [], []
+    for names, counts, energy, nat in iter_composition_tables(xyz):
+        natoms.append(nat)
+        e_pa.append(energy / np.maximum(nat, 1))
+        if len(nat):
+            rows, inv = np.unique(counts, axis=0, return_inverse=True)
+            f = [formula(composition_key(names, r)) for r in rows]
+            formulas.extend(f[i] for i in inv.ravel().tolist())
+    if not natoms:
+        return np.zeros(0, dtype=np.int64), [], np.zeros(0)
+    return np.concatenate(natoms), formulas, np.concatenate(e_pa)
+
+
+def _virial_pairs(v: np.ndarray, n_frames: int) -> tuple[np.ndarray, np.ndarray] | None:
+    """virial_*.out -> (pred (F, 6), ref (F, 6))；格式不认识时返回 None。"""
+    if v.shape == (n_frames, 12):
+        return v[:, :6], v[:, 6:]
+    if v.shape == (6 * n_frames, 2):
+        return v[:, 0].reshape(6, n_frames).T, v[:, 1].reshape(6, n_frames).T
+    return None
+
+
+def frame_errors(out: dict, natoms: np.ndarray) -> dict:
+    """逐帧误差（各为长度 = 帧数的数组，缺失为 nan）。"""
+    n_frames = len(natoms)
+    e = out["energy"]
+    if e.shape[0] != n_frames:
+        raise SystemExit(f"[ERROR] energy file has {e.shape[0]} rows, xyz has {n_frames} frames")
+    err = {"energy_err": e[:, 0] - e[:, 1], "energy_ref": e[:, 1]}
+    err["energy_abs"] = np.abs(err["energy_err"])
+
+    err["force_rmse"] = np.full(n_frames, np.nan)
+    err["force_max"] = np.full(n_frames, np.nan)
+    f = out["force"]
+    if f is not None:
+        total = int(natoms.sum())
+        if f.shape != (total, 6):
+            raise SystemExit(f"[ERROR] force file has shape {f.shape}, expected ({total}, 6) from xyz atom counts")
+        d2 = ((f[:, :3] - f[:, 3:]) ** 2).sum(axis=1)
+        has = natoms > 0
+        if has.any():
+            starts = (np.cumsum(natoms) - natoms)[has]
+            err["force_rmse"][has] = np.sqrt(np.add.reduceat(d2, starts) / (3 * natoms[has]))
+            err["force_max"][has] = np.sqrt(np.maximum.reduceat(d2, starts))
+
+    err["virial_rmse"] = np.full(n_frames, np.nan)
+    v = out["virial"]
+    if v is not None and v.size:
+        pairs = _virial_pairs(v, n_frames)
+        if pairs is None:
+            print(f"[WARN] virial file shape {v.shape} not understood for {n_frames} frames, skipped")
+        else:
+            pred, ref = pairs
+            ok = (np.abs(ref) < VIRIAL_MISSING).all(axis=1)
+            err["virial_rmse"][ok] = np.sqrt(((pred[ok] - ref[ok]) ** 2).mean(axis=1))
+    return err
+
+
+def load_mapping(path: str, split: str, n_frames: int) -> list[tuple[str, str, str]] | None:
+    """mapping_log.csv 中 split 相同的行 -> [(root, frame_dir, source)]；行数对不上时返回 None。"""
+    if not os.path.isfile(path):
+        print(f"[WARN] {path} not found, frames are reported without provenance")
+        return None
+    with open(path, newline="") as f:
+        rows = [(r["root"], r["frame_dir"], r.get("source", "")) for r in csv.DictReader(f)
+                if r["split"] == split]
+    if len(rows) != n_frames:
+        print(f"[WARN] {path} has {len(rows)} {split} rows but xyz has {n_frames} frames; "
+              f"provenance not joined")
+        return None
+    return rows
+
+
+def _rms(x: np.ndarray) -> float:
+    x = x[np.isfinite(x)]
+    return float(np.sqrt((x ** 2).mean())) if len(x) else float("nan")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="NEP 训练输出的逐帧误差，按 mapping_log.csv 对应回 frame 目录")
+    ap.add_argument("directory", nargs="?", default=".", help="含 energy/force/virial_*.out 的目录")
+    ap.add_argument("--split", choices=("train", "test"), default="train", help="读 *_train.out 还是 *_test.out")
+    ap.add_argument("--xyz", default=None, help="对应的 xyz（默认 <directory>/<split>.xyz）")
+    ap.add_argument("--mapping", default=None, help="mapping_log.csv（默认 <directory>/mapping_log.csv）")
+    ap.add_argument("--rank_by", choices=sorted(RANK_BY), default="force", help="排序依据")
+    ap.add_argument("--top", type=int, default=10, help="每个 root 列出误差最大的帧数")
+    ap.add_argument("--frames_csv", default="nep_frame_errors.csv", help="逐帧误差（空字符串不写）")
+    ap.add_argument("--worst_csv", default="nep_worst.csv", help="每个 root 最差的 --top 帧")
+    ap.add_argument("--remove_top", type=int, default=0, help=">0 时把全体误差最大的这么多帧写进删除列表")
+    ap.add_argument("--remove_above", type=float, default=None, help="排序指标超过此值的帧写进删除列表")
+    ap.add_argument("--remove_list", default="nep_remove.txt", help="删除列表（delete_frame.py 语法）")
+    args = ap.parse_args()
+
+    xyz = args.xyz or os.path.join(args.directory, f"{args.split}.xyz")
+    mapping = args.mapping or os.path.join(args.directory, "mapping_log.csv")
+    out = load_outputs(args.directory, args.split)
+    natoms, formulas, e_xyz = frame_table(xyz)
+    err = frame_errors(out, natoms)
+    n = len(natoms)
+    prov = load_mapping(mapping, args.split, n) or [("", "", "")] * n
+    metric = err[RANK_BY[args.rank_by]]
+
+    print(f"Frames: {n}, atoms: {int(natoms.sum())}")
+    print(f"RMSE: energy={_rms(err['energy_err']) * 1000:.2f} meV/atom, "
+          f"force={_rms(err['force_rmse']) * 1000:.1f} meV/A, virial={_rms(err['virial_rmse']) * 1000:.2f} meV/atom")
+
+    if args.frames_csv:
+        with open(args.frames_csv, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(FRAME_FIELDS)
+            cols = [err[k].tolist() for k in ("energy_err", "force_rmse", "force_max", "virial_rmse")]
+            for i in range(n):
+                w.writerow([i, *prov[i], int(natoms[i]), formulas[i]] + [f"{c[i]:.6g}" for c in cols])
+
+    roots = np.array([p[0] for p in prov], dtype=object)
+    with open(args.worst_csv, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["rank"] + FRAME_FIELDS)
+        for root in sorted(set(roots.tolist())):
+            idx = np.flatnonzero(roots == root)
+            sel = idx[np.isfinite(metric[idx])]
+            worst = sel[np.argsort(-metric[sel], kind="stable")[:args.top]]
+            print(f"\n== {root or '(no provenance)'}: {len(idx)} frames, "
+                  f"energy RMSE={_rms(err['energy_err'][idx]) * 1000:.2f} meV/atom, "
+                  f"force RMSE={_rms(err['force_rmse'][idx]) * 1000:.1f} meV/A")
+            for rank, i in enumerate(worst.tolist(), 1):
+                row = [i, *prov[i], int(natoms[i]), formulas[i],
+                       err["energy_err"][i], err["force_rmse"][i], err["force_max"][i], err["virial_rmse"][i]]
+                w.writerow([rank] + row[:6] + [f"{x:.6g}" for x in row[6:]])
+                print(f"  #{i} {prov[i][1] or formulas[i]}  dE={row[6] * 1000:.1f} meV/atom  "
+                      f"F_rmse={row[7] * 1000:.0f} meV/A  F_max={row[8]:.3f} eV/A  V_rmse={row[9] * 1000:.1f} meV/atom")
+
+    # 参考能与 xyz 不一致通常说明 .out 与 xyz 不是同一份数据
+    if n:
+        bad = np.abs(e_xyz - err["energy_ref"]) > 1e-3
+        if bad.any():
+            print(f"\n[WARN] {int(bad.sum())} frames: reference energy in energy_{args.split}.out differs from "
+                  f"{xyz} (first at frame {int(np.flatnonzero(bad)[0])}); check that they belong together")
+
+    remove = np.zeros(n, dtype=bool)
+    if args.remove_above is not None:
+        remove |= np.nan_to_num(metric, nan=-np.inf) > args.remove_above
+    if args.remove_top > 0:
+        order = np.argsort(-np.nan_to_num(metric, nan=-np.inf), kind="stable")
+        remove[order[:args.remove_top]] = True
+    if remove.any():
+        with open(args.remove_list, "w") as f:
+            f.write(format_frame_list(np.flatnonzero(remove)) + "\n")
+        print(f"[REMOVE] {int(remove.sum())} frames by {RANK_BY[args.rank_by]} -> {args.remove_list}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+novelty.py
+
+送 DFT（xyz2single.py / aimd2single.py）之前，先看候选结构是否已被 train.xyz 覆盖：
+- 描述符：每帧一个定长向量 = 各元素对的径向分布（截断半径 --rc 内、--nbins 个高斯展宽的格点，
+  乘余弦截断函数，按原子数归一）+ 各元素的原子分数；周期性边界按 Lattice / pbc 处理
+  （镜像 + scipy KD 树找近邻，只用数组，不构造 Atoms）；
+- 索引：训练集的描述符按段存在 --index 目录下（seg_NNNNN.npz + 该段 KD 树 seg_NNNNN.tree，meta.json 记录参数、
+  元素表、各来源文件已索引到哪一帧），建好后持久化在磁盘上；
+- 增量：再次 index 同一个文件时只算新追加的帧（先核对已索引部分没有被改写），另给的新文件也追加为新段；
+  段数超过 --max_segments 时合并成一段重建 KD 树；
+- 打分：候选帧分块、多进程算描述符，每段 KD 树并行（workers=-j）查最近邻，取各段最小距离；
+  距离超过阈值的帧视为新颖。阈值缺省为训练集内部最近邻距离的 95 分位（index 时抽样估计，记在 meta.json），
+  含索引里没有的元素的候选帧距离记为 inf，总是保留。
+
+用法：
+  python novelty.py index train.xyz --index novelty_index               # 首次建索引 / 之后增量追加
+  python novelty.py index new_batch.xyz --index novelty_index           # 新文件作为新来源追加
+  python novelty.py score candidates.xyz --index novelty_index -o novel.xyz
+  python novelty.py score candidates.xyz.zst --index novelty_index --threshold 0.8 --top 200 -j 8
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+from block_xyz import codec_of, open_frame_reader, open_xyz_writer, load_index, write_json_atomic, iter_chunk_frames
+from xyz_stream import chunk_ranges, parallel_map, parse_header, find_header_value, property_columns
+from energy_screen import iter_composition_tables
+
+META = "meta.json"
+INDEX_VERSION = 1
+REPORT_FIELDS = ["frame", "natoms", "composition", "nn_distance", "nn_source", "nn_frame", "novel"]
+_TRUE = ("t", "true", "1")
+
+
+# ——— 描述符 ———
+
+def descriptor_length(n_elements: int, nbins: int) -> int:
+    return n_elements * (n_elements + 1) // 2 * nbins + n_elements
+
+
+def neighbor_pairs(pos: np.ndarray, cell: np.ndarray | None, pbc: np.ndarray, rc: float):
+    """
+    截断半径内的所有有序原子对 (i, j, 距离)，周期方向计入镜像（任意三斜晶胞，rc 可大于晶胞）。
+    镜像只保留晶胞外 rc 范围内的，用 KD 树（scipy）找近邻，大帧也不会生成 N^2 的距离矩阵。
+    """
+    from scipy.spatial import cKDTree  # 延迟导入（scipy 是 ASE 的依赖）
+
+    n = len(pos)
+    if cell is None or not pbc.any():
+        img, aid = pos, np.arange(n)
+    else:
+        inv = np.linalg.inv(cell)
+        frac = pos @ inv
+        frac[:, pbc] %= 1.0
+        pos = frac @ cell
+        reach = rc * np.linalg.norm(inv, axis=0)  # rc 对应的分数坐标跨度（晶面间距的倒数 × rc）
+        nrep = np.where(pbc, np.ceil(reach), 0).astype(np.int64)
+        shifts = np.array(np.meshgrid(*[np.arange(-k, k + 1) for k in nrep], indexing="ij")).reshape(3, -1).T
+        imf = (frac[None, :, :] + shifts[:, None, :]).reshape(-1, 3)
+        aid = np.tile(np.arange(n), len(shifts))
+        keep = np.all((imf >= -reach) & (imf < 1.0 + reach) | ~pbc, axis=1)
+        img, aid = imf[keep] @ cell, aid[keep]
+    m = cKDTree(pos).sparse_distance_matrix(cKDTree(img), rc, output_type="ndarray")
+    i, j, d = m["i"], aid[m["j"]], m["v"]
+    self_pair = (i == j) & (d < 1e-8)
+    return i[~self_pair], j[~self_pair], d[~self_pair]
+
+
+def frame_descriptor(frame: bytes, elements: dict, rc: float, nbins: int):
+    """
+    一帧原始字节 -> (描述符 float32 向量或 None, 原子数, 化学式)。
+    含 elements 之外元素的帧返回 None。
+    """
+    nl1 = frame.index(b"\n")
+    nl2 = frame.find(b"\n", nl1 + 1)
+    natoms = int(frame[:nl1])
+    fields = parse_header(frame[nl1 + 1:nl2].decode("utf-8", "ignore"))
+    cols = property_columns(fields)
+    ncol = max((c + n for c, n in cols.values()), default=0)
+    toks = frame[nl2 + 1:].split()[:natoms * ncol]
+    if natoms == 0 or len(toks) < natoms * ncol:
+        raise ValueError(f"frame with {natoms} atoms has too few columns for Properties")
+    symbols = [s.decode() for s in toks[cols.get("species", (0, 1))[0]::ncol]]
+    cp = cols.get("pos", (1, 3))[0]
+    pos = np.array([toks[cp + d::ncol] for d in range(3)], dtype=np.float64).T
+    uniq = sorted(set(symbols))
+    comp = "".join(f"{s}{symbols.count(s)}" for s in uniq)
+    if any(s not in elements for s in uniq):
+        return None, natoms, comp
+
+    ne = len(elements)
+    z = np.array([elements[s] for s in symbols], dtype=np.int64)
+    lat = find_header_value(fields, "Lattice")
+    if lat:
+        cell = np.array(lat.split(), dtype=np.float64).reshape(3, 3)
+        pbc = np.array([p.lower() in _TRUE for p in find_header_value(fields, "pbc", "T T T").split()], dtype=bool)
+    else:  # 团簇：非周期
+        cell, pbc = None, np.zeros(3, dtype=bool)
+    i, j, d = neighbor_pairs(pos, cell, pbc, rc)
+
+    # 元素对 (a <= b) 的编号
+    pair = np.zeros((ne, ne), dtype=np.int64)
+    p = 0
+    for a in range(ne):
+        for b in range(a, ne):
+            pair[a, b] = pair[b, a] = p
+            p += 1
+    centers = np.linspace(0.0, rc, nbins)
+    sigma = rc / nbins
+    rdf = np.zeros((p, nbins))
+    if len(d):
+        w = np.exp(-0.5 * ((d[:, None] - centers[None, :]) / sigma) ** 2)
+        w *= (0.5 * (np.cos(np.pi * d / rc) + 1.0))[:, None]
+        np.add.at(rdf, pair[z[i], z[j]], w)
+    frac = np.bincount(z, minlength=ne) / natoms
+    return np.concatenate([rdf.ravel() / natoms, frac]).astype(np.float32), natoms, comp
+
+
+def _descriptor_chunk(task):
+    """一个分块的描述符：(描述符 (n, D)，是否可用 (n,)，原子数 (n,)，化学式列表)。"""
+    path, start, end, skip, params = task
+    elements, rc, nbins = params
+    dim = descriptor_length(len(elements), nbins)
+    vecs, ok, nat, comps = [], [], [], []
+    for k, fr in enumerate(iter_chunk_frames(path, start, end)):
+        if k < skip:
+            continue
+        v, n, comp = frame_descriptor(fr, elements, rc, nbins)
+        ok.append(v is not None)
+        vecs.append(v if v is not None else np.zeros(dim, dtype=np.float32))
+        nat.append(n)
+        comps.append(comp)
+    x = np.array(vecs, dtype=np.float32).reshape(len(vecs), dim)
+    return x, np.array(ok, dtype=bool), np.array(nat, dtype=np.int64), comps
+
+
+def _tasks(path: str, chunk_bytes: int, params: tuple, start_byte: int = 0, start_frame: int = 0) -> list[tuple]:
+    """普通 xyz 从 start_byte 起按字节分块；分块压缩文件从第 start_frame 帧所在的块起按块分组。"""
+    if codec_of(path):
+        blocks = load_index(path)["blocks"]
+        first = 0
+        tasks, lo, size, skip = [], None, 0, 0
+        for b, (_, csize, offs) in enumerate(blocks):
+            if first + len(offs) <= start_frame:
+                first += len(offs)
+                continue
+            if lo is None:
+                lo, skip = b, start_frame - first
+            first += len(offs)
+            size += csize
+            if size * 4 >= chunk_bytes:  # 按约 4 倍压缩比估计解压后的大小
+                tasks.append((path, lo, b + 1, skip, params))
+                lo, size, skip = b + 1, 0, 0
+        if lo is not None and lo < len(blocks):
+            tasks.append((path, lo, len(blocks), skip, params))
+        return tasks
+    return [(path, max(s, start_byte), e, 0, params)
+            for s, e in chunk_ranges(os.path.getsize(path), chunk_bytes) if e > start_byte]
+
+
+def compute_descriptors(path: str, params: tuple, jobs: int = 1, chunk_bytes: int = 16 << 20,
+                        start_byte: int = 0, start_frame: int = 0):
+    parts = list(parallel_map(_descriptor_chunk, _tasks(path, chunk_bytes, params, start_byte, start_frame), jobs))
+    dim = descriptor_length(len(params[0]), params[2])
+    if not parts:
+        return np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64), []
+    return (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]),
+            np.concatenate([p[2] for p in parts]), [c for p in parts for c in p[3]])
+
+
+# ——— 索引 ———
+
+def _tail_hash(path: str, n_frames: int, size: int) -> str:
+    """已索引部分的指纹：普通 xyz 取已索引字节的最后 64 KB，分块压缩文件取最后一个已索引帧。"""
+    h = hashlib.sha256()
+    if codec_of(path):
+        if n_frames:
+            reader = open_frame_reader(path)
+            try:
+                h.update(reader.frame_bytes(n_frames - 1))
+            finally:
+                reader.close()
+    else:
+        with open(path, "rb") as f:
+            f.seek(max(0, size - 65536))
+            h.update(f.read(size - max(0, size - 65536)))
+    return h.hexdigest()
+
+
+class NoveltyIndex:
+    """--index 目录：meta.json + 若干段（描述符、来源帧号、KD 树）。"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, META)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise SystemExit(f"[ERROR] unsupported index version in {directory}")
+        self.elements = {s: k for k, s in enumerate(self.meta["elements"])}
+        self._segments = None
+
+    @classmethod
+    def create(cls, directory: str, elements: list[str], rc: float, nbins: int) -> "NoveltyIndex":
+        os.makedirs(directory, exist_ok=True)
+        write_json_atomic(os.path.join(directory, META), {
+            "version": INDEX_VERSION, "elements": sorted(elements), "rc": rc, "nbins": nbins,
+            "sources": [], "segments": [], "next_segment": 0, "frames": 0, "nn_quantiles": None}, indent=1)
+        return cls(directory)
+
+    @property
+    def params(self) -> tuple:
+        return self.elements, self.meta["rc"], self.meta["nbins"]
+
+    def segments(self) -> list[tuple]:
+        """[(KD 树, 来源编号, 帧号)]，惰性加载。"""
+        if self._segments is None:
+            self._segments = []
+            for seg in self.meta["segments"]:
+                base = os.path.join(self.directory, seg["name"])
+                data = np.load(base + ".npz")
+                with open(base + ".tree", "rb") as f:
+                    tree = pickle.load(f)
+                self._segments.append((tree, data["source"], data["frame"]))
+        return self._segments
+
+    def _write_segment(self, x: np.ndarray, source: np.ndarray, frame: np.ndarray) -> dict:
+        from scipy.spatial import cKDTree  # 延迟导入（scipy 是 ASE 的依赖）
+
+        name = f"seg_{self.meta['next_segment']:05d}"
+        self.meta["next_segment"] += 1
+        base = os.path.join(self.directory, name)
+        with open(base + ".tmp.npz", "wb") as f:
+            np.savez(f, x=x, source=source, frame=frame)
+        os.replace(base + ".tmp.npz", base + ".npz")
+        with open(base + ".tree.tmp", "wb") as f:
+            pickle.dump(cKDTree(x), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(base + ".tree.tmp", base + ".tree")
+        return {"name": name, "frames": len(x)}
+
+    def add(self, path: str, jobs: int = 1, chunk_bytes: int = 16 << 20, max_segments: int = 8) -> tuple[int, int]:
+        """把 path 中尚未索引的帧加进索引，返回 (新增帧数, 因含未知元素跳过的帧数)。"""
+        apath = os.path.abspath(path)
+        src = next((s for s in self.meta["sources"] if s["path"] == apath), None)
+        size = os.path.getsize(path)
+        start_byte = start_frame = 0
+        if src is not None:
+            if size < src["bytes"] or _tail_hash(path, src["frames"], src["bytes"]) != src["tail"]:
+                raise SystemExit(f"[ERROR] {path} changed before the indexed part (not an append); "
+                                 f"rebuild the index with --rebuild")
+            start_byte, start_frame = src["bytes"], src["frames"]
+        x, ok, _, _ = compute_descriptors(path, self.params, jobs, chunk_bytes, start_byte, start_frame)
+        n_new = len(ok)
+        if src is None:
+            src = {"path": apath, "frames": 0, "bytes": 0, "tail": ""}
+            self.meta["sources"].append(src)
+        sid = self.meta["sources"].index(src)
+        frames = np.arange(src["frames"], src["frames"] + n_new, dtype=np.int64)
+        if ok.any():
+            self.meta["segments"].append(self._write_segment(
+                x[ok], np.full(int(ok.sum()), sid, dtype=np.int32), frames[ok]))
+        src["frames"] += n_new
+        src["bytes"] = size
+        src["tail"] = _tail_hash(path, src["frames"], size)
+        self.meta["frames"] += int(ok.sum())
+        if len(self.meta["segments"]) > max_segments:
+            self._compact()
+        self._segments = None
+        if n_new:
+            self.meta["nn_quantiles"] = self._nn_quantiles(jobs)
+        self._save_meta()
+        return n_new, n_new - int(ok.sum())
+
+    def _compact(self):
+        """所有段合并成一段、重建 KD 树。"""
+        old = self.meta["segments"]
+        xs, ss, fs = [], [], []
+        for seg in old:
+            data = np.load(os.path.join(self.directory, seg["name"] + ".npz"))
+            xs.append(data["x"])
+            ss.append(data["source"])
+            fs.append(data["frame"])
+        self.meta["segments"] = [self._write_segment(np.concatenate(xs), np.concatenate(ss), np.concatenate(fs))]
+        self._save_meta()  # 先让 meta 指向新段，再删旧段
+        for seg in old:
+            for ext in (".npz", ".tree"):
+                os.remove(os.path.join(self.directory, seg["name"] + ext))
+        print(f"[COMPACT] {len(old)} segments merged")
+
+    def _save_meta(self):
+        write_json_atomic(os.path.join(self.directory, META), self.meta, indent=1)
+
+    def _nn_quantiles(self, jobs: int, sample: int = 5000, seed: int = 1234) -> dict | None:
+        """训练集内部最近邻距离（抽样，排除自身）的分位数，作为缺省阈值的依据。"""
+        xs = [np.load(os.path.join(self.directory, s["name"] + ".npz"))["x"] for s in self.meta["segments"]]
+        n = sum(len(x) for x in xs)
+        if n < 2:
+            return None
+        rng = np.random.default_rng(seed)
+        pick = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+        x = np.concatenate(xs)[pick]
+        best = np.full(len(x), np.inf)
+        for tree, _, _ in self.segments():
+            d, _ = tree.query(x, k=2, workers=jobs)
+            # 第一近邻是自身（距离 0）时取第二近邻；其它段里自身不出现
+            best = np.minimum(best, np.where(d[:, 0] == 0, d[:, 1], d[:, 0]))
+        best = best[np.isfinite(best)]
+        return {f"p{q}": float(np.percentile(best, q)) for q in (50, 90, 95, 99)}
+
+    def query(self, x: np.ndarray, jobs: int = 1) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """最近邻距离、来源编号、帧号（各段分别查询取最小）。"""
+        best = np.full(len(x), np.inf)
+        src = np.full(len(x), -1, dtype=np.int64)
+        frame = np.full(len(x), -1, dtype=np.int64)
+        if len(x) == 0:
+            return best, src, frame
+        for tree, s, f in self.segments():
+            d, k = tree.query(x, k=1, workers=jobs)
+            better = d < best
+            best[better] = d[better]
+            src[better] = s[k[better]]
+            frame[better] = f[k[better]]
+        return best, src, frame
+
+
+def _file_elements(path: str) -> list[str]:
+    """文件中出现过的元素（字节级组成扫描）。"""
+    found = set()
+    for names, counts, _, _ in iter_composition_tables(path):
+        found.update(n for n, c in zip(names, counts.sum(axis=0).tolist()) if c)
+    return sorted(found)
+
+
+def cmd_index(args):
+    meta_path = os.path.join(args.index, META)
+    if args.rebuild and os.path.isdir(args.index):
+        for fn in os.listdir(args.index):
+            if fn == META or fn.startswith("seg_"):
+                os.remove(os.path.join(args.index, fn))
+    if os.path.exists(meta_path):
+        index = NoveltyIndex(args.index)
+    else:
+        elements = args.elements.split(",") if args.elements else _file_elements(args.input_file)
+        index = NoveltyIndex.create(args.index, elements, args.rc, args.nbins)
+        print(f"[INDEX] new index: elements={','.join(index.meta['elements'])}, rc={args.rc}, nbins={args.nbins}")
+    n_new, skipped = index.add(args.input_file, args.jobs, int(args.chunk_mb * (1 << 20)), args.max_segments)
+    if skipped:
+        print(f"[WARN] {skipped} frames contain elements outside the index ({','.join(index.meta['elements'])}) "
+              f"and were not indexed; rebuild with --elements to include them")
+    q = index.meta["nn_quantiles"]
+    print(f"[INDEX] {args.input_file}: +{n_new - skipped} frames, index now {index.meta['frames']} frames "
+          f"in {len(index.meta['segments'])} segments")
+    if q:
+        print("Train nearest-neighbour distance: " + ", ".join(f"{k}={v:.4g}" for k, v in q.items()))
+
+
+def cmd_score(args):
+    index = NoveltyIndex(args.index)
+    x, ok, natoms, comps = compute_descriptors(args.input_file, index.params, args.jobs,
+                                               int(args.chunk_mb * (1 << 20)))
+    dist, src, frame = index.query(x[ok], args.jobs)
+    nn = np.full(len(ok), np.inf)
+    nn[ok] = dist
+    nn_src = np.full(len(ok), -1, dtype=np.int64)
+    nn_src[ok] = src
+    nn_frame = np.full(len(ok), -1, dtype=np.int64)
+    nn_frame[ok] = frame
+
+    threshold = args.threshold
+    if threshold is None:
+        q = index.meta["nn_quantiles"]
+        if not q:
+            raise SystemExit("[ERROR] index has no distance statistics; give --threshold")
+        threshold = q["p95"]
+    novel = nn > threshold
+    if args.top is not None:
+        order = np.argsort(-nn, kind="stable")
+        keep = np.zeros(len(nn), dtype=bool)
+        keep[order[:args.top]] = True
+        novel &= keep
+
+    sources = [s["path"] for s in index.meta["sources"]]
+    with open(args.report, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(REPORT_FIELDS)
+        for i in np.argsort(-nn, kind="stable").tolist():
+            w.writerow([i, int(natoms[i]), comps[i], f"{nn[i]:.6g}",
+                        sources[nn_src[i]] if nn_src[i] >= 0 else "", int(nn_frame[i]), int(novel[i])])
+    print(f"Candidates: {len(nn)}, threshold: {threshold:.4g}, new elements: {int((~ok).sum())}")
+    print(f"[NOVEL] {int(novel.sum())} frames above threshold (report: {args.report})")
+
+    if args.output:
+        keep = set(np.flatnonzero(novel).tolist())
+        reader = open_frame_reader(args.input_file)
+        writer = open_xyz_writer(args.output)
+        for i, fr in enumerate(reader.iter_frame_bytes()):
+            if i in keep:
+                writer.write_frame(fr)
+        writer.close()
+        reader.close()
+        print(f"Wrote: {args.output}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="训练集描述符 KD 树索引 + 候选结构新颖度打分")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("index", help="建索引，或把新帧/新文件增量加入索引")
+    p.add_argument("input_file", help="训练集 extxyz（可为 .gz/.zst 分块压缩）")
+    p.add_argument("--index", default="novelty_index", help="索引目录")
+    p.add_argument("--elements", default=None, help="建索引时的元素表（逗号分隔，默认取文件中出现的元素）")
+    p.add_argument("--rc", type=float, default=5.0, help="描述符截断半径（A，建索引时确定）")
+    p.add_argument("--nbins", type=int, default=16, help="每个元素对的径向格点数（建索引时确定）")
+    p.add_argument("--max_segments", type=int, default=8, help="段数超过此值时合并")
+    p.add_argument("--rebuild", action="store_true", help="删掉已有索引重建")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("score", help="按到训练集的最近邻距离给候选帧打分")
+    p.add_argument("input_file", help="候选结构 extxyz")
+    p.add_argument("--index", default="novelty_index", help="索引目录")
+    p.add_argument("--threshold", type=float, default=None,
+                   help="新颖阈值（描述符距离；默认取训练集内部最近邻距离的 95 分位）")
+    p.add_argument("--top", type=int, default=None, help="最多保留距离最大的这么多帧")
+    p.add_argument("--report", default="novelty.csv", help="逐帧距离报告（按距离从大到小）")
+    p.add_argument("-o", "--output", default=None, help="写出新颖帧（原样拷贝）")
+    p.set_defaults(func=cmd_score)
+
+    for p in sub.choices.values():
+        p.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                       help="算描述符的进程数 / KD 树查询的线程数")
+        p.add_argument("--chunk_mb", type=float, default=16.0, help="每个分块的大小（MB）")
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+order_frames.py
+
+按结构相似度排列单点能的计算顺序，并用前一个 frame 收敛后的 WAVECAR（或 CHGCAR）作初猜：
+1) order：读取各 frame 的 POSCAR，按“兼容组”分组
+   （元素序列与原子数相同、晶胞相同（--cell_tol）、ENCUT/ISPIN/NBANDS/KPOINTS/POTCAR 相同），
+   组内用最小镜像 RMSD 做贪心最近邻链（从编号最小的 frame 出发，每次走到最近的未访问 frame）；
+   输出 order.txt（可直接作 submit.sh 的 FRAME_LIST）和 order.json（每个 frame 的前驱与距离）；
+2) seed：submit.sh 在算某个 frame 之前调用；前驱已完成（DONE）且 WAVECAR 头部有效时复制过来并设 ISTART=1，
+   没有可用 WAVECAR 但有 CHGCAR 时复制 CHGCAR 并设 ICHARG=1；不满足条件时什么都不改（从头算）；
+   实际使用的初猜记录在 SEEDED_FROM；
+3) report：统计有/无初猜的 frame 的电子步数，估算节省的电子步与时间。
+
+注意：前驱要保留 WAVECAR（不要设 LWAVE=.FALSE.），复制而不是硬链接（VASP 会原地改写 WAVECAR）。
+
+用法：
+  python order_frames.py order growth/2c -o order.txt
+  FRAME_LIST=order.txt ORDER_JSON=order.json ORDER_PY=$PWD/order_frames.py sbatch submit.sh
+  python order_frames.py report --order order.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from ase.io import read
+
+from frame_crawler import crawl_root
+from recover_failed import read_incar, update_incar, wavecar_valid, scan_outcar
+from compressed_io import resolve_variant
+
+SEED_MARKER = "SEEDED_FROM"
+SETUP_TAGS = ("ENCUT", "ISPIN", "NBANDS", "LNONCOLLINEAR", "LSORBIT", "PREC")
+
+
+# ======================
+# 1. 分组与排序
+# ======================
+
+def _potcar_titles(path: str, cache: dict) -> str:
+    real = os.path.realpath(path)
+    if real not in cache:
+        titles = []
+        if os.path.isfile(real):
+            with open(real, errors="ignore") as f:
+                titles = [ln.strip() for ln in f if "TITEL" in ln]
+        cache[real] = "|".join(titles)
+    return cache[real]
+
+
+def setup_hash(frame_dir: str, potcar_cache: dict) -> str:
+    """决定 WAVECAR 能否复用的输入参数摘要（INCAR 中的几个 TAG、KPOINTS、POTCAR 的 TITEL）。"""
+    incar = read_incar(os.path.join(frame_dir, "INCAR"))
+    parts = [f"{t}={incar.get(t, '').upper()}" for t in SETUP_TAGS]
+    kp = os.path.join(frame_dir, "KPOINTS")
+    if os.path.isfile(kp):
+        with open(kp, errors="ignore") as f:
+            parts.append(" ".join(f.read().split()))
+    parts.append(_potcar_titles(os.path.join(frame_dir, "POTCAR"), potcar_cache))
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def group_key(atoms, setup: str, cell_tol: float) -> str:
+    cell = np.round(np.asarray(atoms.get_cell()) / cell_tol).astype(np.int64)
+    return json.dumps([atoms.get_chemical_symbols(), cell.ravel().tolist(), setup])
+
+
+def min_image_rmsd(frac_a: np.ndarray, frac_b: np.ndarray, cell: np.ndarray) -> np.ndarray:
+    """frac_a: (natoms,3)；frac_b: (n,natoms,3)。返回 n 个最小镜像 RMSD（Å）。"""
+    d = frac_b - frac_a[None]
+    d -= np.round(d)
+    cart = d @ cell
+    return np.sqrt((cart ** 2).sum(axis=2).mean(axis=1))
+
+
+def nn_chain(frac: np.ndarray, cell: np.ndarray) -> tuple[list[int], list[float]]:
+    """贪心最近邻链：从 0 出发；返回 (顺序, 每个 frame 到前驱的距离，首个为 nan)。"""
+    n = len(frac)
+    left = np.ones(n, dtype=bool)
+    order, dist = [0], [float("nan")]
+    left[0] = False
+    cur = 0
+    for _ in range(n - 1):
+        idx = np.flatnonzero(left)
+        dd = min_image_rmsd(frac[cur], frac[idx], cell)
+        k = int(np.argmin(dd))
+        cur = int(idx[k])
+        left[cur] = False
+        order.append(cur)
+        dist.append(float(dd[k]))
+    return order, dist
+
+
+def order_frames(frame_dirs: list[str], cell_tol: float = 1e-3):
+    """返回 (groups, skipped)：groups 为 [{"key":..., "frames": [[dir, 前驱 dir 或 None, 距离], ...]}]。"""
+    potcar_cache: dict = {}
+    buckets: dict[str, list] = {}
+    skipped = []
+    for d in frame_dirs:
+        poscar = os.path.join(d, "POSCAR")
+        try:
+            atoms = read(poscar, format="vasp")
+        except Exception as e:
+            skipped.append((d, f"{type(e).__name__}: {e}"))
+            continue
+        key = group_key(atoms, setup_hash(d, potcar_cache), cell_tol)
+        buckets.setdefault(key, []).append((d, atoms))
+
+    groups = []
+    for key, members in buckets.items():
+        cell = np.asarray(members[0][1].get_cell())
+        frac = np.array([a.get_scaled_positions(wrap=False) for _, a in members])
+        order, dist = nn_chain(frac, cell)
+        frames = []
+        for pos, (i, dd) in enumerate(zip(order, dist)):
+            prev = members[order[pos - 1]][0] if pos else None
+            frames.append([members[i][0], prev, None if prev is None else round(dd, 6)])
+        groups.append({"key": key, "frames": frames})
+    groups.sort(key=lambda g: g["frames"][0][0])
+    return groups, skipped
+
+
+# ======================
+# 2. 初猜
+# ======================
+
+def _load_order(path: str) -> dict:
+    """order.json -> {frame_dir: (前驱, 距离)}"""
+    with open(path) as f:
+        data = json.load(f)
+    return {d: (prev, dist) for g in data["groups"] for d, prev, dist in g["frames"]}
+
+
+def seed_frame(frame_dir: str, order: dict) -> tuple[str | None, str]:
+    """返回 (用到的文件名 或 None, 说明)；只有确实复制了初猜才修改 INCAR。"""
+    frame_dir = os.path.abspath(frame_dir)
+    if frame_dir not in order:
+        return None, "not in order file"
+    prev, dist = order[frame_dir]
+    if prev is None:
+        return None, "first frame of its group"
+    if not os.path.isfile(os.path.join(prev, "DONE")):
+        return None, f"predecessor not finished: {prev}"
+
+    wavecar = os.path.join(prev, "WAVECAR")
+    chgcar = os.path.join(prev, "CHGCAR")
+    if os.path.isfile(wavecar) and wavecar_valid(wavecar):
+        name, changes = "WAVECAR", {"ISTART": "1"}
+    elif os.path.isfile(chgcar) and os.path.getsize(chgcar) > 0:
+        name, changes = "CHGCAR", {"ICHARG": "1"}
+    else:
+        return None, f"no valid WAVECAR/CHGCAR in predecessor: {prev}"
+
+    dst = os.path.join(frame_dir, name)
+    tmp = dst + ".seed_tmp"
+    shutil.copyfile(os.path.join(prev, name), tmp)
+    os.replace(tmp, dst)
+    # INCAR 可能是指向公共 INCAR 的软链接：update_incar 用 os.replace 写成本目录自己的文件
+    update_incar(os.path.join(frame_dir, "INCAR"), changes, note=f"order_frames.py seed ({name})")
+    with open(os.path.join(frame_dir, SEED_MARKER), "w") as f:
+        json.dump({"from": prev, "file": name, "rmsd": dist}, f)
+    return name, f"{name} from {prev} (rmsd={dist:.4f} A)"
+
+
+# ======================
+# 3. 统计
+# ======================
+
+def scf_steps(frame_dir: str) -> int | None:
+    outcar = resolve_variant(os.path.join(frame_dir, "OUTCAR"))
+    if outcar is None or not os.path.isfile(os.path.join(frame_dir, "DONE")):
+        return None
+    return scan_outcar(outcar)["nelec"] or None
+
+
+def report(order: dict, csv_path: str | None = None) -> dict:
+    rows = []
+    for d in sorted(order):
+        steps = scf_steps(d)
+        if steps is None:
+            continue
+        seeded = os.path.isfile(os.path.join(d, SEED_MARKER))
+        rows.append((d, seeded, steps, order[d][1]))
+    cold = [r[2] for r in rows if not r[1]]
+    warm = [r[2] for r in rows if r[1]]
+    out = {"finished": len(rows), "seeded": len(warm), "unseeded": len(cold),
+           "mean_steps_seeded": float(np.mean(warm)) if warm else None,
+           "mean_steps_unseeded": float(np.mean(cold)) if cold else None,
+           "scf_steps_saved": None}
+    if warm and cold:
+        out["scf_steps_saved"] = float(np.mean(cold) * len(warm) - sum(warm))
+    if csv_path:
+        with open(csv_path, "w") as f:
+            f.write("frame_dir,seeded,scf_steps,rmsd_to_prev\n")
+            for d, s, n, dist in rows:
+                f.write(f"{d},{int(s)},{n},{'' if dist is None else dist}\n")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按结构相似度排列单点能顺序，并用前一帧的 WAVECAR 作初猜")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("order", help="分组并生成计算顺序")
+    p.add_argument("roots", nargs="+")
+    p.add_argument("--prefix", default="frame")
+    p.add_argument("-o", "--output", default="order.txt", help="顺序列表（submit.sh 的 FRAME_LIST）")
+    p.add_argument("--json", default=None, help="前驱表（默认与 -o 同名的 .json）")
+    p.add_argument("--cell_tol", type=float, default=1e-3, help="晶胞相同的判据（Å）")
+    p.add_argument("--skip_done", action="store_true", help="跳过已有 DONE 的 frame（仍可作为前驱）")
+
+    p = sub.add_parser("seed", help="给一个 frame 放入前驱的 WAVECAR/CHGCAR（submit.sh 调用）")
+    p.add_argument("frame_dir")
+    p.add_argument("--order", required=True, help="order 子命令生成的 JSON")
+
+    p = sub.add_parser("report", help="统计初猜节省的电子步")
+    p.add_argument("--order", required=True)
+    p.add_argument("--csv", default=None, help="逐 frame 明细")
+    args = ap.parse_args()
+
+    if args.cmd == "order":
+        frame_dirs = []
+        for root in args.roots:
+            frames, _, _ = crawl_root(root, args.prefix)
+            frame_dirs.extend(f[0] for f in frames)
+        groups, skipped = order_frames(frame_dirs, args.cell_tol)
+        for d, why in skipped:
+            print(f"[IGNORED] (POSCAR unreadable) {d} :: {why}")
+        json_path = args.json or os.path.splitext(args.output)[0] + ".json"
+        with open(json_path, "w") as f:
+            json.dump({"groups": groups}, f, indent=1)
+        n = 0
+        with open(args.output, "w") as f:
+            for g in groups:
+                f.write(f"# group: {len(g['frames'])} frames\n")
+                for d, _, _ in g["frames"]:
+                    if args.skip_done and os.path.isfile(os.path.join(d, "DONE")):
+                        continue
+                    f.write(d + "\n")
+                    n += 1
+        dists = [fr[2] for g in groups for fr in g["frames"] if fr[2] is not None]
+        print(f"groups={len(groups)}, frames={n}, "
+              f"median rmsd to predecessor={np.median(dists) if dists else float('nan'):.4f} A")
+        print(f"Wrote: {args.output}, {json_path}")
+    elif args.cmd == "seed":
+        name, msg = seed_frame(args.frame_dir, _load_order(args.order))
+        print(f"    [SEED] {msg}" if name else f"    [NO SEED] {msg}")
+    elif args.cmd == "report":
+        out = report(_load_order(args.order), args.csv)
+        for k, v in out.items():
+            print(f"{k:22s} {v if v is None or isinstance(v, int) else f'{v:.1f}'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+outcar_stream.py
+
+单次顺序扫描 OUTCAR，逐个产出离子步（AIMD / 结构优化中的每一步）：
+- 结构：direct lattice vectors + POSITION/TOTAL-FORCE 块；
+- 能量：FREE ENERGIE OF THE ION-ELECTRON SYSTEM 块（energy 取 energy(sigma->0)，与 ASE 一致）；
+- virial：该步的 “FORCE on cell =-STRESS” Total 行（eV），映射方式与 1218merge.py 相同；
+  该步没有 stress 块时为 None。
+
+内存与 OUTCAR 大小无关：只保留当前一步的原始行，被选中的步才解析成数组。
+选步方式：stride（每 k 步取一步）、min_de（与上一次选中步的每原子能量差 >= 阈值才取）、
+include_last（无论如何都带上最后一步）。
+
+命令行：python outcar_stream.py OUTCAR --stride 10   （列出选中的步）
+"""
+
+import argparse
+
+import numpy as np
+
+
+def _species_from_potcar(potcar_syms: list[str]) -> list[str]:
+    """OUTCAR 里每个 POTCAR: 行出现两次，只取前一半（与 ASE 相同）。"""
+    half = sum(divmod(len(potcar_syms), 2))
+    return potcar_syms[:half]
+
+
+def _potcar_symbol(line: str) -> str:
+    parts = line.split()
+    sym = parts[1] if "1/r potential" in line else parts[2]
+    sym = sym.split("_")[0]
+    return "".join(c for c in sym if c.isalpha())
+
+
+def _virial_from_total(line: str):
+    nums = []
+    for tok in line.split():
+        try:
+            nums.append(float(tok))
+        except ValueError:
+            pass
+    if len(nums) < 6:
+        return None
+    xx, yy, zz, xy, yz, zx = nums[:6]
+    return np.array([[xx, xy, zx],
+                     [xy, yy, yz],
+                     [zx, yz, zz]], dtype=float)
+
+
+def _build_step(index, symbols, cell, pos_lines, energy, free_energy, virial) -> dict:
+    data = np.array([ln.split()[:6] for ln in pos_lines], dtype=float)
+    return {
+        "index": index,
+        "symbols": symbols,
+        "cell": np.array(cell, dtype=float),
+        "positions": data[:, 0:3].copy(),
+        "forces": data[:, 3:6].copy(),
+        "energy": energy,
+        "free_energy": free_energy,
+        "virial": virial,
+    }
+
+
+def iter_ionic_steps(fh, stride: int = 1, min_de: float | None = None,
+                     include_last: bool = False):
+    """
+    fh: 已打开的文本文件对象（可以是解压流）。
+    产出 dict: index / symbols / cell / positions / forces / energy / free_energy / virial。
+    最后一步若没写完（被截断），直接丢弃。
+    """
+    stride = max(1, int(stride))
+    potcar_syms: list[str] = []
+    ion_counts: list[int] | None = None
+    symbols: list[str] | None = None
+    natoms = 0
+
+    cell = None
+    virial = None
+    pos_lines: list[str] | None = None
+    step = 0
+    last_kept_e = None
+    pending_last = None  # include_last 时暂存最近一个未被选中的步
+
+    it = iter(fh)
+    try:
+        for line in it:
+            if symbols is None:
+                if "POTCAR:" in line:
+                    potcar_syms.append(_potcar_symbol(line))
+                    continue
+                if "ions per type" in line:
+                    ion_counts = [int(x) for x in line.split("=")[1].split()]
+                    species = _species_from_potcar(potcar_syms)
+                    symbols = [s for s, c in zip(species, ion_counts) for _ in range(c)]
+                    natoms = len(symbols)
+                    continue
+                continue
+
+            if "direct lattice vectors" in line:
+                cell = [[float(x) for x in next(it).split()[:3]] for _ in range(3)]
+            elif "FORCE on cell =-STRESS" in line:
+                for _ in range(40):
+                    ln = next(it)
+                    if ln.strip().startswith("Total"):
+                        virial = _virial_from_total(ln)
+                        break
+            elif "POSITION" in line and "TOTAL-FORCE" in line:
+                next(it)  # 分隔线
+                pos_lines = [next(it) for _ in range(natoms)]
+            elif "FREE ENERGIE OF THE ION-ELECTRON SYSTEM" in line:
+                free_energy = energy = None
+                for _ in range(6):
+                    ln = next(it)
+                    if "free  energy   TOTEN" in ln:
+                        free_energy = float(ln.split()[4])
+                    elif "energy  without entropy" in ln:
+                        energy = float(ln.split()[-1])
+                        break
+                if energy is None or pos_lines is None or cell is None:
+                    continue
+
+                keep = step % stride == 0
+                if keep and min_de is not None and last_kept_e is not None:
+                    keep = abs(energy - last_kept_e) / natoms >= min_de
+                if keep:
+                    last_kept_e = energy
+                    pending_last = None
+                    yield _build_step(step, symbols, cell, pos_lines, energy, free_energy, virial)
+                elif include_last:
+                    pending_last = (step, cell, pos_lines, energy, free_energy, virial)
+
+                step += 1
+                virial = None
+                pos_lines = None
+    except StopIteration:
+        pass  # 文件在块中间结束：丢弃没写完的最后一步
+
+    if pending_last is not None:
+        idx, c, pl, e, fe, v = pending_last
+        yield _build_step(idx, symbols, c, pl, e, fe, v)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="列出 OUTCAR 中被选中的离子步")
+    ap.add_argument("outcar")
+    ap.add_argument("--stride", type=int, default=1)
+    ap.add_argument("--min_de", type=float, default=None, help="每原子能量变化阈值（eV/atom）")
+    ap.add_argument("--include_last", action="store_true")
+    args = ap.parse_args()
+
+    n = 0
+    with open(args.outcar, "r", errors="ignore") as f:
+        for st in iter_ionic_steps(f, args.stride, args.min_de, args.include_last):
+            n += 1
+            vir = "-" if st["virial"] is None else f"{np.trace(st['virial']):.4f}"
+            print(f"step={st['index']:6d} natoms={len(st['symbols'])} "
+                  f"energy={st['energy']:.8f} trace(virial)={vir}")
+    print(f"# selected steps: {n}")
+
+
+if __name__ == "__main__":
+    main()
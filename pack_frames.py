@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pack_frames.py
+
+把一个算完的 root 下所有 frame* 目录打包成单个归档（<root>.frames.tar），减少小文件数量：
+- 归档是普通（不压缩的）tar，可用 tar -tf 查看；成员名为 "<frame 相对路径>/<文件名>"；
+- 旁边写 <archive>.index.json：每个成员的数据偏移、大小、mtime，读取时直接 seek；
+- --compress gz|xz|zst：把尚未压缩的文件逐个流式压缩后再放入（已是 .gz/.xz/.zst 的原样放入）；
+- 默认跳过 WAVECAR/CHG/CHGCAR 等大文件（--exclude 可改）。
+
+1218merge.py / frame_crawler.py 可直接把归档当 root 使用，不需要解包。
+
+用法：
+  python pack_frames.py pack growth/2c --compress gz
+  python pack_frames.py list growth/2c.frames.tar
+  python pack_frames.py cat  growth/2c.frames.tar::frame_00001/OUTCAR.gz
+"""
+
+import argparse
+import fnmatch
+import gzip
+import json
+import lzma
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+from compressed_io import (compression_of, index_path, load_archive_index, open_binary,
+                           ARCHIVE_SUFFIX, INDEX_VERSION)
+from frame_crawler import crawl_root
+
+DEFAULT_EXCLUDE = ("WAVECAR", "CHG", "CHGCAR", "PROCAR", "DOSCAR", "LOCPOT", "ELFCAR")
+
+
+def _compress_to(src: str, dst_fh, kind: str):
+    if kind == "gz":
+        out = gzip.GzipFile(fileobj=dst_fh, mode="wb", compresslevel=6, mtime=0)
+    elif kind == "xz":
+        out = lzma.LZMAFile(dst_fh, mode="wb", preset=6)
+    elif kind == "zst":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("--compress zst needs the 'zstandard' package") from e
+        out = zstandard.ZstdCompressor(level=10).stream_writer(dst_fh, closefd=False)
+    else:
+        raise ValueError(kind)
+    with open(src, "rb") as fin:
+        shutil.copyfileobj(fin, out, 1 << 20)
+    out.close()
+
+
+def _frame_files(frame_dir: str, exclude) -> list[os.DirEntry]:
+    with os.scandir(frame_dir) as it:
+        files = [e for e in it if e.is_file()
+                 and not any(fnmatch.fnmatchcase(e.name, pat) for pat in exclude)]
+    return sorted(files, key=lambda e: e.name)
+
+
+def pack_root(root: str, archive: str | None = None, prefix: str = "frame",
+              exclude=DEFAULT_EXCLUDE, compress: str | None = None,
+              remove: bool = False) -> tuple[str, int, int]:
+    """打包 root，返回 (archive 路径, frame 数, 文件数)。"""
+    root = os.path.abspath(root)
+    archive = os.path.abspath(archive or root.rstrip("/") + ARCHIVE_SUFFIX)
+    frames, _, _ = crawl_root(root, prefix)
+    index: dict[str, dict] = {}
+    n_files = 0
+
+    tmp_archive = archive + ".tmp"
+    with tarfile.open(tmp_archive, "w", format=tarfile.PAX_FORMAT) as tf:
+        for frame_dir, *_ in frames:
+            rel = os.path.relpath(frame_dir, root)
+            files = index.setdefault(rel, {})
+            for e in _frame_files(frame_dir, exclude):
+                st = e.stat()
+                if compress and compression_of(e.name) is None:
+                    name = f"{e.name}.{compress}"
+                    with tempfile.TemporaryFile(dir=os.path.dirname(archive)) as tmp:
+                        _compress_to(e.path, tmp, compress)
+                        ti = tarfile.TarInfo(f"{rel}/{name}")
+                        ti.size = tmp.tell()
+                        ti.mtime = int(st.st_mtime)
+                        tmp.seek(0)
+                        tf.addfile(ti, tmp)
+                else:
+                    name = e.name
+                    ti = tarfile.TarInfo(f"{rel}/{name}")
+                    ti.size = st.st_size
+                    ti.mtime = int(st.st_mtime)
+                    with open(e.path, "rb") as fin:
+                        tf.addfile(ti, fin)
+                # addfile 之后 tf.offset 指向下一个头；数据段按 512 字节对齐在它之前
+                size = tf.members[-1].size
+                offset_data = tf.offset - -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                files[name] = [offset_data, size, st.st_mtime]
+                n_files += 1
+            # 大 root 下 members 列表会一直增长；索引已记录，清掉即可
+            tf.members.clear()
+
+    with open(tmp_archive, "rb+") as f:
+        os.fsync(f.fileno())
+    tmp_index = index_path(archive) + ".tmp"
+    with open(tmp_index, "w") as f:
+        json.dump({"version": INDEX_VERSION, "root": root, "prefix": prefix, "frames": index}, f)
+    os.replace(tmp_archive, archive)
+    os.replace(tmp_index, index_path(archive))
+    load_archive_index.cache_clear()
+
+    if remove:
+        for frame_dir, *_ in frames:
+            shutil.rmtree(frame_dir)
+    return archive, len(frames), n_files
+
+
+def main():
+    ap = argparse.ArgumentParser(description="把 root 下的 frame* 目录打包成带偏移索引的单个归档")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("pack", help="打包一个或多个 root（每个 root 一个归档）")
+    p.add_argument("roots", nargs="+")
+    p.add_argument("-o", "--output", default=None, help="归档路径（仅一个 root 时可用）")
+    p.add_argument("--prefix", default="frame")
+    p.add_argument("--compress", choices=("gz", "xz", "zst"), default=None,
+                   help="把未压缩的文件压缩后再放入归档")
+    p.add_argument("--exclude", default=",".join(DEFAULT_EXCLUDE),
+                   help="不打包的文件名（逗号分隔，支持通配符）")
+    p.add_argument("--remove", action="store_true",
+                   help="打包成功后删除原 frame 目录（被 --exclude 的文件也会一起删除）")
+
+    p = sub.add_parser("list", help="列出归档中的 frame 与文件")
+    p.add_argument("archive")
+
+    p = sub.add_parser("cat", help="把归档成员（自动解压）输出到 stdout")
+    p.add_argument("member", help="<archive>::<frame 相对路径>/<文件名>")
+
+    args = ap.parse_args()
+
+    if args.cmd == "pack":
+        if args.output and len(args.roots) > 1:
+            ap.error("-o/--output 只能用于单个 root")
+        exclude = tuple(x for x in args.exclude.split(",") if x)
+        for root in args.roots:
+            archive, nf, nfiles = pack_root(root, args.output, args.prefix, exclude,
+                                            args.compress, args.remove)
+            print(f"[PACKED] {root} -> {archive} : frames={nf}, files={nfiles}")
+    elif args.cmd == "list":
+        index = load_archive_index(os.path.abspath(args.archive))
+        for rel in sorted(index["frames"]):
+            files = index["frames"][rel]
+            print(f"{rel}\t" + " ".join(f"{n}({v[1]})" for n, v in sorted(files.items())))
+    elif args.cmd == "cat":
+        with open_binary(args.member) as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
+
+
+if __name__ == "__main__":
+    main()
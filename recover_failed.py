@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+recover_failed.py
+
+读取 check_single_convergence.py 写出的 error.out，逐个判断失败原因并准备重算：
+1) 分类（看 OUTCAR 与 vasp.out）：
+   - no_outcar       ：没有 OUTCAR（没跑起来 / 一开始就挂了）
+   - nelm_exhausted  ：电子步跑满 NELM 仍未达到 EDIFF
+   - crash           ：vasp.out 里有报错（EDDDAV/ZHEGV/BAD TERMINATION/被杀等）或 OUTCAR 没写完
+   - diverged        ：scf_watchdog.py 判定 SCF 停滞/振荡并提前中止（frame 目录里有 ABORTED_SCF）
+   - converged       ：其实已经收敛（不处理）
+2) 把这次失败的输出（OUTCAR/OSZICAR/vasp.out/DONE ...）和原 INCAR 挪进 frame 目录下的 attempt_N/，
+   按失败类型和重试次数逐级修改 INCAR（见 POLICIES）：
+   加大 NELM -> ALGO=All -> 调小 AMIX/BMIX -> ALGO=Damped；
+   WAVECAR 头部检查通过时保留并设 ISTART=1 从上次波函数续算，否则挪走并设 ISTART=0；
+   CHGCAR 随失败输出挪走，INCAR 里的 ICHARG=1 改回 0（保留了 WAVECAR）或 2；
+3) 每个 frame 目录的重试历史记在 RETRY.json，超过 --max_retries 的写入 gave_up.txt 不再重试；
+4) 需要重算的目录写入 retry_dirs.txt，用 FRAME_LIST=retry_dirs.txt sbatch submit.sh 提交
+   （--submit "sbatch submit.sh" 会直接提交）。
+
+用法：
+  python recover_failed.py error.out --max_retries 3
+  python recover_failed.py error.out --dry_run          # 只分类、打印将要做的修改
+"""
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import subprocess
+import time
+
+from block_xyz import write_json_atomic, write_text_atomic
+from check_single_convergence import get_nelm
+from compressed_io import open_text, resolve_variant
+from frame_crawler import is_outcar_name
+from scf_stream import ABORT_MARKER
+
+RETRY_FILE = "RETRY.json"
+DEFAULT_NELM = 60
+
+# 失败后需要挪走的输出；输入（INCAR/POSCAR/KPOINTS/POTCAR）和有效的 WAVECAR 留在原地
+OUTPUT_FILES = ("OSZICAR", "vasp.out", "vasprun.xml", "CONTCAR", "XDATCAR", "EIGENVAL",
+                "DOSCAR", "PCDOS", "IBZKPT", "REPORT", "PROCAR", "CHG", "CHGCAR", "LOCPOT",
+                "ELFCAR", "DONE", ABORT_MARKER)
+
+# vasp.out 中的报错特征 -> 简短说明；前面的优先
+CRASH_SIGNATURES = (
+    ("EDDDAV", "EDDDAV"),
+    ("ZHEGV", "ZHEGV"),
+    ("ZPOTRF", "ZPOTRF"),
+    ("Sub-Space-Matrix is not hermitian", "subspace_not_hermitian"),
+    ("ZBRENT", "ZBRENT"),
+    ("VERY BAD NEWS", "very_bad_news"),
+    ("BAD TERMINATION", "bad_termination"),
+    ("Segmentation fault", "segfault"),
+    ("out of memory", "out_of_memory"),
+    ("oom-kill", "out_of_memory"),
+    ("DUE TO TIME LIMIT", "time_limit"),
+    ("CANCELLED", "cancelled"),
+    ("Killed", "killed"),
+)
+# 与对角化相关的报错：第一次重试就换 ALGO，而不是原样重跑
+SOLVER_ERRORS = {"EDDDAV", "ZHEGV", "ZPOTRF", "subspace_not_hermitian"}
+
+# WAVECAR 第一条记录：(记录长度, ISPIN, 精度标记)，均为 float64
+WAVECAR_PREC_TAGS = {45200, 45210, 53300, 53310}
+
+
+def _double_nelm(incar: dict) -> str:
+    return str(max(2 * _int_or(incar.get("NELM"), DEFAULT_NELM), 120))
+
+
+# 每类失败的逐级策略：第 k 次重试应用第 k 项（超出时用最后一项）；
+# 值可以是函数，参数为当前 INCAR 的 {TAG: 值}
+POLICIES = {
+    "no_outcar": [{}],
+    "nelm_exhausted": [
+        {"NELM": _double_nelm},
+        {"NELM": _double_nelm, "ALGO": "All"},
+        {"NELM": _double_nelm, "ALGO": "All", "AMIX": "0.1", "BMIX": "0.0001"},
+        {"NELM": _double_nelm, "ALGO": "Damped", "TIME": "0.4", "AMIX": "0.05", "BMIX": "0.0001"},
+    ],
+    # 看门狗中止：直接从算法/混合参数入手；振荡（charge sloshing）先调小混合
+    "diverged": [
+        {"NELM": _double_nelm, "ALGO": "All"},
+        {"NELM": _double_nelm, "ALGO": "All", "AMIX": "0.1", "BMIX": "0.0001"},
+        {"NELM": _double_nelm, "ALGO": "Damped", "TIME": "0.4", "AMIX": "0.05", "BMIX": "0.0001"},
+    ],
+    "crash": [
+        {},
+        {"ALGO": "Normal"},
+        {"ALGO": "All"},
+        {"ALGO": "Damped", "TIME": "0.4"},
+    ],
+}
+
+
+def _int_or(value, default: int) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+# ======================
+# 1. INCAR 读写
+# ======================
+
+def _split_comment(line: str) -> tuple[str, str]:
+    cut = min((i for i in (line.find("!"), line.find("#")) if i >= 0), default=len(line))
+    return line[:cut], line[cut:]
+
+
+def read_incar(path: str) -> dict:
+    """INCAR -> {TAG(大写): 值字符串}；同一 TAG 出现多次时后者为准（与 VASP 一致）。"""
+    tags = {}
+    if not os.path.isfile(path):
+        return tags
+    with open(path, errors="ignore") as f:
+        for line in f:
+            code, _ = _split_comment(line)
+            for stmt in code.split(";"):
+                if "=" in stmt:
+                    key, val = stmt.split("=", 1)
+                    tags[key.strip().upper()] = val.strip()
+    return tags
+
+
+def update_incar(path: str, changes: dict, note: str = ""):
+    """原地修改 INCAR：已有的 TAG 改值（保留其它内容和注释），没有的追加到末尾。"""
+    lines = []
+    if os.path.isfile(path):
+        with open(path, errors="ignore") as f:
+            lines = f.read().splitlines()
+    left = dict(changes)
+    out = []
+    for line in lines:
+        code, comment = _split_comment(line)
+        stmts = code.split(";")
+        touched = False
+        for k, stmt in enumerate(stmts):
+            if "=" not in stmt:
+                continue
+            key = stmt.split("=", 1)[0].strip().upper()
+            if key in changes:
+                stmts[k] = f"{key} = {changes[key]}"
+                left.pop(key, None)
+                touched = True
+        if touched:
+            line = " ; ".join(s.strip() for s in stmts if s.strip())
+            line += f"   ! {note}" if note else (f"   {comment}" if comment else "")
+        out.append(line)
+    for key, val in left.items():
+        out.append(f"{key} = {val}" + (f"   ! {note}" if note else ""))
+    write_text_atomic(path, "\n".join(out) + "\n")
+
+
+# ======================
+# 2. 分类
+# ======================
+
+def wavecar_valid(path: str) -> bool:
+    """检查 WAVECAR 头：记录长度为正整数、文件大小是其整数倍、ISPIN 与精度标记合法。"""
+    try:
+        size = os.path.getsize(path)
+        if size < 24:
+            return False
+        with open(path, "rb") as f:
+            nrecl, nspin, tag = struct.unpack("<3d", f.read(24))
+    except (OSError, struct.error):
+        return False
+    if not (nrecl > 0 and float(nrecl).is_integer()):
+        return False
+    nrecl = int(nrecl)
+    return (size % nrecl == 0 and size >= 3 * nrecl
+            and nspin in (1.0, 2.0) and int(tag) in WAVECAR_PREC_TAGS)
+
+
+def scan_outcar(outcar: str) -> dict:
+    """一次扫描：是否达到 EDIFF、最后一个离子步的电子步数、是否正常结束。"""
+    info = {"ediff_reached": False, "nelec": 0, "finished": False}
+    cur = 0
+    last_done = None
+    with open_text(outcar) as f:
+        for line in f:
+            if "LOOP:" in line:
+                cur += 1
+            elif "LOOP+:" in line:
+                last_done, cur = cur, 0
+            elif "aborting loop because EDIFF is reached" in line:
+                info["ediff_reached"] = True
+            elif "aborting loop EDIFF was not reached" in line:
+                info["ediff_reached"] = False
+            elif "General timing and accounting" in line:
+                info["finished"] = True
+    info["nelec"] = cur if cur else (last_done or 0)
+    return info
+
+
+def scan_vasp_out(path: str) -> str | None:
+    """返回 vasp.out 中第一个命中的报错特征（按 CRASH_SIGNATURES 顺序），没有则 None。"""
+    path = resolve_variant(path)
+    if path is None:
+        return None
+    found = set()
+    with open_text(path) as f:
+        for line in f:
+            for pat, name in CRASH_SIGNATURES:
+                if pat in line:
+                    found.add(name)
+    for _, name in CRASH_SIGNATURES:
+        if name in found:
+            return name
+    return None
+
+
+def classify_failure(frame_dir: str) -> tuple[str, str]:
+    """返回 (类别, 说明)，类别见模块说明。"""
+    marker = os.path.join(frame_dir, ABORT_MARKER)
+    if os.path.isfile(marker):
+        try:
+            with open(marker) as f:
+                return "diverged", json.load(f).get("reason", "aborted")
+        except (OSError, ValueError):
+            return "diverged", "aborted"
+
+    outcar = resolve_variant(os.path.join(frame_dir, "OUTCAR"))
+    if outcar is None or os.path.getsize(outcar) == 0:
+        return "no_outcar", "OUTCAR missing or empty"
+
+    info = scan_outcar(outcar)
+    crash = scan_vasp_out(os.path.join(frame_dir, "vasp.out"))
+    nelm = get_nelm(os.path.join(frame_dir, "INCAR"), DEFAULT_NELM)
+
+    if info["ediff_reached"] and info["finished"]:
+        return "converged", "EDIFF reached"
+    if crash is not None:
+        return "crash", crash
+    if not info["finished"]:
+        return "crash", "OUTCAR truncated"
+    if info["nelec"] >= nelm:
+        return "nelm_exhausted", f"{info['nelec']} >= NELM={nelm}"
+    return "nelm_exhausted", f"no EDIFF after {info['nelec']} steps (NELM={nelm})"
+
+
+# ======================
+# 3. 准备重试目录
+# ======================
+
+def load_history(frame_dir: str) -> list:
+    path = os.path.join(frame_dir, RETRY_FILE)
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f).get("attempts", [])
+
+
+def save_history(frame_dir: str, attempts: list):
+    write_json_atomic(os.path.join(frame_dir, RETRY_FILE), {"attempts": attempts}, indent=1)
+
+
+def plan_changes(cls: str, detail: str, attempt: int, incar: dict) -> dict:
+    """第 attempt 次重试（从 1 开始）要写入 INCAR 的 {TAG: 值}（不含 ISTART）。"""
+    ladder = POLICIES[cls]
+    k = attempt - 1
+    if cls == "crash" and detail in SOLVER_ERRORS:
+        k += 1  # 对角化报错：原样重跑没有意义，直接换算法
+    if cls == "diverged" and detail == "oscillation":
+        k += 1  # 电荷振荡：跳过只换 ALGO 的一级，直接调小混合
+    step = ladder[min(k, len(ladder) - 1)]
+    return {tag: (val(incar) if callable(val) else val) for tag, val in step.items()}
+
+
+def _attempt_outputs(frame_dir: str) -> list[str]:
+    names = []
+    with os.scandir(frame_dir) as it:
+        for e in it:
+            if e.is_file() and (e.name in OUTPUT_FILES or is_outcar_name(e.name)
+                                or e.name.startswith("vasprun.xml")):
+                names.append(e.name)
+    return sorted(names)
+
+
+def prepare_retry(frame_dir: str, cls: str, detail: str, attempt: int,
+                  dry_run: bool = False) -> dict:
+    """把失败输出挪进 attempt_N/，按策略改 INCAR；返回实际写入的修改。"""
+    incar_path = os.path.join(frame_dir, "INCAR")
+    incar = read_incar(incar_path)
+    changes = plan_changes(cls, detail, attempt, incar)
+
+    wavecar = os.path.join(frame_dir, "WAVECAR")
+    has_wavecar = os.path.isfile(wavecar)
+    keep_wavecar = has_wavecar and cls != "no_outcar" and wavecar_valid(wavecar)
+    if keep_wavecar:
+        changes["ISTART"] = "1"
+    elif _int_or(incar.get("ISTART"), 0) != 0 or has_wavecar:
+        changes["ISTART"] = "0"
+    # CHGCAR 属于失败输出，会被挪进 attempt_N/；order_frames.py seed 设的 ICHARG=1 不能留着，
+    # 改回 VASP 的默认值（有 WAVECAR 时从波函数构造电荷，否则用原子电荷叠加）
+    if _int_or(incar.get("ICHARG"), 2) == 1:
+        changes["ICHARG"] = "0" if keep_wavecar else "2"
+
+    if dry_run:
+        return changes
+
+    adir = os.path.join(frame_dir, f"attempt_{attempt}")
+    os.makedirs(adir, exist_ok=True)
+    for name in _attempt_outputs(frame_dir):
+        shutil.move(os.path.join(frame_dir, name), os.path.join(adir, name))
+    if has_wavecar and not keep_wavecar:
+        shutil.move(wavecar, os.path.join(adir, "WAVECAR"))
+    if os.path.isfile(incar_path):
+        shutil.copy2(incar_path, os.path.join(adir, "INCAR"))
+    if changes:
+        update_incar(incar_path, changes, note=f"recover_failed.py attempt {attempt} ({cls})")
+    return changes
+
+
+# ======================
+# 4. 主逻辑
+# ======================
+
+def read_frame_list(path: str) -> list[str]:
+    with open(path) as f:
+        return [ln.strip() for ln in f if ln.strip() and not ln.startswith("#")]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按失败类型修改 INCAR 并准备重算 error.out 中的 frame")
+    ap.add_argument("error_file", nargs="?", default="error.out",
+                    help="check_single_convergence.py 输出的失败列表（默认 error.out）")
+    ap.add_argument("--max_retries", type=int, default=3, help="每个 frame 最多重试次数")
+    ap.add_argument("--retry_list", default="retry_dirs.txt", help="需要重算的目录列表")
+    ap.add_argument("--gave_up", default="gave_up.txt", help="超过重试上限的目录列表")
+    ap.add_argument("--dry_run", action="store_true", help="只分类并打印计划，不改任何文件")
+    ap.add_argument("--submit", default=None,
+                    help='准备完后执行的提交命令，例如 "sbatch submit.sh"（环境变量 FRAME_LIST 指向 --retry_list）')
+    args = ap.parse_args()
+
+    frames = read_frame_list(args.error_file)
+    retry, gave_up = [], []
+    by_class: dict[str, int] = {}
+
+    for d in frames:
+        d = os.path.abspath(d)
+        if not os.path.isdir(d):
+            print(f"[跳过] 目录不存在: {d}")
+            continue
+        cls, detail = classify_failure(d)
+        by_class[cls] = by_class.get(cls, 0) + 1
+        if cls == "converged":
+            print(f"  [OK] 已收敛: {d}")
+            continue
+
+        history = load_history(d)
+        attempt = len(history) + 1
+        if attempt > args.max_retries:
+            print(f"  [GIVEUP] {cls} ({detail}) 已重试 {len(history)} 次: {d}")
+            gave_up.append(d)
+            continue
+
+        changes = prepare_retry(d, cls, detail, attempt, dry_run=args.dry_run)
+        desc = ", ".join(f"{k}={v}" for k, v in changes.items()) or "INCAR 不变"
+        print(f"  [RETRY {attempt}/{args.max_retries}] {cls} ({detail}) -> {desc}: {d}")
+        if not args.dry_run:
+            history.append({"attempt": attempt, "class": cls, "detail": detail,
+                            "changes": changes, "time": time.strftime("%Y-%m-%d %H:%M:%S")})
+            save_history(d, history)
+        retry.append(d)
+
+    print("\n===== 统计 =====")
+    for cls in sorted(by_class):
+        print(f"{cls:16s} {by_class[cls]}")
+    print(f"重算: {len(retry)}，放弃: {len(gave_up)}")
+
+    if args.dry_run:
+        return
+    with open(args.retry_list, "w") as f:
+        f.writelines(d + "\n" for d in retry)
+    with open(args.gave_up, "w") as f:
+        f.writelines(d + "\n" for d in gave_up)
+    print(f"重算目录已写入: {os.path.abspath(args.retry_list)}")
+
+    if not retry:
+        return
+    if args.submit:
+        env = dict(os.environ, FRAME_LIST=os.path.abspath(args.retry_list))
+        subprocess.run(args.submit, shell=True, check=True, env=env)
+    else:
+        print(f"提交: FRAME_LIST={os.path.abspath(args.retry_list)} sbatch submit.sh")
+
+
+if __name__ == "__main__":
+    main()
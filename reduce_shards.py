@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+reduce_shards.py
+
+1218merge.py 分布式模式（--worker I/M）的 reduce 步骤：
+- 每个 worker 在 <shard_dir>/worker_III_of_MMM/ 下写自己的 train.xyz / test.xyz / mapping_log.csv /
+  ignored_frames.txt，以及 units.txt：每个处理单元 (root 序号, 阶段, 序号) 在这四个文件里各写了多少字节
+  （阶段 0 = 遍历时就被忽略的目录，1 = 参与抽样的 frame），正常结束时写 shard.json；
+- 本脚本检查 M 个分片都已完成且参数一致，然后按 (root 序号, 阶段, 序号) 的规范顺序
+  把各分片的单元依次流式拷贝到最终输出，结果与单进程运行逐字节一致；
+  最终 train/test 以 .gz/.zst 结尾时逐帧写分块压缩（块边界也与单进程一致）；
+- worker 运行时给了 --bucket_batch 的，拼接后同样调用 bucket_order.py；
+- 给了 --shard_frames / --shard_bytes 时，最后把 train/test 切成封顶分片 + manifest.json（见 xyz_shards.py）。
+
+分配方式（1218merge.py --assign）：
+  root：第 ri 个 root（按绝对路径排序）给 ri % M 号 worker；
+  hash：frame 目录路径的 crc32 % M，同一 root 的 frame 分散到各 worker，负载更均匀。
+
+用法：
+  for i in 0 1 2 3; do python 1218merge.py growth/* --worker $i/4 --shard_dir shards & done; wait
+  python reduce_shards.py shards
+"""
+
+import argparse
+import glob
+import heapq
+import json
+import os
+import zlib
+
+from block_xyz import open_xyz_writer, INDEX_SUFFIX
+from bucket_order import reorder_file
+from xyz_stream import iter_frame_spans
+from xyz_shards import shard_file, shard_dir_for, parse_size
+
+SHARD_META = "shard.json"
+SHARD_VERSION = 1
+SHARD_FILES = {"train": "train.xyz", "test": "test.xyz", "mapping": "mapping_log.csv",
+               "ignored": "ignored_frames.txt", "units": "units.txt"}
+UNIT_KEYS = ("train", "test", "mapping", "ignored")
+ASSIGN_MODES = ("hash", "root")
+
+
+def parse_worker(spec: str) -> tuple[int, int]:
+    """'I/M' -> (I, M)，0 <= I < M。"""
+    try:
+        i, m = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"--worker expects I/M, got {spec!r}") from None
+    if not (m >= 1 and 0 <= i < m):
+        raise ValueError(f"--worker expects 0 <= I < M, got {spec!r}")
+    return i, m
+
+
+def shard_path(shard_dir: str, worker: int, workers: int) -> str:
+    return os.path.join(shard_dir, f"worker_{worker:03d}_of_{workers:03d}")
+
+
+def owner(assign: str, workers: int, root_index: int, frame_dir: str) -> int:
+    """处理单元归哪个 worker；只依赖路径和 root 序号，各 worker 独立算出相同结果。"""
+    if assign == "root":
+        return root_index % workers
+    return zlib.crc32(frame_dir.encode("utf-8", "surrogateescape")) % workers
+
+
+def load_shards(shard_dir: str) -> list[tuple[str, dict]]:
+    """返回按 worker 编号排列的 [(分片目录, meta)]；缺分片、未完成或参数不一致时抛 SystemExit。"""
+    metas = []
+    for d in sorted(glob.glob(os.path.join(shard_dir, "worker_*_of_*"))):
+        meta_path = os.path.join(d, SHARD_META)
+        if not os.path.isfile(meta_path):
+            raise SystemExit(f"[ERROR] shard not finished (no {SHARD_META}): {d}")
+        with open(meta_path) as f:
+            metas.append((d, json.load(f)))
+    if not metas:
+        raise SystemExit(f"[ERROR] no worker_*_of_* shards under {shard_dir}")
+    m = metas[0][1]["workers"]
+    ref = metas[0][1]
+    for d, meta in metas:
+        if meta.get("version") != SHARD_VERSION:
+            raise SystemExit(f"[ERROR] shard version mismatch: {d}")
+        if meta["workers"] != m or meta["assign"] != ref["assign"] or meta["signature"] != ref["signature"]:
+            raise SystemExit(f"[ERROR] shard {d} was written with different roots/options than {metas[0][0]}")
+    got = sorted(meta["worker"] for _, meta in metas)
+    if got != list(range(m)):
+        missing = sorted(set(range(m)) - set(got))
+        raise SystemExit(f"[ERROR] expected {m} shards, missing workers: {missing}")
+    return [(d, meta) for d, meta in sorted(metas, key=lambda x: x[1]["worker"])]
+
+
+def _iter_units(path: str, w: int):
+    with open(path) as f:
+        for line in f:
+            vals = [int(x) for x in line.split()]
+            yield (vals[0], vals[1], vals[2]), w, vals[3:]
+
+
+def reduce_shards(shard_dir: str, out_train: str | None = None, out_test: str | None = None,
+                  mapping: str = "mapping_log.csv", ignored: str = "ignored_frames.txt",
+                  frames_per_block: int | None = None) -> dict:
+    """按规范顺序拼接各分片；out_train/out_test/frames_per_block 缺省时用 worker 运行时的参数。"""
+    shards = load_shards(shard_dir)
+    sig = shards[0][1]["signature"]
+    out_train = out_train or sig["out_train"]
+    out_test = out_test or sig["out_test"]
+    fpb = frames_per_block or sig["frames_per_block"]
+
+    header = shards[0][1]["mapping_header"]  # 与单进程运行写的表头相同
+    srcs = [{k: open(os.path.join(d, SHARD_FILES[k]), "rb") for k in UNIT_KEYS} for d, _ in shards]
+    writers = {"train": open_xyz_writer(out_train, fpb), "test": open_xyz_writer(out_test, fpb)}
+    texts = {"mapping": open(mapping, "wb"), "ignored": open(ignored, "wb")}
+    texts["mapping"].write(header.encode())
+    counts = {"train": 0, "test": 0, "ignored": 0, "units": 0}
+    try:
+        units = [_iter_units(os.path.join(d, SHARD_FILES["units"]), w) for w, (d, _) in enumerate(shards)]
+        for _, w, sizes in heapq.merge(*units):
+            counts["units"] += 1
+            for key, n in zip(UNIT_KEYS, sizes):
+                if not n:
+                    continue
+                data = srcs[w][key].read(n)
+                if len(data) != n:
+                    raise SystemExit(f"[ERROR] shard {shards[w][0]}: {SHARD_FILES[key]} shorter than units.txt says")
+                if key in writers:
+                    for start, _, _, _, end in iter_frame_spans(data):
+                        writers[key].write_frame(data[start:end])
+                        counts[key] += 1
+                else:
+                    texts[key].write(data)
+                    if key == "ignored":
+                        counts["ignored"] += data.count(b"\n")
+        for w, (d, _) in enumerate(shards):
+            for key in UNIT_KEYS:
+                if os.path.getsize(os.path.join(d, SHARD_FILES[key])) != srcs[w][key].tell():
+                    print(f"[WARN] shard {d}: {SHARD_FILES[key]} has bytes not listed in units.txt")
+    finally:
+        for f in list(writers.values()) + list(texts.values()):
+            f.close()
+        for s in srcs:
+            for f in s.values():
+                f.close()
+    counts.update(out_train=out_train, out_test=out_test, mapping=mapping, ignored_file=ignored,
+                  bucket_batch=shards[0][1].get("bucket_batch", 0), seed=sig["seed"], frames_per_block=fpb,
+                  roots=sig["roots"], test_fraction=sig["test_fraction"])
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按规范顺序拼接 1218merge.py --worker I/M 写出的分片")
+    ap.add_argument("shard_dir", nargs="?", default="shards")
+    ap.add_argument("--out_train", default=None, help="默认与 worker 运行时的 --out_train 相同")
+    ap.add_argument("--out_test", default=None, help="默认与 worker 运行时的 --out_test 相同")
+    ap.add_argument("--mapping", default="mapping_log.csv")
+    ap.add_argument("--ignored", default="ignored_frames.txt")
+    ap.add_argument("--frames_per_block", type=int, default=None,
+                    help="输出为 .gz/.zst 时每块帧数（默认与 worker 运行时相同）")
+    ap.add_argument("--shard_frames", type=int, default=None,
+                    help="把 train/test 切成每个最多这么多帧的分片 + manifest.json")
+    ap.add_argument("--shard_bytes", type=str, default=None, help="每个分片最多的未压缩字节数（可写 500M / 2G）")
+    ap.add_argument("--shard_jobs", type=int, default=4, help="并行写分片的线程数")
+    ap.add_argument("--no_bucket", action="store_true", help="不执行 worker 运行时要求的 --bucket_batch 重排")
+    args = ap.parse_args()
+
+    c = reduce_shards(args.shard_dir, args.out_train, args.out_test, args.mapping, args.ignored,
+                      args.frames_per_block)
+    if c["bucket_batch"] > 0 and not args.no_bucket:
+        reorder_file(c["out_train"], batch=c["bucket_batch"], seed=c["seed"],
+                     mapping=args.mapping, split="train")
+        print(f"[BUCKET] {c['out_train']} reordered into buckets of {c['bucket_batch']}")
+
+    outs = [c["out_train"], c["out_test"]]
+    if args.shard_frames or args.shard_bytes:
+        for split, path in zip(("train", "test"), outs):
+            shard_file(path, max_frames=args.shard_frames, max_bytes=parse_size(args.shard_bytes),
+                       frames_per_block=c["frames_per_block"], jobs=args.shard_jobs,
+                       meta={"tool": "reduce_shards.py", "split": split, "mapping": args.mapping,
+                             "roots": c["roots"], "seed": c["seed"], "test_fraction": c["test_fraction"]})
+            for p in (path, path + INDEX_SUFFIX):
+                if os.path.exists(p):
+                    os.remove(p)
+        outs = [shard_dir_for(p) + "/" for p in outs]
+
+    print(f"Read total: train={c['train']}, test={c['test']} ({c['units']} units)")
+    print(f"Wrote: {outs[0]}, {outs[1]}, {args.mapping}")
+    print(f"Ignored frames: {c['ignored']} (see {args.ignored})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+rewrite_header.py
+
+process_nepkit.py 的通用版：按给定的一串字段操作改写 extxyz 每帧的注释行（第二行），
+原子行按原始字节直接拷贝；文件按帧对齐分块，多进程并行处理，结果按顺序写出。
+
+字段操作（可重复，按命令行顺序依次执行）：
+  --set KEY=VALUE        设置/覆盖字段，例如 --set weight=2
+  --copy NEW=OLD         用已有字段的值设置新字段，例如 --copy config_type=root
+  --rename OLD=NEW       重命名字段（保留位置和原值）
+  --drop PATTERN         删除字段，支持通配符，例如 --drop frame_dir --drop 'source*'
+  --scale KEY=FACTOR     字段里的所有数乘以 FACTOR，例如 --scale Virial=-1
+
+示例（等价于 process_nepkit.py）：
+  python rewrite_header.py train.xyz -o clean.xyz --drop Config_type
+"""
+
+import argparse
+import fnmatch
+import os
+import sys
+
+from xyz_stream import (open_mmap, resync, iter_frame_spans, chunk_ranges, parallel_map,
+                        parse_header, format_header, quote, unquote)
+
+
+class _OpAction(argparse.Action):
+    """把不同类型的操作按出现顺序追加到同一个列表。"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        ops = getattr(namespace, self.dest, None) or []
+        kind = option_string.lstrip("-")
+        if kind != "drop":
+            if "=" not in values:
+                parser.error(f"{option_string} 需要 A=B 形式的参数: {values}")
+            a, b = values.split("=", 1)
+            if kind == "scale":
+                try:
+                    b = float(b)
+                except ValueError:
+                    parser.error(f"{option_string} 的系数不是数字: {values}")
+            ops.append((kind, a, b))
+        else:
+            ops.append((kind, values, None))
+        setattr(namespace, self.dest, ops)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(
+        description="按字段操作改写 extxyz 注释行（原子行原样拷贝，多进程分块）"
+    )
+    ap.add_argument("input_file", help="输入 .xyz 文件")
+    ap.add_argument("-o", "--output", required=True, help="输出 .xyz 文件")
+    for opt, meta in (("--set", "KEY=VALUE"), ("--copy", "NEW=OLD"),
+                      ("--rename", "OLD=NEW"), ("--drop", "PATTERN"),
+                      ("--scale", "KEY=FACTOR")):
+        ap.add_argument(opt, dest="ops", action=_OpAction, metavar=meta)
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                    help="并行进程数（默认 CPU 核数）")
+    ap.add_argument("--chunk_mb", type=float, default=64.0,
+                    help="每个分块的大小（MB，默认 64）")
+    args = ap.parse_args()
+    if not args.ops:
+        ap.error("至少需要一个字段操作（--set/--copy/--rename/--drop/--scale）")
+    return args
+
+
+def _scale_value(raw: str, factor: float) -> str:
+    text = unquote(raw)
+    out = []
+    for tok in text.split():
+        try:
+            out.append(f"{float(tok) * factor:.14g}")
+        except ValueError:
+            out.append(tok)
+    new = " ".join(out)
+    return quote(new, force=raw.startswith('"'))
+
+
+def apply_ops(fields: dict[str, str], ops) -> dict[str, str]:
+    """对解析后的注释字段依次执行操作；缺失的源字段直接跳过。"""
+    for kind, a, b in ops:
+        if kind == "set":
+            fields[a] = quote(b)
+        elif kind == "copy":
+            if b in fields:
+                fields[a] = fields[b]
+        elif kind == "rename":
+            if a in fields and a != b:
+                fields = {(b if k == a else k): v for k, v in fields.items() if k != b}
+        elif kind == "drop":
+            fields = {k: v for k, v in fields.items() if not fnmatch.fnmatchcase(k, a)}
+        elif kind == "scale":
+            if fields.get(a) is not None:
+                fields[a] = _scale_value(fields[a], b)
+    return fields
+
+
+def rewrite_comment(comment: bytes, ops) -> bytes:
+    text = comment.decode("utf-8", errors="surrogateescape")
+    body = text.rstrip("\r\n")
+    eol = text[len(body):] or "\n"
+    new = format_header(apply_ops(parse_header(body), ops))
+    if new == body:
+        return comment
+    return (new + eol).encode("utf-8", errors="surrogateescape")
+
+
+def rewrite_chunk(task) -> tuple[bytes, int]:
+    """处理起点落在 [start, end) 内的帧，返回 (改写后的字节, 帧数)。"""
+    path, start, end, ops = task
+    buf = open_mmap(path)
+    try:
+        pos = resync(buf, start, limit=end) if start > 0 else 0
+        out = []
+        n = 0
+        for fs, natoms, cs, ats, fe in iter_frame_spans(buf, pos, stop=end):
+            out.append(buf[fs:cs])
+            out.append(rewrite_comment(buf[cs:ats], ops))
+            out.append(buf[ats:fe])
+            n += 1
+        return b"".join(out), n
+    finally:
+        if not isinstance(buf, bytes):
+            buf.close()
+
+
+def rewrite_file(input_file: str, output_file: str, ops, jobs: int = 1,
+                 chunk_bytes: int = 64 << 20) -> int:
+    size = os.path.getsize(input_file)
+    tasks = [(input_file, s, e, ops) for s, e in chunk_ranges(size, chunk_bytes)]
+    tmp = output_file + ".tmp"
+    n_frames = 0
+    with open(tmp, "wb") as fout:
+        for data, n in parallel_map(rewrite_chunk, tasks, jobs):
+            fout.write(data)
+            n_frames += n
+    os.replace(tmp, output_file)
+    return n_frames
+
+
+def main():
+    args = parse_args()
+    if os.path.abspath(args.input_file) == os.path.abspath(args.output):
+        print("Error: 输出文件不能与输入文件相同", file=sys.stderr)
+        sys.exit(1)
+    n = rewrite_file(args.input_file, args.output, args.ops, jobs=args.jobs,
+                     chunk_bytes=int(args.chunk_mb * (1 << 20)))
+    print(f"处理完成。输入文件：{args.input_file}，共 {n} 帧")
+    print(f"输出文件：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+scf_stream.py
+
+增量读取正在写入的 VASP 输出（vasp.out / OSZICAR / OUTCAR），供 monitor_vasp.py 等使用：
+- TailFollower：记住文件偏移，每次只读新增的字节；文件被截断/替换（inode 变化）时从头读；
+  大小没变时只做一次 stat，不打开文件；
+- parse_scf_line：解析 DAV:/RMM:/CG:/... 电子步行 -> (算法, 步号, E, dE)；
+- parse_loop_line：解析 OUTCAR 的 LOOP: / LOOP+: 计时行（cost_profile.py 也用它）；
+- ScfState：累积一个 frame 的电子步、离子步、LOOP 计时，
+  并根据 log10|dE| 的线性趋势估计还需多少电子步收敛（ETA）。
+"""
+
+import math
+import os
+import re
+from collections import deque
+
+ABORT_MARKER = "ABORTED_SCF"   # scf_watchdog.py 中止 SCF 时在 frame 目录写的标记文件
+SCF_TAGS = ("DAV:", "RMM:", "CG :", "CG:", "SDA:", "DIA:", "EDW:")
+IONIC_RE = re.compile(r"^\s*\d+\s+F=")
+# OUTCAR 计时行；字段宽度不够时 VASP 写成 ****（如 'LOOP+:  cpu time********: real time  110.13'）
+LOOP_RE = re.compile(r"LOOP(\+?):\s+cpu time\s*([-\d.]+|\*+):\s+real time\s*([-\d.]+|\*+)")
+
+
+class TailFollower:
+    """按偏移增量读取一个文本文件（只返回完整的行）。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.ino = None
+        self.mtime = None
+        self._partial = b""
+
+    def poll(self, max_bytes: int = 64 << 20) -> tuple[list[str], bool]:
+        """返回 (新增的完整行, 是否从头重读)；文件不存在时返回 ([], False)。"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return [], False
+        reset = False
+        if st.st_ino != self.ino or st.st_size < self.offset:
+            reset = self.ino is not None
+            self.ino, self.offset, self._partial = st.st_ino, 0, b""
+        self.mtime = st.st_mtime
+        if st.st_size == self.offset:
+            return [], reset
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(min(st.st_size - self.offset, max_bytes))
+        self.offset += len(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return [ln.decode("utf-8", "ignore") for ln in lines], reset
+
+
+def parse_scf_line(line: str):
+    """'DAV:   3    -0.12345E+03   -0.456E-02 ...' -> ('DAV', 3, E, dE)；不是电子步行返回 None。"""
+    s = line.lstrip()
+    if not s.startswith(SCF_TAGS):
+        return None
+    tag, _, rest = s.partition(":")
+    parts = rest.split()
+    if len(parts) < 3:
+        return None
+    try:
+        return tag.strip(), int(parts[0]), float(parts[1]), float(parts[2])
+    except ValueError:
+        return None
+
+
+def parse_loop_line(line: str):
+    """
+    'LOOP:  cpu time    0.89: real time    0.89' -> (是否 LOOP+, cpu 秒, real 秒)；不是计时行返回 None。
+    溢出成 **** 的字段记 nan，另一个字段照常使用。
+    """
+    m = LOOP_RE.search(line)
+    if m is None:
+        return None
+    cpu, real = (math.nan if v.startswith("*") else float(v) for v in m.group(2, 3))
+    return m.group(1) == "+", cpu, real
+
+
+class ScfState:
+    """一个 frame 的电子步进度；vasp.out 行用 feed_stdout，OUTCAR 行用 feed_outcar。"""
+
+    def __init__(self, ediff: float = 1e-4, nelm: int = 60, window: int = 8):
+        self.ediff = ediff
+        self.nelm = nelm
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.ionic_done = 0          # 已完成的离子步
+        self.scf_step = 0            # 当前离子步的电子步数
+        self.scf_total = 0           # 所有电子步
+        self.energy = None
+        self.de = deque(maxlen=64)   # 当前离子步的 dE
+        self.loop_times = deque(maxlen=32)  # OUTCAR LOOP: real time（秒/电子步）
+        self.loop_count = 0          # OUTCAR 中当前离子步的 LOOP: 数（vasp.out 没有电子步行时使用）
+        self.ediff_reached = False
+        self.finished = False
+
+    def feed_stdout(self, line: str):
+        rec = parse_scf_line(line)
+        if rec is not None:
+            _, n, e, de = rec
+            if n < self.scf_step:  # 步号回退：新的离子步（没有 F= 行时）
+                self._next_ionic()
+            self.scf_step = n
+            self.scf_total += 1
+            self.energy = e
+            self.de.append(de)
+        elif IONIC_RE.match(line):
+            self._next_ionic()
+
+    def _next_ionic(self):
+        self.ionic_done += 1
+        self.scf_step = 0
+        self.de.clear()
+
+    def feed_outcar(self, line: str):
+        if "LOOP:" in line:
+            rec = parse_loop_line(line)
+            if rec is not None and not math.isnan(rec[2]):
+                self.loop_times.append(rec[2])
+            self.loop_count += 1
+        elif "LOOP+:" in line:
+            self.loop_count = 0
+        elif "aborting loop because EDIFF is reached" in line:
+            self.ediff_reached = True
+        elif "General timing and accounting" in line:
+            self.finished = True
+
+    @property
+    def steps(self) -> int:
+        return self.scf_step or self.loop_count
+
+    def seconds_per_step(self) -> float | None:
+        if not self.loop_times:
+            return None
+        return sum(self.loop_times) / len(self.loop_times)
+
+    def de_slope(self) -> float | None:
+        """最近 window 个电子步 log10|dE| 对步号的斜率（每步下降几个数量级，负数为在收敛）。"""
+        pts = [math.log10(abs(x)) for x in list(self.de)[-self.window:] if x != 0.0]
+        n = len(pts)
+        if n < 3:
+            return None
+        xm = (n - 1) / 2
+        ym = sum(pts) / n
+        sxx = sum((i - xm) ** 2 for i in range(n))
+        return sum((i - xm) * (y - ym) for i, y in enumerate(pts)) / sxx
+
+    def remaining_steps(self) -> int:
+        """按 dE 趋势外推到 |dE| < EDIFF 还需的电子步；不在收敛时按跑满 NELM 估计。"""
+        left = max(0, self.nelm - self.steps)
+        if self.ediff_reached or self.finished:
+            return 0
+        slope = self.de_slope()
+        if slope is None or slope >= 0 or not self.de or self.de[-1] == 0.0:
+            return left
+        need = (math.log10(self.ediff) - math.log10(abs(self.de[-1]))) / slope
+        return min(left, max(0, math.ceil(need)))
+
+    def eta(self) -> float | None:
+        sps = self.seconds_per_step()
+        return None if sps is None else self.remaining_steps() * sps
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+scf_watchdog.py
+
+包住 VASP 命令运行，边转发 stdout 边看电子步（DAV:/RMM: 行），发现不会收敛的 SCF 就提前杀掉：
+- 停滞：当前离子步已跑 >= --min_steps 步，且最近 --window 步里 |dE| 的最小值
+  没有比之前的最小值再降低 --min_gain 倍；
+- 电荷振荡（charge sloshing）：最近 --osc_window 步 dE 的符号几乎每步翻转，
+  |dE| 仍远大于 EDIFF（> --osc_floor × EDIFF），且 log10|dE| 没有在下降。
+前 --min_steps 步（含 NELMDL 的非自洽步）不做判断；|dE| 已低于 EDIFF 时从不中止。
+
+中止时：先 SIGTERM 整个进程组（mpirun 及各 rank），--grace 秒后 SIGKILL；
+在当前目录写 ABORTED_SCF（JSON：原因、离子步、电子步、最近的 dE），退出码 ABORT_EXIT_CODE(3)。
+recover_failed.py 看到 ABORTED_SCF 会归为 diverged 类并按对应策略改 INCAR。
+
+用法（submit.sh 里设置 WATCHDOG=/path/to/scf_watchdog.py 即启用）：
+  python scf_watchdog.py --window 15 -- mpirun -np 28 vasp_std
+  python scf_watchdog.py -- python fake_vasp.py --mode oscillate    # 本地试验
+"""
+
+import argparse
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import deque
+
+from block_xyz import write_json_atomic
+from recover_failed import read_incar
+from scf_stream import parse_scf_line, IONIC_RE, ABORT_MARKER
+
+ABORT_EXIT_CODE = 3
+
+
+class ScfWatchdog:
+    """只做判断，不管进程：逐行 feed，返回中止原因（字符串）或 None。"""
+
+    def __init__(self, ediff: float = 1e-4, window: int = 15, min_steps: int = 20,
+                 osc_window: int = 10, osc_floor: float = 100.0, min_gain: float = 2.0):
+        self.ediff = ediff
+        self.window = window
+        self.min_gain = min_gain
+        self.min_steps = min_steps
+        self.osc_window = osc_window
+        self.osc_floor = osc_floor
+        self.ionic = 0
+        self._new_ionic()
+
+    def _new_ionic(self):
+        self.step = 0
+        self.de: list[float] = []   # 当前离子步的全部 dE（最多 NELM 个）
+        self.history = deque(maxlen=64)
+
+    def feed(self, line: str) -> str | None:
+        rec = parse_scf_line(line)
+        if rec is None:
+            if IONIC_RE.match(line):
+                self.ionic += 1
+                self._new_ionic()
+            return None
+        _, n, _, de = rec
+        if n < self.step:
+            self.ionic += 1
+            self._new_ionic()
+        self.step = n
+        self.de.append(de)
+        self.history.append(de)
+        if n < self.min_steps or abs(de) < self.ediff:
+            return None
+        return self._stagnated() or self._oscillating()
+
+    def _stagnated(self) -> str | None:
+        if len(self.de) <= self.window:
+            return None
+        best_before = min(abs(x) for x in self.de[:-self.window])
+        best_recent = min(abs(x) for x in self.de[-self.window:])
+        if best_recent * self.min_gain > best_before:
+            return (f"stagnation: min|dE| over last {self.window} steps = {best_recent:.3e} "
+                    f"not {self.min_gain:g}x below earlier best {best_before:.3e}")
+        return None
+
+    def _oscillating(self) -> str | None:
+        win = self.de[-self.osc_window:]
+        if len(win) < self.osc_window:
+            return None
+        flips = sum(1 for a, b in zip(win, win[1:]) if a * b < 0)
+        if flips < len(win) - 2:
+            return None
+        if min(abs(x) for x in win) < self.osc_floor * self.ediff:
+            return None
+        logs = [math.log10(abs(x)) for x in win if x != 0.0]
+        half = len(logs) // 2
+        # 后半段的平均量级没有比前半段低半个数量级 -> 没在收敛
+        if sum(logs[half:]) / (len(logs) - half) > sum(logs[:half]) / half - 0.5:
+            return (f"oscillation: dE changed sign {flips} times in {len(win)} steps, "
+                    f"|dE| ~ {abs(win[-1]):.3e}")
+        return None
+
+
+def _kill_group(proc: subprocess.Popen, grace: float):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+
+
+def write_marker(path: str, reason: str, dog: ScfWatchdog, cmd: list):
+    write_json_atomic(path, {"reason": reason.split(":")[0], "detail": reason,
+                             "ionic_step": dog.ionic, "scf_step": dog.step,
+                             "recent_de": list(dog.history)[-20:], "command": cmd,
+                             "time": time.strftime("%Y-%m-%d %H:%M:%S")}, indent=1)
+
+
+def run(cmd: list, dog: ScfWatchdog, marker: str = ABORT_MARKER, grace: float = 30.0) -> int:
+    """运行 cmd，stdout/stderr 原样转发到本进程 stdout；返回退出码（中止时为 ABORT_EXIT_CODE）。"""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    out = sys.stdout.buffer
+    reason = None
+    try:
+        for raw in proc.stdout:
+            out.write(raw)
+            out.flush()
+            reason = dog.feed(raw.decode("utf-8", "ignore"))
+            if reason:
+                break
+    except KeyboardInterrupt:
+        _kill_group(proc, grace)
+        raise
+    if reason is None:
+        return proc.wait()
+
+    msg = f"[WATCHDOG] aborting SCF at ionic step {dog.ionic}, electronic step {dog.step}: {reason}"
+    out.write((msg + "\n").encode())
+    out.flush()
+    _kill_group(proc, grace)
+    proc.stdout.close()
+    write_marker(marker, reason, dog, cmd)
+    return ABORT_EXIT_CODE
+
+
+def main():
+    ap = argparse.ArgumentParser(description="运行 VASP 并在 SCF 停滞/振荡时提前中止",
+                                 usage="%(prog)s [options] -- vasp command ...")
+    ap.add_argument("--window", type=int, default=15,
+                    help="|dE| 连续多少步没有明显创新低视为停滞")
+    ap.add_argument("--min_gain", type=float, default=2.0,
+                    help="窗口内的最小 |dE| 至少要比之前的最小值低这么多倍，否则视为停滞")
+    ap.add_argument("--min_steps", type=int, default=20, help="每个离子步前多少个电子步不做判断")
+    ap.add_argument("--osc_window", type=int, default=10, help="判断符号振荡看最近多少步")
+    ap.add_argument("--osc_floor", type=float, default=100.0,
+                    help="|dE| 低于 osc_floor×EDIFF 时不按振荡中止")
+    ap.add_argument("--ediff", type=float, default=None, help="默认从当前目录 INCAR 读取（缺省 1E-4）")
+    ap.add_argument("--grace", type=float, default=30.0, help="SIGTERM 后等待多少秒再 SIGKILL")
+    ap.add_argument("--marker", default=ABORT_MARKER, help="中止时写的标记文件")
+    ap.add_argument("cmd", nargs=argparse.REMAINDER)
+    args = ap.parse_args()
+
+    cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+    if not cmd:
+        ap.error("missing command, e.g. -- mpirun -np 28 vasp_std")
+
+    ediff = args.ediff
+    if ediff is None:
+        try:
+            ediff = float(read_incar("INCAR").get("EDIFF", "1E-4").replace("d", "e").replace("D", "E"))
+        except ValueError:
+            ediff = 1e-4
+    dog = ScfWatchdog(ediff=ediff, window=args.window, min_steps=args.min_steps,
+                      osc_window=args.osc_window, osc_floor=args.osc_floor,
+                      min_gain=args.min_gain)
+    sys.exit(run(cmd, dog, args.marker, args.grace))
+
+
+if __name__ == "__main__":
+    main()
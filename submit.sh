@@ -21,49 +21,81 @@ ulimit -s unlimited
 ulimit -l unlimited
 
 # 用 srun 或 mpirun 执行 VASP（根据你的集群环境可选）
+# 设置 WATCHDOG=/path/to/scf_watchdog.py 时由看门狗包住运行：SCF 停滞/振荡时提前中止，
+# 写 ABORTED_SCF 并以退出码 3 结束（WATCHDOG_ARGS 可传 --window 等参数）
 run_vasp() {
-  mpirun -np "${SLURM_NTASKS}" "${vasp_path}/bin/vasp_std" | tee vasp.out
+  if [ -n "${WATCHDOG:-}" ]; then
+    python "$WATCHDOG" ${WATCHDOG_ARGS:-} -- mpirun -np "${SLURM_NTASKS}" "${vasp_path}/bin/vasp_std"
+  else
+    mpirun -np "${SLURM_NTASKS}" "${vasp_path}/bin/vasp_std"
+  fi
 }
 
-progress_file="progress.log"
+workdir="$(pwd)"
+progress_file="${workdir}/progress.log"
+# order_frames.py 的位置，默认取提交目录下的（sbatch 会把本脚本拷到 spool 目录，不能用 $0 找）；
+# 必须是绝对路径，因为循环里会 cd 进各 frame 目录
+ORDER_PY="${ORDER_PY:-${workdir}/order_frames.py}"
 : > "$progress_file"   # 清空旧记录
 
-for step in $(seq 2365 1 3040); do
-  d=$(printf "frame_%05d" "$step")
+# 要算的目录：默认 frame_02365 ~ frame_03040；
+# 设置 FRAME_LIST=retry_dirs.txt（每行一个目录，recover_failed.py 生成）时只算列表中的目录；
+# 也可以是 order_frames.py 生成的 order.txt（按结构相似度排好的顺序）
+frame_dirs() {
+  if [ -n "${FRAME_LIST:-}" ]; then
+    grep -v '^[[:space:]]*\(#\|$\)' "$FRAME_LIST"
+  else
+    for step in $(seq 2365 1 3040); do
+      printf "frame_%05d\n" "$step"
+    done
+  fi
+}
+
+for d in $(frame_dirs); do
+  cd "$workdir"
   if [ ! -d "$d" ]; then
     echo "目录不存在：$d，跳过" | tee -a "$progress_file"
     continue
   fi
 
+  # 相似度排序模式（order_frames.py）：设置 ORDER_JSON 时，先用前驱 frame 的 WAVECAR 作初猜
+  if [ -n "${ORDER_JSON:-}" ] && [ ! -s "$d/OUTCAR" ] && [ ! -f "$d/DONE" ]; then
+    python "$ORDER_PY" seed "$d" --order "$ORDER_JSON" 2>&1 | tee -a "$progress_file"
+  fi
+
   echo ">>> [$d] 开始：$(date)" | tee -a "$progress_file"
-  cd "$d" || { echo "无法进入目录 $d, 跳过" | tee -a "../$progress_file"; cd ..; continue; }
+  cd "$d" || { echo "无法进入目录 $d, 跳过" | tee -a "$progress_file"; continue; }
 
   if [ -s OUTCAR ] || [ -f DONE ]; then
-    echo "    已存在 OUTCAR/DONE，跳过" | tee -a "../$progress_file"
-    cd ..
+    echo "    已存在 OUTCAR/DONE，跳过" | tee -a "$progress_file"
     continue
   fi
 
   : > vasp.out
 
-  # 运行 VASP，并捕捉退出代码
+  # 运行 VASP，并捕捉退出代码（取管道中 run_vasp 的退出码，而不是 tee 的）
   run_vasp 2>&1 | tee -a vasp.out
-  exit_code=$?
-  
+  exit_code=${PIPESTATUS[0]}
+
+  if [ $exit_code -eq 3 ] && [ -f ABORTED_SCF ]; then
+    echo "    [$d] SCF 不收敛，看门狗提前中止（见 ABORTED_SCF）" | tee -a "$progress_file"
+    echo "ABORTED_SCF: $d" >> "$progress_file"
+    continue
+  fi
+
   if [ $exit_code -ne 0 ]; then
     # 出错情况
-    echo "    [$d] 出错，退出码 = $exit_code" | tee -a "../$progress_file"
-    echo "ERROR: $d failed with exit code $exit_code" >> "../$progress_file"
-    cd ..
+    echo "    [$d] 出错，退出码 = $exit_code" | tee -a "$progress_file"
+    echo "ERROR: $d failed with exit code $exit_code" >> "$progress_file"
     # 跳过去，不创建 DONE，不影响其它目录
     continue
   fi
 
   # 成功时才创建标志文件
   touch DONE
-  echo "    [$d] 完成：$(date)" | tee -a "../$progress_file"
-  echo "$step" >> "../$progress_file"
-  cd ..
+  echo "    [$d] 完成：$(date)" | tee -a "$progress_file"
+  echo "$d" >> "$progress_file"
 done
+cd "$workdir"
 
 echo "✅ 全部单点能顺序完成（含跳过出错项） $(date)" | tee -a "$progress_file"
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+union_xyz.py
+
+合并多个 train.xyz（不同批次、merge.py / 22merge.py / 1218merge.py 的产物），去重并报告冲突：
+- 每帧两个键：
+  来源键   root + frame_dir（没有时用 frame）+ source + ionic_step，注释行里没有 frame_dir/frame 时不用；
+  内容哈希 元素序列 + 坐标（按 float64 精确值，-0.0 视同 0.0）的 blake2b；
+  新帧与已保留的帧来源键相同、或内容哈希相同，即视为同一帧；
+- 同一帧的标签（energy / forces / virial）完全一致记为 duplicate，不一致记为 conflict
+  （同一 frame_dir 被不同脚本按不同 virial 约定写了两次，就会是 virial 不同的 conflict）；
+- 键和标签哈希放在磁盘上的 sqlite 索引里，不在内存里攒帧；各输入只顺序读一遍，
+  保留的帧原样拷贝到输出（.gz/.zst 写分块压缩）；
+- 冲突处理策略（--policy）决定各输入的处理顺序，先处理的输入里的帧优先保留：
+  first   按命令行顺序；
+  newest  按输入文件修改时间从新到旧；
+  prefer  匹配 --prefer（路径或文件名的通配符，可多次给出）的输入先处理，其余按命令行顺序；
+  输出中的帧也按这个顺序排列。
+- 被丢掉的帧写到 --conflicts（CSV）：类型、按哪个键匹配、保留/丢弃的 输入:帧号、不同的标签、能量差。
+
+用法：
+  python union_xyz.py old/train.xyz new/train.xyz.zst -o union.xyz --policy newest
+  python union_xyz.py a.xyz b.xyz -o union.xyz --policy prefer --prefer 'b*' --index union.sqlite
+"""
+
+import argparse
+import csv
+import fnmatch
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+
+from block_xyz import open_frame_reader, open_xyz_writer
+from xyz_stream import parse_header, find_header_value, property_columns
+
+POLICIES = ("first", "newest", "prefer")
+LABELS = ("energy", "forces", "virial")
+CONFLICT_FIELDS = ["kind", "match", "kept_input", "kept_frame", "dropped_input", "dropped_frame",
+                   "root", "frame_dir", "source", "ionic_step", "differs", "dE_per_atom"]
+
+_SCHEMA = """
+CREATE TABLE inputs (id INTEGER PRIMARY KEY, path TEXT, mtime REAL, frames INTEGER);
+CREATE TABLE frames (
+    id INTEGER PRIMARY KEY, input INTEGER, idx INTEGER, kept INTEGER,
+    prov TEXT, chash BLOB, natoms INTEGER, energy REAL, fhash BLOB, vhash BLOB
+);
+CREATE UNIQUE INDEX kept_prov ON frames(prov) WHERE kept = 1 AND prov IS NOT NULL;
+CREATE UNIQUE INDEX kept_chash ON frames(chash) WHERE kept = 1;
+"""
+
+
+def _digest(*parts: bytes) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    for p in parts:
+        h.update(p)
+    return h.digest()
+
+
+def _array_hash(values) -> bytes | None:
+    if values is None:
+        return None
+    return _digest((np.asarray(values, dtype=np.float64) + 0.0).tobytes())  # +0.0：-0.0 -> 0.0
+
+
+def frame_arrays(frame: bytes) -> dict:
+    """一帧原始字节 -> 来源字段、元素、坐标/力/virial 数组（float64）和能量；不经 ASE，缺失的标签为 None。"""
+    lines = frame.split(b"\n")
+    natoms = int(lines[0])
+    fields = parse_header(lines[1].decode("utf-8", "ignore"))
+
+    cols = property_columns(fields)
+    cs, cp = cols.get("species", (0, 1))[0], cols.get("pos", (1, 3))[0]
+    cf = cols.get("forces", cols.get("force", (None, 0)))[0]
+    rows = [ln.split() for ln in lines[2:2 + natoms]]
+    forces = None
+    if cf is not None:
+        forces = np.array([r[cf:cf + 3] for r in rows], dtype=np.float64).reshape(natoms, 3)
+
+    root = find_header_value(fields, "root")
+    where = find_header_value(fields, "frame_dir") or find_header_value(fields, "frame")
+    source = find_header_value(fields, "source")
+    step = find_header_value(fields, "ionic_step")
+    try:
+        energy = float(find_header_value(fields, "energy"))
+    except ValueError:
+        energy = None
+    vir = find_header_value(fields, "virial") or find_header_value(fields, "stress")
+    return {
+        "prov": "\t".join((root, where, source, step)) if where else None,
+        "root": root, "frame_dir": where, "source": source, "ionic_step": step,
+        "natoms": natoms, "species": b" ".join(r[cs] for r in rows),
+        "positions": np.array([r[cp:cp + 3] for r in rows], dtype=np.float64).reshape(natoms, 3),
+        "forces": forces, "energy": energy,
+        "virial": np.array([float(x) for x in vir.split()], dtype=np.float64) if vir else None,
+    }
+
+
+def content_hash(fa: dict) -> bytes:
+    """元素序列 + 坐标的精确哈希（frame_arrays 的结果）。"""
+    return _digest(fa["species"], b"\0", (fa["positions"] + 0.0).tobytes())
+
+
+def frame_keys(frame: bytes) -> dict:
+    """一帧原始字节 -> 来源键、内容哈希、标签（能量值，力/virial 的哈希）。"""
+    fa = frame_arrays(frame)
+    return {
+        "prov": fa["prov"], "root": fa["root"], "frame_dir": fa["frame_dir"], "source": fa["source"],
+        "ionic_step": fa["ionic_step"], "chash": content_hash(fa),
+        "natoms": fa["natoms"], "energy": fa["energy"],
+        "fhash": _array_hash(fa["forces"]), "vhash": _array_hash(fa["virial"]),
+    }
+
+
+def input_order(paths: list[str], policy: str, prefer: list[str] | None = None) -> list[int]:
+    """按策略给出输入的处理顺序（下标）；同等优先级保持命令行顺序。"""
+    idx = list(range(len(paths)))
+    if policy == "newest":
+        return sorted(idx, key=lambda i: -os.path.getmtime(paths[i]))
+    if policy == "prefer":
+        pats = prefer or []
+
+        def preferred(i):
+            return any(fnmatch.fnmatch(paths[i], p) or fnmatch.fnmatch(os.path.basename(paths[i]), p)
+                       for p in pats)
+        return sorted(idx, key=lambda i: not preferred(i))
+    return idx
+
+
+def _differs(new: dict, old) -> list[str]:
+    """old 为 frames 表的一行 (chash, energy, fhash, vhash)。"""
+    out = []
+    if new["chash"] != old[0]:
+        out.append("structure")
+    if new["energy"] != old[1]:
+        out.append("energy")
+    if new["fhash"] != old[2]:
+        out.append("forces")
+    if new["vhash"] != old[3]:
+        out.append("virial")
+    return out
+
+
+def union(paths: list[str], output: str, policy: str = "first", prefer: list[str] | None = None,
+          index: str | None = None, conflicts: str = "union_conflicts.csv",
+          frames_per_block: int = 256, commit_every: int = 20000) -> dict:
+    """把 paths 合并到 output；返回计数。index 为 None 时索引放临时文件，结束后删除。"""
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy {policy!r}, expected one of {POLICIES}")
+    out_abs = os.path.abspath(output)
+    if any(os.path.abspath(p) == out_abs for p in paths):
+        raise ValueError(f"output {output} is also an input")
+
+    tmp = None
+    if index is None:
+        fd, tmp = tempfile.mkstemp(prefix=".union_", suffix=".sqlite",
+                                   dir=os.path.dirname(out_abs) or ".")
+        os.close(fd)
+        index = tmp
+    if os.path.exists(index):
+        os.remove(index)
+    db = sqlite3.connect(index)
+    db.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF; PRAGMA cache_size=-65536;")
+    db.executescript(_SCHEMA)
+
+    counts = {"read": 0, "kept": 0, "duplicate": 0, "conflict": 0}
+    counts.update({f"differs_{k}": 0 for k in ("structure",) + LABELS})
+    writer = open_xyz_writer(output, frames_per_block)
+    report = open(conflicts, "w", newline="")
+    w = csv.writer(report)
+    w.writerow(CONFLICT_FIELDS)
+    try:
+        order = input_order(paths, policy, prefer)
+        for rank, k in enumerate(order):
+            path = paths[k]
+            db.execute("INSERT INTO inputs VALUES (?, ?, ?, NULL)", (k, path, os.path.getmtime(path)))
+            reader = open_frame_reader(path)
+            n_in = 0
+            try:
+                for i, fb in enumerate(reader.iter_frame_bytes()):
+                    n_in += 1
+                    key = frame_keys(fb)
+                    match, hit = "provenance", None
+                    if key["prov"] is not None:
+                        hit = db.execute("SELECT chash, energy, fhash, vhash, input, idx FROM frames "
+                                         "WHERE kept = 1 AND prov = ?", (key["prov"],)).fetchone()
+                    if hit is None:
+                        match = "content"
+                        hit = db.execute("SELECT chash, energy, fhash, vhash, input, idx FROM frames "
+                                         "WHERE kept = 1 AND chash = ?", (key["chash"],)).fetchone()
+                    kept = hit is None
+                    db.execute("INSERT INTO frames (input, idx, kept, prov, chash, natoms, energy, fhash, vhash) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (k, i, int(kept), key["prov"], key["chash"], key["natoms"],
+                                key["energy"], key["fhash"], key["vhash"]))
+                    if kept:
+                        writer.write_frame(fb)
+                        counts["kept"] += 1
+                    else:
+                        diff = _differs(key, hit)
+                        kind = "conflict" if diff else "duplicate"
+                        counts[kind] += 1
+                        for d in diff:
+                            counts[f"differs_{d}"] += 1
+                        de = ""
+                        if key["energy"] is not None and hit[1] is not None:
+                            de = f"{(key['energy'] - hit[1]) / key['natoms']:.6g}"
+                        w.writerow([kind, match, paths[hit[4]], hit[5], path, i, key["root"],
+                                    key["frame_dir"], key["source"], key["ionic_step"],
+                                    ";".join(diff), de])
+                    counts["read"] += 1
+                    if counts["read"] % commit_every == 0:
+                        db.commit()
+            finally:
+                reader.close()
+            db.execute("UPDATE inputs SET frames = ? WHERE id = ?", (n_in, k))
+            print(f"[UNION] {path}: {n_in} frames (priority {rank + 1}/{len(order)})")
+        db.commit()
+    finally:
+        writer.close()
+        report.close()
+        db.close()
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按来源键 + 内容哈希合并多个 extxyz，去重并报告冲突")
+    ap.add_argument("inputs", nargs="+", help="输入 extxyz（可为 .gz/.zst 分块压缩）")
+    ap.add_argument("-o", "--output", required=True, help="输出 extxyz（.gz/.zst 写分块压缩）")
+    ap.add_argument("--policy", choices=POLICIES, default="first",
+                    help="同一帧出现多次时保留哪个输入的：first / newest（文件修改时间）/ prefer")
+    ap.add_argument("--prefer", action="append", default=[],
+                    help="--policy prefer 时优先的输入（路径或文件名通配符，可多次给出）")
+    ap.add_argument("--index", default=None, help="保留 sqlite 索引到此路径（默认用临时文件，结束后删除）")
+    ap.add_argument("--conflicts", default="union_conflicts.csv", help="被丢弃帧的报告（CSV）")
+    ap.add_argument("--frames_per_block", type=int, default=256, help="输出为 .gz/.zst 时每块帧数")
+    args = ap.parse_args()
+    if args.policy == "prefer" and not args.prefer:
+        ap.error("--policy prefer needs at least one --prefer")
+
+    c = union(args.inputs, args.output, args.policy, args.prefer, args.index, args.conflicts,
+              args.frames_per_block)
+    print(f"Read: {c['read']} frames from {len(args.inputs)} files")
+    print(f"Wrote: {c['kept']} frames -> {args.output}")
+    print(f"Dropped: {c['duplicate']} duplicates, {c['conflict']} conflicts (see {args.conflicts})")
+    if c["conflict"]:
+        parts = [f"{k}={c[f'differs_{k}']}" for k in ("structure",) + LABELS if c[f"differs_{k}"]]
+        print(f"[CONFLICT] labels that differ: {', '.join(parts)}")
+
+
+if __name__ == "__main__":
+    main()
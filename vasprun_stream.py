@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+vasprun_stream.py
+
+用 ElementTree.iterparse 流式读取 vasprun.xml，逐个产出 <calculation>（离子步）：
+- 结构：calculation/structure 的 basis + positions（分数坐标，转成笛卡尔）；
+- 力：calculation/varray[@name="forces"]（eV/Å）；
+- 能量：与 ASE 相同，free_energy 取 calculation/energy 的 e_fr_energy 减去 PSTRESS × 体积 / 1602.1766208
+  （PSTRESS≠0 时那里的 e_fr_energy 是含 PV 项的焓，OUTCAR 的 TOTEN 不含），
+  energy = free_energy + (最后一个 scstep 的 e_0_energy - e_fr_energy)
+  （VASP 写在 calculation/energy 里的 e_0_energy 有已知错误）；
+- virial：calculation/varray[@name="stress"]（kB）× 体积 / 1602.1766208 -> eV，
+  与 OUTCAR “FORCE on cell =-STRESS” 的 Total 行同号同义；没有 stress 时为 None。
+
+内存有界：scstep / eigenvalues / dos 等子树在结束时立即清空，每个 calculation
+处理完后清空整棵树；未被选中的步只保留几行文本，不构造数组。
+选步方式与 outcar_stream.iter_ionic_steps 相同（stride / min_de / include_last），
+另有 last_only 只取最后一步。
+
+文件被截断（作业中断）时 iterparse 在末尾报错，这里抛 VasprunTruncated，
+调用方据此回退到 OUTCAR。
+
+命令行：python vasprun_stream.py vasprun.xml --stride 10   （列出选中的步）
+"""
+
+import argparse
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from compressed_io import open_binary, compression_of, ARCHIVE_SEP
+
+EV_A3_PER_KBAR = 1602.1766208
+_DISCARD_TAGS = {"scstep", "eigenvalues", "eigenvalues_kpoints_opt", "dos", "projected",
+                 "projected_kpoints_opt", "dielectricfunction"}
+
+
+class VasprunTruncated(ValueError):
+    """vasprun.xml 不完整（作业中断或仍在写），completed 为已完整读到的 calculation 数。"""
+
+    def __init__(self, msg: str, completed: int = 0):
+        super().__init__(msg)
+        self.completed = completed
+
+
+def is_complete(path: str, tail_bytes: int = 4096) -> bool | None:
+    """
+    普通文件：看末尾是否有 </modeling>，返回 True/False；
+    压缩文件/归档成员无法廉价地看末尾，返回 None（由流式解析时发现截断）。
+    """
+    if ARCHIVE_SEP in path or compression_of(path) is not None:
+        return None
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - tail_bytes))
+        return b"</modeling>" in f.read()
+
+
+def _species(atominfo) -> list[str]:
+    for arr in atominfo.iter("array"):
+        if arr.get("name") == "atoms":
+            return [rc.find("c").text.strip() for rc in arr.iter("rc")]
+    raise ValueError("no atominfo/array[@name='atoms'] in vasprun.xml")
+
+
+def _varray_texts(parent, name: str) -> list[str] | None:
+    for va in parent.findall("varray"):
+        if va.get("name") == name:
+            return [v.text for v in va.findall("v")]
+    return None
+
+
+def _energy_value(energy, name: str) -> float | None:
+    if energy is None:
+        return None
+    for i in energy.findall("i"):
+        if i.get("name") == name:
+            return float(i.text)
+    return None
+
+
+def _pstress(parameters) -> float:
+    """<parameters> 里的 PSTRESS（kB），没有时为 0。"""
+    for i in parameters.iter("i"):
+        if i.get("name") == "PSTRESS":
+            return float(i.text)
+    return 0.0
+
+
+def _raw_calculation(calc, last_sc: tuple, pstress: float = 0.0) -> tuple | None:
+    """从 calculation 元素里只摘出需要的文本；缺项（未完成的步）返回 None。pstress 不为 0 时扣掉 PV 项。"""
+    structure = calc.find("structure")
+    forces = _varray_texts(calc, "forces")
+    free_energy = _energy_value(calc.find("energy"), "e_fr_energy")
+    if structure is None or forces is None or free_energy is None:
+        return None
+    crystal = structure.find("crystal")
+    basis = _varray_texts(crystal, "basis") if crystal is not None else None
+    positions = _varray_texts(structure, "positions")
+    if basis is None or positions is None:
+        return None
+    if pstress:
+        free_energy -= pstress * abs(np.linalg.det(_to_array(basis))) / EV_A3_PER_KBAR
+    sc_e0, sc_fr = last_sc
+    energy = free_energy + (sc_e0 - sc_fr) if sc_e0 is not None and sc_fr is not None else free_energy
+    return basis, positions, forces, _varray_texts(calc, "stress"), energy, free_energy
+
+
+def _to_array(texts: list[str]) -> np.ndarray:
+    return np.array([t.split() for t in texts], dtype=float)
+
+
+def _build_step(index, symbols, raw) -> dict:
+    basis, positions, forces, stress, energy, free_energy = raw
+    cell = _to_array(basis)
+    virial = None
+    if stress is not None:
+        virial = _to_array(stress) * abs(np.linalg.det(cell)) / EV_A3_PER_KBAR
+    return {
+        "index": index,
+        "symbols": symbols,
+        "cell": cell,
+        "positions": _to_array(positions) @ cell,
+        "forces": _to_array(forces),
+        "energy": energy,
+        "free_energy": free_energy,
+        "virial": virial,
+    }
+
+
+def iter_calculations(fh, stride: int = 1, min_de: float | None = None,
+                      include_last: bool = False, last_only: bool = False):
+    """
+    fh: 二进制文件对象（可以是解压流）。
+    产出 dict，键与 outcar_stream.iter_ionic_steps 相同：
+    index / symbols / cell / positions / forces / energy / free_energy / virial。
+    文件被截断时已产出的步保持有效，随后抛 VasprunTruncated。
+    """
+    stride = max(1, int(stride))
+    symbols = None
+    root = None
+    depth = 0
+    calc_depth = None
+    last_sc = (None, None)
+    pstress = 0.0
+    step = 0
+    last_kept_e = None
+    pending_last = None
+
+    try:
+        for event, elem in ET.iterparse(fh, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = elem
+                elif elem.tag == "calculation" and calc_depth is None:
+                    calc_depth = depth
+                    last_sc = (None, None)
+                continue
+            depth -= 1
+
+            tag = elem.tag
+            if tag == "atominfo":
+                symbols = _species(elem)
+                elem.clear()
+            elif tag == "parameters" and calc_depth is None:
+                pstress = _pstress(elem)
+                elem.clear()
+            elif tag == "scstep" and calc_depth is not None:
+                en = elem.find("energy")
+                last_sc = (_energy_value(en, "e_0_energy"), _energy_value(en, "e_fr_energy"))
+                elem.clear()
+            elif tag in _DISCARD_TAGS:
+                elem.clear()
+            elif tag == "calculation" and calc_depth is not None and depth == calc_depth - 1:
+                calc_depth = None
+                raw = _raw_calculation(elem, last_sc, pstress)
+                root.clear()
+                if raw is None or symbols is None:
+                    continue
+                energy = raw[4]
+                if last_only:
+                    pending_last = (step, raw)
+                else:
+                    keep = step % stride == 0
+                    if keep and min_de is not None and last_kept_e is not None:
+                        keep = abs(energy - last_kept_e) / len(symbols) >= min_de
+                    if keep:
+                        last_kept_e = energy
+                        pending_last = None
+                        yield _build_step(step, symbols, raw)
+                    elif include_last:
+                        pending_last = (step, raw)
+                step += 1
+    except ET.ParseError as e:
+        raise VasprunTruncated(f"vasprun.xml truncated or malformed: {e}", completed=step) from None
+
+    if pending_last is not None:
+        idx, raw = pending_last
+        yield _build_step(idx, symbols, raw)
+
+
+def read_last_calculation(path: str) -> dict:
+    """读取最后一个完整的 calculation；文件不完整时抛 VasprunTruncated。"""
+    if is_complete(path) is False:
+        raise VasprunTruncated("vasprun.xml has no closing </modeling>")
+    last = None
+    with open_binary(path) as fh:
+        for last in iter_calculations(fh, last_only=True):
+            pass
+    if last is None:
+        raise ValueError("no complete calculation in vasprun.xml")
+    return last
+
+
+def main():
+    ap = argparse.ArgumentParser(description="列出 vasprun.xml 中被选中的离子步")
+    ap.add_argument("vasprun")
+    ap.add_argument("--stride", type=int, default=1)
+    ap.add_argument("--min_de", type=float, default=None, help="每原子能量变化阈值（eV/atom）")
+    ap.add_argument("--include_last", action="store_true")
+    args = ap.parse_args()
+
+    n = 0
+    with open_binary(args.vasprun) as f:
+        try:
+            for st in iter_calculations(f, args.stride, args.min_de, args.include_last):
+                n += 1
+                vir = "-" if st["virial"] is None else f"{np.trace(st['virial']):.4f}"
+                print(f"step={st['index']:6d} natoms={len(st['symbols'])} "
+                      f"energy={st['energy']:.8f} trace(virial)={vir}")
+        except VasprunTruncated as e:
+            print(f"[WARN] {e} (complete calculations: {e.completed})")
+    print(f"# selected steps: {n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+xyz_dataset.py
+
+在 notebook 里交互查看/筛选 train.xyz 用的惰性随机访问 Dataset：
+- 打开时什么都不读；帧偏移表在第一次按下标访问时才按需向后扫描（普通 xyz），
+  分块压缩的 .gz/.zst 直接用 .fidx 索引；
+- len / 整数 / 切片 / 布尔掩码 / 下标数组索引：整数返回 ase.Atoms，其余返回共享同一文件的子 Dataset（视图）；
+- 列：energies / natoms / max_force（每帧最大力的模，eV/Å）返回 numpy 数组，
+  整个文件顺序扫描一遍后缓存，子 Dataset 直接按下标取；
+- 解码后的 Atoms 放在有界 LRU 缓存里（cache_size 帧）；只有整数索引/迭代时才构造 Atoms（也才导入 ASE）；
+  record(i) / records() 给出不经 ASE 的紧凑 FrameRecord（见 frame_record.py），适合批量处理。
+
+用法：
+  from xyz_dataset import Dataset
+  ds = Dataset("train.xyz")
+  bad = ds[ds.max_force > 30]
+  bad.write("suspicious.xyz")
+  atoms = ds[12345]
+"""
+
+import mmap
+from array import array
+from collections import OrderedDict
+from io import StringIO
+
+import numpy as np
+
+from block_xyz import codec_of, BlockXYZReader, open_xyz_writer
+from xyz_stream import open_mmap, iter_frame_spans, parse_header, find_header_value, property_columns
+
+DEFAULT_CACHE_SIZE = 256
+
+
+def force_columns(fields: dict[str, str]) -> int | None:
+    """按 Properties 找力所在的第一列（原子行按空白切分后的列号）；没有力返回 None。"""
+    cols = property_columns(fields)
+    return cols.get("forces", cols.get("force", (None, 0)))[0]
+
+
+def frame_columns(frame: bytes) -> tuple[int, float, float]:
+    """不经 ASE 从一帧原始字节取 (natoms, energy, max_force)；缺失的记 nan。"""
+    lines = frame.split(b"\n")
+    natoms = int(lines[0])
+    fields = parse_header(lines[1].decode("utf-8", "ignore"))
+    try:
+        energy = float(find_header_value(fields, "energy"))
+    except ValueError:
+        energy = float("nan")
+    c = force_columns(fields)
+    fmax = float("nan")
+    if c is not None and natoms:
+        f = np.array([ln.split()[c:c + 3] for ln in lines[2:2 + natoms]], dtype=float)
+        fmax = float(np.sqrt((f ** 2).sum(axis=1)).max())
+    return natoms, energy, fmax
+
+
+class _Store:
+    """一个文件的共享状态：惰性偏移表、列缓存、Atoms 的 LRU 缓存。"""
+
+    def __init__(self, path: str, cache_size: int):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, object] = OrderedDict()
+        self.columns: dict[str, np.ndarray] | None = None
+        self._block = None
+        self._buf = None
+        self._spans = None
+        self._starts = array("q")
+        self._ends = array("q")
+        self._complete = False
+
+    # ——— 帧定位 ———
+
+    def _open(self):
+        if codec_of(self.path):
+            if self._block is None:
+                self._block = BlockXYZReader(self.path)
+                self._complete = True
+        elif self._buf is None:
+            self._buf = open_mmap(self.path)
+            self._spans = iter_frame_spans(self._buf)
+
+    def _extend(self, upto: int | None):
+        """把偏移表扫描到至少 upto+1 帧（None：扫到文件末尾）。"""
+        self._open()
+        while not self._complete and (upto is None or len(self._starts) <= upto):
+            span = next(self._spans, None)
+            if span is None:
+                self._complete = True
+                break
+            self._starts.append(span[0])
+            self._ends.append(span[4])
+
+    def __len__(self):
+        self._extend(None)
+        return len(self._block) if self._block is not None else len(self._starts)
+
+    def frame_bytes(self, i: int) -> bytes:
+        if i < 0:
+            i += len(self)
+        self._open()
+        if self._block is not None:
+            return self._block.frame_bytes(i)
+        self._extend(i)
+        if i >= len(self._starts):
+            raise IndexError(f"frame {i} out of range ({len(self._starts)} frames)")
+        return bytes(self._buf[self._starts[i]:self._ends[i]])
+
+    def iter_frame_bytes(self):
+        self._open()
+        if self._block is not None:
+            yield from self._block.iter_frame_bytes()
+            return
+        i = 0
+        while True:
+            self._extend(i)
+            if i >= len(self._starts):
+                return
+            yield bytes(self._buf[self._starts[i]:self._ends[i]])
+            i += 1
+
+    # ——— Atoms 与列 ———
+
+    def atoms(self, i: int):
+        if i < 0:
+            i += len(self)
+        hit = self.cache.get(i)
+        if hit is not None:
+            self.cache.move_to_end(i)
+            return hit
+        from ase.io import read  # 只在真正要 Atoms 时才导入 ASE
+
+        atoms = read(StringIO(self.frame_bytes(i).decode()), format="extxyz")
+        self.cache[i] = atoms
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return atoms
+
+    def column(self, name: str) -> np.ndarray:
+        if self.columns is None:
+            natoms, energy, fmax = array("q"), array("d"), array("d")
+            for fb in self.iter_frame_bytes():
+                n, e, f = frame_columns(fb)
+                natoms.append(n)
+                energy.append(e)
+                fmax.append(f)
+            self.columns = {"natoms": np.frombuffer(natoms, dtype=np.int64),
+                            "energies": np.frombuffer(energy, dtype=np.float64),
+                            "max_force": np.frombuffer(fmax, dtype=np.float64)}
+        return self.columns[name]
+
+    def close(self):
+        if self._block is not None:
+            self._block.close()
+        if isinstance(self._buf, mmap.mmap):
+            self._spans = None
+            self._buf.close()
+
+
+class Dataset:
+    """
+    extxyz（普通或分块压缩）上的惰性随机访问视图。
+
+    ds[i] 返回 ase.Atoms（来自 LRU 缓存的同一个对象，要修改请先 .copy()）；
+    ds[切片 / 布尔掩码 / 下标数组] 返回子 Dataset，与父对象共享偏移表和缓存。
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        self._store = _Store(path, cache_size)
+        self._idx: np.ndarray | None = None  # None 表示整个文件
+
+    @classmethod
+    def _view(cls, store: _Store, idx: np.ndarray) -> "Dataset":
+        ds = cls.__new__(cls)
+        ds._store, ds._idx = store, idx
+        return ds
+
+    @property
+    def path(self) -> str:
+        return self._store.path
+
+    def __len__(self):
+        return len(self._store) if self._idx is None else len(self._idx)
+
+    def __repr__(self):
+        n = "?" if self._idx is None and not self._store._complete else len(self)
+        return f"Dataset({self.path!r}, frames={n})"
+
+    def _global(self, i: int) -> int:
+        if self._idx is None:
+            return int(i)
+        return int(self._idx[i])
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._store.atoms(self._global(key))
+        if isinstance(key, slice):
+            base = np.arange(len(self._store)) if self._idx is None else self._idx
+            return self._view(self._store, base[key])
+        key = np.asarray(key)
+        if key.dtype == bool:
+            if len(key) != len(self):
+                raise IndexError(f"boolean mask has {len(key)} entries, dataset has {len(self)} frames")
+            key = np.flatnonzero(key)
+        elif not np.issubdtype(key.dtype, np.integer):
+            raise TypeError(f"unsupported index type: {key.dtype}")
+        base = np.arange(len(self._store)) if self._idx is None else self._idx
+        return self._view(self._store, base[key])
+
+    def __iter__(self):
+        if self._idx is None:
+            for i in range(len(self)):
+                yield self._store.atoms(i)
+        else:
+            for i in self._idx:
+                yield self._store.atoms(int(i))
+
+    def indices(self) -> np.ndarray:
+        """本视图各帧在文件中的序号。"""
+        return np.arange(len(self._store)) if self._idx is None else self._idx.copy()
+
+    def frame_bytes(self, i: int) -> bytes:
+        return self._store.frame_bytes(self._global(i))
+
+    def record(self, i: int):
+        """第 i 帧的 FrameRecord（直接解析原始字节，不进 LRU 缓存）。"""
+        from frame_record import FrameRecord
+
+        return FrameRecord.from_xyz(self.frame_bytes(i))
+
+    def records(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def header(self, i: int) -> dict[str, str]:
+        """第 i 帧注释行的 key=value（原始文本，不构造 Atoms）。"""
+        fb = self.frame_bytes(i)
+        nl = fb.index(b"\n")
+        return parse_header(fb[nl + 1:fb.index(b"\n", nl + 1)].decode("utf-8", "ignore"))
+
+    def _column(self, name: str) -> np.ndarray:
+        col = self._store.column(name)
+        return col if self._idx is None else col[self._idx]
+
+    @property
+    def energies(self) -> np.ndarray:
+        return self._column("energies")
+
+    @property
+    def natoms(self) -> np.ndarray:
+        return self._column("natoms")
+
+    @property
+    def max_force(self) -> np.ndarray:
+        return self._column("max_force")
+
+    def write(self, path: str, frames_per_block: int = 256) -> int:
+        """把本视图的帧原样写到 path（.gz/.zst 写分块压缩）；返回帧数。"""
+        writer = open_xyz_writer(path, frames_per_block)
+        n = 0
+        for i in range(len(self)):
+            writer.write_frame(self.frame_bytes(i))
+            n += 1
+        writer.close()
+        return n
+
+    def close(self):
+        self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
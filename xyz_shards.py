@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+xyz_shards.py
+
+把一个数据集写成多个按帧数 / 字节数封顶的分片，加一份 manifest.json，代替单个巨大的 train.xyz：
+- 分片放在 <stem>_shards/ 下（train.xyz -> train_shards/train_00000.xyz, ...；
+  .gz/.zst 输出的分片也是分块压缩，各自带 .fidx）；
+- 封顶：--shard_frames 帧数、--shard_bytes 未压缩字节数（放不下下一帧时换新分片），两者可同时给；
+  分片边界只取决于帧序列，所以断点续写 / 重跑得到相同的分片；
+- 每个分片先写隐藏临时文件 .<name>，写完 fsync、算 sha256，再 os.replace 成正式名字，
+  不会出现写了一半的正式分片；收尾（最后一块压缩、fsync、校验和、改名）在线程池里做，
+  与下一个分片的写入并行；
+- manifest.json（原子写入）记录每个分片的文件名、帧号区间、帧数、原子数、未压缩字节数、文件大小、sha256、
+  能量/atom 的 min/max/mean、各 root 的帧数，以及生成时的参数（provenance）；
+- 需要单个文件时（GPUMD 只读一个 train.xyz）：python concat_shards.py train_shards -o train.xyz。
+
+两种用法：
+  ShardedXYZWriter  边生成边写（1218merge.py --shard_frames/--shard_bytes），sync() 的状态可用于断点续写；
+  shard_file        把已有文件切成分片（filter_E&F.py、bucket 重排之后、reduce_shards.py），
+                    普通 xyz 先一遍扫出各分片的字节区间，再由多个线程并行写各分片。
+
+用法：
+  python xyz_shards.py train.xyz --shard_frames 50000
+  python xyz_shards.py train.xyz.zst --shard_bytes 2G -j 8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from block_xyz import (codec_of, open_frame_reader, open_xyz_writer, write_json_atomic, INDEX_SUFFIX,
+                       DEFAULT_FRAMES_PER_BLOCK)
+from xyz_stream import open_mmap, iter_frame_spans
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+_ENERGY_RE = re.compile(rb'(?:^|\s)energy=("?)([^\s"]+)', re.I)
+_ROOT_RE = re.compile(rb'(?:^|\s)root=(?:"([^"]*)"|(\S*))')
+_SIZE_UNITS = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def parse_size(text: str | None) -> int | None:
+    """'2G' / '500M' / '123456' -> 字节数。"""
+    if text is None:
+        return None
+    t = str(text).strip().lower().rstrip("b")
+    if t and t[-1] in _SIZE_UNITS:
+        return int(float(t[:-1]) * _SIZE_UNITS[t[-1]])
+    return int(t)
+
+
+def split_name(path: str) -> tuple[str, str]:
+    """'train.xyz.zst' -> ('train', '.xyz.zst')，'clean.xyz' -> ('clean', '.xyz')。"""
+    base = os.path.basename(path)
+    codec_ext = ""
+    if codec_of(base):
+        base, codec_ext = os.path.splitext(base)
+    stem, ext = os.path.splitext(base)
+    return stem, ext + codec_ext
+
+
+def shard_dir_for(path: str) -> str:
+    """输出 path 对应的分片目录：与 path 同目录的 <stem>_shards。"""
+    return os.path.join(os.path.dirname(path), split_name(path)[0] + "_shards")
+
+
+def sha256_file(path: str, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(bufsize)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(path: str) -> dict:
+    """path 可以是分片目录或 manifest.json 本身。"""
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST)
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise SystemExit(f"[ERROR] unsupported manifest version in {path}")
+    manifest["directory"] = os.path.dirname(os.path.abspath(path))
+    return manifest
+
+
+# ——— 分片统计 ———
+
+def _new_entry(fname: str, first_frame: int) -> dict:
+    return {"file": fname, "first_frame": first_frame, "frames": 0, "atoms": 0, "raw_bytes": 0,
+            "energy_per_atom": {"n": 0, "min": None, "max": None, "mean": None}, "roots": {}}
+
+
+def _add_frame(entry: dict, natoms: int, comment: bytes, nbytes: int):
+    """把一帧计入分片统计（只看原子数和注释行）。"""
+    entry["frames"] += 1
+    entry["atoms"] += natoms
+    entry["raw_bytes"] += nbytes
+    m = _ENERGY_RE.search(comment)
+    if m and natoms:
+        try:
+            e = float(m.group(2)) / natoms
+        except ValueError:
+            e = None
+        if e is not None:
+            st = entry["energy_per_atom"]
+            st["n"] += 1
+            st["min"] = e if st["min"] is None else min(st["min"], e)
+            st["max"] = e if st["max"] is None else max(st["max"], e)
+            st["mean"] = e if st["mean"] is None else st["mean"] + (e - st["mean"]) / st["n"]
+    m = _ROOT_RE.search(comment)
+    root = (m.group(1) if m.group(1) is not None else m.group(2)).decode("utf-8", "replace") if m else ""
+    entry["roots"][root] = entry["roots"].get(root, 0) + 1
+
+
+def _frame_parts(data: bytes) -> tuple[int, bytes]:
+    nl1 = data.index(b"\n")
+    nl2 = data.find(b"\n", nl1 + 1)
+    return int(data[:nl1]), data[nl1 + 1:nl2 if nl2 >= 0 else len(data)]
+
+
+def _finalize(writer, tmp: str, final: str, entry: dict) -> dict:
+    """关闭临时分片，fsync、算 sha256，再连同 .fidx 一起原子改名为正式分片。"""
+    writer.close()
+    fd = os.open(tmp, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    entry["size"] = os.path.getsize(tmp)
+    entry["sha256"] = sha256_file(tmp)
+    if os.path.exists(tmp + INDEX_SUFFIX):
+        os.replace(tmp + INDEX_SUFFIX, final + INDEX_SUFFIX)
+    os.replace(tmp, final)
+    return entry
+
+
+def _remove_stale(directory: str, name: str, suffix: str, keep: int = 0, keep_tmp: str | None = None):
+    """删掉目录里序号 >= keep 的同名分片、临时分片（keep_tmp 除外）和它们的 .fidx。"""
+    pat = re.compile(rf"^\.?{re.escape(name)}_(\d+){re.escape(suffix)}(?:{re.escape(INDEX_SUFFIX)})?$")
+    for fn in os.listdir(directory):
+        m = pat.match(fn)
+        if not m:
+            continue
+        full = os.path.join(directory, fn)
+        if keep_tmp is not None and full in (keep_tmp, keep_tmp + INDEX_SUFFIX):
+            continue
+        if fn.startswith(".") or int(m.group(1)) >= keep:
+            os.remove(full)
+
+
+class ShardedXYZWriter:
+    """
+    与 open_xyz_writer 的写者接口相同（write_frame / sync / close），把帧依次写进封顶的分片。
+    sync() 等待已满分片收尾、写一份未完成的 manifest，返回可 JSON 序列化的续写状态；
+    用该状态重新构造写者即可从断点继续，分片内容与不中断时相同。
+    """
+
+    def __init__(self, directory: str, name: str, suffix: str = ".xyz", max_frames: int | None = None,
+                 max_bytes: int | None = None, frames_per_block: int = DEFAULT_FRAMES_PER_BLOCK,
+                 jobs: int = 4, meta: dict | None = None, resume_state: dict | None = None):
+        if not max_frames and not max_bytes:
+            raise ValueError("ShardedXYZWriter needs max_frames and/or max_bytes")
+        self.directory, self.name, self.suffix = directory, name, suffix
+        self.max_frames, self.max_bytes = max_frames, max_bytes
+        self.fpb = frames_per_block
+        self.meta = meta or {}
+        self.jobs = max(1, jobs)
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+        self._futures = []
+        self.shards: list[dict] = []
+        self.frames = 0
+        self._next = 0
+        self._cur = None  # (writer, tmp, final, entry)
+        os.makedirs(directory, exist_ok=True)
+        if resume_state is None:
+            _remove_stale(directory, name, suffix)
+            manifest = os.path.join(directory, MANIFEST)
+            if os.path.exists(manifest):
+                os.remove(manifest)
+        else:
+            self._resume(resume_state)
+
+    def _paths(self, k: int) -> tuple[str, str, str]:
+        fname = f"{self.name}_{k:05d}{self.suffix}"
+        return fname, os.path.join(self.directory, "." + fname), os.path.join(self.directory, fname)
+
+    def _resume(self, state: dict):
+        for e in state["shards"]:
+            path = os.path.join(self.directory, e["file"])
+            if not os.path.isfile(path) or os.path.getsize(path) != e["size"]:
+                raise SystemExit(f"[ERROR] shard {path} missing or changed since the checkpoint")
+        self.shards = [dict(e) for e in state["shards"]]
+        self.frames = state["frames"]
+        self._next = state["next"]
+        cur = state["current"]
+        keep_tmp = None
+        if cur is not None:
+            fname, tmp, final = self._paths(self._next - 1)
+            keep_tmp = tmp
+            if not os.path.exists(tmp) and os.path.exists(final):  # 检查点之后该分片已收尾改名，改回来续写
+                os.replace(final, tmp)
+                if os.path.exists(final + INDEX_SUFFIX):
+                    os.replace(final + INDEX_SUFFIX, tmp + INDEX_SUFFIX)
+            writer = open_xyz_writer(tmp, self.fpb, resume_state=cur["writer"])
+            self._cur = (writer, tmp, final, cur["entry"])
+        _remove_stale(self.directory, self.name, self.suffix, keep=len(self.shards), keep_tmp=keep_tmp)
+
+    def write_frame(self, data: bytes):
+        if (self._cur is not None and self.max_bytes and self._cur[3]["frames"]
+                and self._cur[3]["raw_bytes"] + len(data) > self.max_bytes):
+            self._close_shard()
+        if self._cur is None:
+            fname, tmp, final = self._paths(self._next)
+            self._next += 1
+            self._cur = (open_xyz_writer(tmp, self.fpb), tmp, final, _new_entry(fname, self.frames))
+        self._cur[0].write_frame(data)
+        natoms, comment = _frame_parts(data)
+        _add_frame(self._cur[3], natoms, comment, len(data))
+        self.frames += 1
+        if self.max_frames and self._cur[3]["frames"] >= self.max_frames:
+            self._close_shard()
+
+    def _close_shard(self):
+        writer, tmp, final, entry = self._cur
+        self._cur = None
+        self._futures.append(self._pool.submit(_finalize, writer, tmp, final, entry))
+        while len(self._futures) > self.jobs:  # 限制在途分片数
+            self.shards.append(self._futures.pop(0).result())
+
+    def _drain(self):
+        for f in self._futures:
+            self.shards.append(f.result())
+        self._futures = []
+
+    def sync(self) -> dict:
+        self._drain()
+        cur = None
+        if self._cur is not None:
+            cur = {"writer": self._cur[0].sync(), "entry": json.loads(json.dumps(self._cur[3]))}
+        self._write_manifest(complete=False)
+        return {"shards": [dict(e) for e in self.shards], "current": cur,
+                "frames": self.frames, "next": self._next}
+
+    def close(self) -> dict:
+        if self._cur is not None:
+            self._close_shard()
+        self._drain()
+        self._pool.shutdown()
+        return self._write_manifest(complete=True)
+
+    def _write_manifest(self, complete: bool) -> dict:
+        manifest = build_manifest(self.shards, self.name, self.suffix, self.max_frames, self.max_bytes,
+                                  self.fpb, self.meta, complete)
+        write_json_atomic(os.path.join(self.directory, MANIFEST), manifest, indent=1)
+        return manifest
+
+
+def build_manifest(shards: list[dict], name: str, suffix: str, max_frames, max_bytes, fpb: int,
+                   meta: dict, complete: bool = True) -> dict:
+    return {"version": MANIFEST_VERSION, "complete": complete, "name": name, "suffix": suffix,
+            "max_frames": max_frames, "max_bytes": max_bytes,
+            "frames_per_block": fpb if codec_of("x" + suffix) else None,
+            "frames": sum(e["frames"] for e in shards), "atoms": sum(e["atoms"] for e in shards),
+            "raw_bytes": sum(e["raw_bytes"] for e in shards), "meta": meta, "shards": shards}
+
+
+# ——— 切分已有文件 ———
+
+def _plan_plain(path: str, name: str, suffix: str, max_frames, max_bytes) -> list[tuple[dict, list]]:
+    """普通 xyz：一遍扫出每个分片的统计与帧的字节区间 [(entry, [(start, end), ...])]。"""
+    buf = open_mmap(path)
+    plan, spans, entry = [], [], None
+    frame = 0
+    try:
+        for start, natoms, cs, ats, end in iter_frame_spans(buf):
+            n = end - start
+            if entry is not None and max_bytes and entry["frames"] and entry["raw_bytes"] + n > max_bytes:
+                plan.append((entry, spans))
+                entry = None
+            if entry is None:
+                entry, spans = _new_entry(f"{name}_{len(plan):05d}{suffix}", frame), []
+            _add_frame(entry, natoms, bytes(buf[cs:ats]), n)
+            spans.append((start, end))
+            frame += 1
+            if max_frames and entry["frames"] >= max_frames:
+                plan.append((entry, spans))
+                entry = None
+        if entry is not None:
+            plan.append((entry, spans))
+    finally:
+        if not isinstance(buf, bytes):
+            buf.close()
+    return plan
+
+
+def _write_planned(task) -> dict:
+    src, directory, entry, spans, fpb = task
+    final = os.path.join(directory, entry["file"])
+    tmp = os.path.join(directory, "." + entry["file"])
+    buf = open_mmap(src)
+    try:
+        writer = open_xyz_writer(tmp, fpb)
+        if codec_of(tmp):
+            for s, e in spans:
+                writer.write_frame(buf[s:e])
+        else:  # 普通输出：分片是源文件的连续一段，整段拷贝
+            writer.write_frame(buf[spans[0][0]:spans[-1][1]])
+        return _finalize(writer, tmp, final, entry)
+    finally:
+        if not isinstance(buf, bytes):
+            buf.close()
+
+
+def shard_file(path: str, directory: str | None = None, max_frames: int | None = None,
+               max_bytes: int | None = None, frames_per_block: int = DEFAULT_FRAMES_PER_BLOCK,
+               jobs: int = 4, meta: dict | None = None, suffix: str | None = None) -> dict:
+    """把已有的 extxyz 切成分片，返回 manifest。suffix 缺省与输入相同（如 .xyz / .xyz.zst）。"""
+    if not max_frames and not max_bytes:
+        raise ValueError("shard_file needs max_frames and/or max_bytes")
+    name, in_suffix = split_name(path)
+    suffix = suffix or in_suffix
+    directory = directory or shard_dir_for(path)
+    meta = dict(meta or {}, source=os.path.abspath(path))
+    if codec_of(path):
+        writer = ShardedXYZWriter(directory, name, suffix, max_frames, max_bytes, frames_per_block, jobs, meta)
+        reader = open_frame_reader(path)
+        try:
+            for data in reader.iter_frame_bytes():
+                writer.write_frame(data)
+        finally:
+            reader.close()
+        return writer.close()
+
+    os.makedirs(directory, exist_ok=True)
+    _remove_stale(directory, name, suffix)
+    plan = _plan_plain(path, name, suffix, max_frames, max_bytes)
+    tasks = [(path, directory, entry, spans, frames_per_block) for entry, spans in plan]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as ex:
+        shards = list(ex.map(_write_planned, tasks))
+    manifest = build_manifest(shards, name, suffix, max_frames, max_bytes, frames_per_block, meta)
+    write_json_atomic(os.path.join(directory, MANIFEST), manifest, indent=1)
+    return manifest
+
+
+def main():
+    ap = argparse.ArgumentParser(description="把 extxyz 切成按帧数/字节数封顶的分片，写 manifest.json")
+    ap.add_argument("input_file", help="extxyz（可为 .gz/.zst 分块压缩）")
+    ap.add_argument("-d", "--directory", default=None, help="分片目录（默认 <stem>_shards）")
+    ap.add_argument("--shard_frames", type=int, default=None, help="每个分片最多帧数")
+    ap.add_argument("--shard_bytes", default=None, help="每个分片最多未压缩字节数（可写 500M / 2G）")
+    ap.add_argument("--suffix", default=None, help="分片后缀（默认与输入相同，例如 .xyz.zst 写压缩分片）")
+    ap.add_argument("--frames_per_block", type=int, default=DEFAULT_FRAMES_PER_BLOCK,
+                    help="压缩分片每块帧数")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="并行写分片的线程数")
+    args = ap.parse_args()
+    if not args.shard_frames and not args.shard_bytes:
+        ap.error("need --shard_frames and/or --shard_bytes")
+
+    directory = args.directory or shard_dir_for(args.input_file)
+    m = shard_file(args.input_file, directory, args.shard_frames, parse_size(args.shard_bytes),
+                   args.frames_per_block, args.jobs, suffix=args.suffix)
+    print(f"[SHARDS] {len(m['shards'])} shards, {m['frames']} frames, {m['atoms']} atoms -> "
+          f"{os.path.join(directory, MANIFEST)}")
+
+
+if __name__ == "__main__":
+    main()
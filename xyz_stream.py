@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+xyz_stream.py
+
+extxyz 的字节级工具（只用标准库，不依赖 ASE / NumPy）：
+- frame_at / iter_frame_spans：按“原子数行 + 注释行 + N 行原子”切分帧，返回字节偏移；
+- resync：从任意字节位置向后找到下一个真正的帧起点（用于多进程分块处理）；
+- chunk_ranges / parallel_map：把文件粗分成字节区间，按顺序串行或多进程处理；
+- parse_header / format_header：解析、重建注释行里的 key=value 字段（保留顺序和引号）；
+- property_columns：按 Properties 算 species / pos / forces 等属性所在的列。
+
+帧的字节区间记为 (start, comment_start, atoms_start, end)，end 为下一帧的起点。
+"""
+
+import mmap
+import os
+import re
+
+# key=value，value 可以是 "带空格的引号串" 或不含空格的 token；也允许单独的 flag
+_HEADER_TOKEN_RE = re.compile(r'([^\s=]+)(?:=("[^"]*"|\S*))?')
+DEFAULT_PROPERTIES = "species:S:1:pos:R:3"
+
+
+def open_mmap(path: str):
+    """只读 mmap 整个文件；空文件返回 b""。"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _line_end(buf, pos: int) -> int:
+    """返回 pos 所在行之后下一行的起点（文件末尾无换行时返回 len(buf)）。"""
+    nl = buf.find(b"\n", pos)
+    return len(buf) if nl < 0 else nl + 1
+
+
+def _parse_natoms(buf, pos: int):
+    """pos 行若是单个非负整数则返回 (natoms, 下一行起点)，否则 None。"""
+    nxt = _line_end(buf, pos)
+    token = bytes(buf[pos:nxt]).strip()
+    if not token.isdigit():
+        return None
+    return int(token), nxt
+
+
+def frame_at(buf, pos: int):
+    """
+    解析 pos 处的一帧，返回 (natoms, comment_start, atoms_start, end)；
+    不是合法帧（原子数行不是整数 / 原子行不够）返回 None。
+    """
+    size = len(buf)
+    if pos >= size:
+        return None
+    head = _parse_natoms(buf, pos)
+    if head is None:
+        return None
+    natoms, comment_start = head
+    if comment_start >= size:
+        return None
+    p = atoms_start = _line_end(buf, comment_start)
+    for _ in range(natoms):
+        if p >= size:
+            return None
+        p = _line_end(buf, p)
+    return natoms, comment_start, atoms_start, p
+
+
+def _is_tail(buf, pos: int) -> bool:
+    """pos 之后只剩空白（或已到文件末尾）。"""
+    size = len(buf)
+    while pos < size:
+        if bytes(buf[pos:pos + 65536]).strip():
+            return False
+        pos += 65536
+    return True
+
+
+def resync(buf, pos: int, limit: int | None = None) -> int:
+    """
+    从 pos 起（先对齐到行首）寻找第一个帧起点：该行能解析成完整一帧，
+    且帧后紧接着是另一帧的原子数行或文件末尾。找不到返回 len(buf)。
+    limit 不为 None 时，只在 [pos, limit) 内找起点。
+    """
+    size = len(buf)
+    if pos > 0 and buf[pos - 1:pos] != b"\n":
+        pos = _line_end(buf, pos)
+    stop = size if limit is None else min(limit, size)
+    while pos < stop:
+        fr = frame_at(buf, pos)
+        if fr is not None:
+            end = fr[3]
+            if end >= size or _is_tail(buf, end) or _parse_natoms(buf, end) is not None:
+                return pos
+        pos = _line_end(buf, pos)
+    return size
+
+
+def iter_frame_spans(buf, start: int = 0, stop: int | None = None):
+    """
+    从帧起点 start 开始顺序切分，产出 (start, natoms, comment_start, atoms_start, end)，
+    直到下一帧起点 >= stop（默认到文件末尾）。遇到非法帧抛 ValueError。
+    """
+    size = len(buf)
+    stop = size if stop is None else stop
+    pos = start
+    while pos < stop:
+        fr = frame_at(buf, pos)
+        if fr is None:
+            if _is_tail(buf, pos):
+                return
+            raise ValueError(f"malformed xyz frame at byte offset {pos}")
+        natoms, cs, ats, end = fr
+        yield pos, natoms, cs, ats, end
+        pos = end
+
+
+def iter_frames(path: str):
+    """逐帧产出 (natoms, comment_bytes, frame_bytes)；frame_bytes 为整帧原始字节。"""
+    buf = open_mmap(path)
+    try:
+        for start, natoms, cs, ats, end in iter_frame_spans(buf):
+            yield natoms, bytes(buf[cs:ats]), bytes(buf[start:end])
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+def count_frames(path: str) -> int:
+    buf = open_mmap(path)
+    try:
+        n = 0
+        for _ in iter_frame_spans(buf):
+            n += 1
+        return n
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+def chunk_ranges(size: int, chunk_bytes: int) -> list[tuple[int, int]]:
+    """把 [0, size) 按 chunk_bytes 粗分成字节区间；各区间的帧归属由 resync 决定。"""
+    chunk_bytes = max(1, chunk_bytes)
+    return [(s, min(s + chunk_bytes, size)) for s in range(0, size, chunk_bytes)] or [(0, 0)]
+
+
+def parallel_map(func, tasks: list, jobs: int):
+    """按顺序产出 func(task)：jobs <= 1 或只有一个任务时串行，否则用 jobs 个进程（func 须可 pickle）。"""
+    if jobs <= 1 or len(tasks) == 1:
+        yield from map(func, tasks)
+        return
+    from multiprocessing import Pool  # 延迟导入：串行路径用不到
+
+    with Pool(jobs) as pool:
+        yield from pool.imap(func, tasks)
+
+
+# ——— 注释行 key=value ———
+
+def parse_header(line: str) -> dict[str, str]:
+    """
+    解析注释行为有序 dict：key -> 原始 value 文本（保留引号；flag 的 value 为 None）。
+    例：'energy=-1.0 pbc="T T T"' -> {"energy": "-1.0", "pbc": '"T T T"'}
+    """
+    fields: dict[str, str] = {}
+    for m in _HEADER_TOKEN_RE.finditer(line):
+        fields[m.group(1)] = m.group(2)
+    return fields
+
+
+def format_header(fields: dict[str, str]) -> str:
+    """parse_header 的逆操作（不含换行）。"""
+    return " ".join(k if v is None else f"{k}={v}" for k, v in fields.items())
+
+
+def unquote(value: str | None) -> str:
+    if value is None:
+        return ""
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def quote(value: str, force: bool = False) -> str:
+    """含空白、为空或 force=True 时加双引号。"""
+    if force or value == "" or any(c.isspace() for c in value):
+        return f'"{value}"'
+    return value
+
+
+def header_value(fields: dict[str, str], key: str, default: str = "") -> str:
+    v = fields.get(key)
+    return default if v is None else unquote(v)
+
+
+def find_header_value(fields: dict[str, str], key: str, default: str = "") -> str:
+    """大小写不敏感地取字段（extxyz 里 energy / Energy、virial / Virial 都有人写）。"""
+    if key in fields:
+        return header_value(fields, key, default)
+    low = key.lower()
+    for k in fields:
+        if k.lower() == low:
+            return header_value(fields, k, default)
+    return default
+
+
+def property_columns(fields: dict[str, str], default: str = DEFAULT_PROPERTIES) -> dict[str, tuple[int, int]]:
+    """
+    按注释行的 Properties（缺省为 default）算各属性所在的列：小写名 -> (起始列, 列数)，
+    列号是原子行按空白切分后的序号；每行总列数为 max(c + n for c, n in 结果.values())。
+    例：species:S:1:pos:R:3:forces:R:3 -> {"species": (0, 1), "pos": (1, 3), "forces": (4, 3)}
+    """
+    props = find_header_value(fields, "Properties", default).split(":")
+    cols: dict[str, tuple[int, int]] = {}
+    c = 0
+    for k in range(0, len(props) - 2, 3):
+        n = int(props[k + 2])
+        cols[props[k].lower()] = (c, n)
+        c += n
+    return cols